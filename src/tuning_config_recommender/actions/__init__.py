@@ -1,10 +1,11 @@
 from .actions import IR, Action, Comment, PatchLevel, PatchType
 from .compute import ApplyComputeConfig
-from .data import ApplyChatFormat, ApplyQAFormat
+from .data import ApplyChatFormat, ApplyPaddingStrategy, ApplyQAFormat
 from .defaults import ApplyDefaults
 from .train import (
     ApplyDistributedTraining,
     ApplyFastKernelsOptimization,
+    ApplyGlobalBatchSize,
     ApplyGradientCheckpointing,
     ApplyLoRAConfig,
     ApplyMoEOptimization,
@@ -22,6 +23,8 @@ ACTIONS = [
     ApplyLoRAConfig,
     ApplyMoEOptimization,
     ApplyOptimalBatchSize,
+    ApplyGlobalBatchSize,
     ApplyChatFormat,
     ApplyQAFormat,
+    ApplyPaddingStrategy,
 ]
@@ -1,5 +1,39 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
 from loguru import logger
 
+from tuning_config_recommender.constants import (
+    DEFAULT_COMPUTE_CANDIDATE_SHAPES,
+    DEFAULT_GPU_MODEL,
+    DEFAULT_MEMORY_SAFETY_MARGIN,
+    GPU_TYPE_RANKINGS,
+)
+from tuning_config_recommender.metrics import (
+    ESTIMATOR_FALLBACKS,
+    STAGE_SECONDS,
+    cache_lookup,
+    record_miss,
+)
+from tuning_config_recommender.utils.isolation import (
+    CircuitBreaker,
+    ProcessIsolatedRunner,
+)
+from tuning_config_recommender.utils.memory_estimator import (
+    estimate_throughput,
+    gpu_memory_bytes,
+    max_batch_size_that_fits,
+)
+from tuning_config_recommender.utils.model_facts import get_model_facts
+from tuning_config_recommender.utils.single_flight import SingleFlight
+from tuning_config_recommender.utils.tuning_config import (
+    use_kb_for_batch_size,
+    use_kb_for_throughput,
+)
+
 from .actions import IR, Action, Comment, PatchLevel, PatchType
 
 try:
@@ -16,15 +50,234 @@ except ImportError:
     )
 
 
-class ApplyComputeConfig(Action):
-    _recommender: "MinGpuRecommenderCaller" = None
+_RECOMMENDER: "MinGpuRecommenderCaller" = None
+_RECOMMENDER_LOCK = threading.Lock()
+RECOMMENDER_CACHE_SIZE = 1024
+
+
+def get_min_gpu_recommender() -> "MinGpuRecommenderCaller":
+    """Process wide min gpu recommender, created on first use"""
+    global _RECOMMENDER
+    with _RECOMMENDER_LOCK:
+        if _RECOMMENDER is None:
+            logger.debug("No recommender instance set.. creating one")
+            _RECOMMENDER = MinGpuRecommenderCaller()
+        return _RECOMMENDER
+
+
+def _normalize_configuration(configuration: dict) -> tuple:
+    return (
+        ("model_name", str(configuration["model_name"]).strip()),
+        ("method", str(configuration["method"]).strip().lower()),
+        ("gpu_model", str(configuration["gpu_model"]).strip()),
+        ("tokens_per_sample", int(configuration["tokens_per_sample"])),
+        ("batch_size", int(configuration["batch_size"])),
+        ("gpus_per_worker", int(configuration["gpus_per_worker"])),
+        ("model_version", str(configuration["model_version"]).strip()),
+    )
+
+
+# "process" runs the estimator in worker processes with a timeout,
+# "inline" runs it in the calling thread
+ESTIMATOR_ISOLATION = os.environ.get("TCR_ESTIMATOR_ISOLATION", "process")
+_RUNNER: ProcessIsolatedRunner = None
+
+
+def _init_estimator_worker(factory=None):
+    global _RECOMMENDER
+    _RECOMMENDER = factory() if factory else None
+    get_min_gpu_recommender()
+
+
+def _recommend(configuration: tuple) -> tuple:
+    result = get_min_gpu_recommender().run(dict(configuration), "min_gpu")
+    return tuple(result.items())
+
+
+def get_estimator_runner() -> ProcessIsolatedRunner:
+    """Process pool running the min gpu recommender, created on first use"""
+    global _RUNNER
+    with _RECOMMENDER_LOCK:
+        if _RUNNER is None:
+            _RUNNER = ProcessIsolatedRunner(
+                initializer=_init_estimator_worker,
+                timeout=float(os.environ.get("TCR_ESTIMATOR_TIMEOUT", 30)),
+                startup_timeout=float(
+                    os.environ.get("TCR_ESTIMATOR_STARTUP_TIMEOUT", 300)
+                ),
+                max_workers=int(os.environ.get("TCR_ESTIMATOR_WORKERS", 2)),
+                breaker=CircuitBreaker(
+                    failure_threshold=int(
+                        os.environ.get("TCR_ESTIMATOR_FAILURE_THRESHOLD", 3)
+                    ),
+                    cooldown=float(os.environ.get("TCR_ESTIMATOR_COOLDOWN", 60)),
+                ),
+            )
+        return _RUNNER
+
+
+def warm_up_estimator():
+    """Create the min gpu recommender, or start its worker processes, ahead of
+    the first request"""
+    if skip_autoconf:
+        return
+    if ESTIMATOR_ISOLATION == "inline":
+        get_min_gpu_recommender()
+    else:
+        get_estimator_runner().start()
+
+
+# concurrent requests missing the cache for the same configuration share a call
+_ESTIMATOR_FLIGHT = SingleFlight()
+
+
+@lru_cache(maxsize=RECOMMENDER_CACHE_SIZE)
+def _run_min_gpu_recommender(configuration: tuple) -> tuple:
+    # failed calls raise and are therefore not cached
+    record_miss()
+    if ESTIMATOR_ISOLATION == "inline":
+        return _recommend(configuration)
+    return get_estimator_runner().call(_recommend, configuration)
+
+
+def run_min_gpu_recommender(configuration: dict) -> dict:
+    """Min gpu recommendation for the configuration, memoized across requests
+
+    Args:
+        configuration (dict): model_name, method, gpu_model, tokens_per_sample,
+            batch_size, gpus_per_worker and model_version
+
+    Returns:
+        dict: workers and gpus_per_worker, -1 when no recommendation is possible
+    """
+    configuration = _normalize_configuration(configuration)
+    with cache_lookup("estimator"):
+        return dict(
+            _ESTIMATOR_FLIGHT.do(configuration, _run_min_gpu_recommender, configuration)
+        )
+
+
+def evaluate_candidates(
+    candidates: list[dict], configurations: list[dict]
+) -> list[dict]:
+    """Query the recommender for all candidate shapes concurrently
+
+    The regressor has no batched interface so candidates are evaluated in
+    parallel threads, each going through the memoized recommender. Candidates
+    with the same configuration are evaluated once, as the recommender returns
+    the number of workers it needs a candidate is only feasible with at most
+    its num_nodes workers.
+
+    Args:
+        candidates (list[dict]): shapes with num_nodes and num_gpus_per_node
+        configurations (list[dict]): recommender configuration for each candidate
+
+    Returns:
+        list[dict]: feasibility curve, the candidate shape with feasible, the
+        recommended workers and gpus_per_worker and the error if the
+        recommender failed
+    """
+
+    def _evaluate(configuration):
+        try:
+            return run_min_gpu_recommender(configuration), None
+        except Exception as e:
+            logger.warning(f"Min gpu recommender failed for {configuration}: {e!r}")
+            return {}, e
+
+    if not configurations:
+        return []
+    unique = {_normalize_configuration(c): c for c in configurations}
+    # more threads than estimator workers would only wait for a worker
+    max_workers = len(unique)
+    if ESTIMATOR_ISOLATION != "inline":
+        max_workers = min(max_workers, get_estimator_runner().max_workers)
+    with (
+        STAGE_SECONDS.time(stage="estimator"),
+        ThreadPoolExecutor(max_workers=max_workers) as executor,
+    ):
+        results = dict(
+            zip(unique, executor.map(_evaluate, unique.values()), strict=True)
+        )
+    curve = []
+    for candidate, configuration in zip(candidates, configurations, strict=True):
+        res, error = results[_normalize_configuration(configuration)]
+        feasible = (
+            res.get("gpus_per_worker", -1) != -1
+            and res.get("workers", -1) <= candidate["num_nodes"]
+        )
+        if not feasible and error is None:
+            logger.debug(
+                f"Recommender was not able to issue recommender for {configuration}"
+            )
+        curve.append(
+            {
+                "num_nodes": candidate["num_nodes"],
+                "num_gpus_per_node": candidate["num_gpus_per_node"],
+                "feasible": feasible,
+                "workers": res.get("workers", -1),
+                "gpus_per_worker": res.get("gpus_per_worker", -1),
+                "error": error,
+            }
+        )
+    return curve
 
-    def __init__(self):
-        if not skip_autoconf:
-            if self._recommender is None:
-                logger.debug("No recommender instance set.. creating one")
-                self._recommender = MinGpuRecommenderCaller()
 
+def _fallback_shape(ir: IR, candidates: list[dict], gpu_model: str):
+    """Smallest candidate shape from the KB or the analytic memory model
+
+    Returns:
+        tuple: (num_nodes, num_gpus_per_node, source) or None
+    """
+    tuning_strategy = ir.tuning_config.get("tuning_strategy", "full")
+    max_seq_length = int(ir.tuning_config.get("max_seq_length", 2048))
+    totals = np.array([c["num_nodes"] * c["num_gpus_per_node"] for c in candidates])
+    try:
+        kb_result = use_kb_for_batch_size(
+            {
+                "model_name_or_path": ir.tuning_config["model_name_or_path"],
+                "tuning_strategy": tuning_strategy,
+                "max_seq_length": max_seq_length,
+            }
+        )
+    except Exception as e:
+        logger.debug(f"KB lookup for compute fallback failed: {e!r}")
+        kb_result = {}
+    if (kb_result or {}).get("number_gpus", None):
+        index = np.flatnonzero(totals >= int(kb_result["number_gpus"]))
+        if index.size:
+            c = candidates[index[0]]
+            ESTIMATOR_FALLBACKS.inc(source="knowledge_base")
+            return c["num_nodes"], c["num_gpus_per_node"], "the knowledge base"
+    try:
+        fits = max_batch_size_that_fits(
+            get_model_facts(ir.tuning_config["model_name_or_path"]).config,
+            gpu_memory_bytes({"gpu_model": gpu_model}),
+            float(
+                ir.tuning_config.get(
+                    "memory_safety_margin", DEFAULT_MEMORY_SAFETY_MARGIN
+                )
+            ),
+            tuning_strategy=tuning_strategy,
+            seq_len=max_seq_length,
+            sharding_degree=totals,
+            sharding_strategy="FULL_SHARD",
+            dtype=ir.tuning_config.get("torch_dtype", "bfloat16"),
+        )
+    except (OSError, ValueError) as e:
+        logger.debug(f"Analytic compute fallback failed: {e!r}")
+        ESTIMATOR_FALLBACKS.inc(source="none")
+        return None
+    index = np.flatnonzero(np.asarray(fits) >= 1)
+    if not index.size:
+        ESTIMATOR_FALLBACKS.inc(source="none")
+        return None
+    c = candidates[index[0]]
+    ESTIMATOR_FALLBACKS.inc(source="analytic_memory_model")
+    return c["num_nodes"], c["num_gpus_per_node"], "the analytic memory estimate"
+
+
+class ApplyComputeConfig(Action):
     def heuristic_skip(self, ir):
         return skip_autoconf
 
@@ -54,6 +307,173 @@ class ApplyComputeConfig(Action):
 
         return r_name
 
+    def _min_gpu_shape(
+        self, ir: IR, r_model_name: str, r_gpu: str, candidates: list[dict]
+    ) -> tuple[tuple[int, int] | None, str]:
+        """Smallest shape of r_gpu GPUs among candidates the training fits in
+
+        Returns:
+            tuple: (num_nodes, num_gpus_per_node) or None, and a comment
+            describing how it was obtained
+        """
+        # Check if tuning method is enabled, if not go for full
+        r_method = ir.tuning_config.get("tuning_strategy", "full")
+
+        # set batch size - this is tricky because we get the per-device batch size from IR
+        # while the recommender model uses batch size across gpus.
+        # Current solution - test every candidate shape and pick the smallest one that we get
+        # recommendation for. The recommender takes no worker count, so shapes are
+        # queried per node and the workers it returns decide multi node shapes
+        r_max_seq_length = ir.tuning_config.get("max_seq_length", 2048)
+        r_batch_size = ir.tuning_config.get(
+            "per_device_train_batch_size",
+            ir.tuning_config.get("per_device_batch_size", 1),
+        )
+        configurations = [
+            {
+                "model_name": r_model_name,
+                "method": r_method,
+                "gpu_model": r_gpu,
+                "tokens_per_sample": r_max_seq_length,
+                "batch_size": r_batch_size * candidate["num_gpus_per_node"],
+                "gpus_per_worker": candidate["num_gpus_per_node"],
+                "model_version": "2.0.0",
+            }
+            for candidate in candidates
+        ]
+        feasibility_curve = evaluate_candidates(candidates, configurations)
+        errors = [c["error"] for c in feasibility_curve if c["error"] is not None]
+        if errors:
+            # a failed smaller candidate may have been feasible, so the curve
+            # cannot be trusted and the estimator is not used at all
+            fallback = _fallback_shape(ir, candidates, r_gpu)
+            if fallback:
+                return fallback[:2], (
+                    f"Min gpu estimator was unavailable ({errors[0]!r}), "
+                    f"compute config is a fallback based on {fallback[2]}"
+                )
+            return None, (
+                f"Min gpu estimator was unavailable ({errors[0]!r}), "
+                "compute config is left unchanged"
+            )
+        comment = "Feasibility of candidate shapes (nodes x gpus per node): " + (
+            ", ".join(
+                f"{c['num_nodes']}x{c['num_gpus_per_node']} "
+                + (
+                    f"feasible as {c['workers']}x{c['gpus_per_worker']}"
+                    if c["feasible"]
+                    else "infeasible"
+                )
+                for c in feasibility_curve
+            )
+        )
+        feasible = [c for c in feasibility_curve if c["feasible"]]
+        if not feasible:
+            return None, comment
+        logger.debug(
+            f"recommender returned configuration workers:{feasible[0]['workers']} "
+            f"gpus:{feasible[0]['gpus_per_worker']}"
+        )
+        return (feasible[0]["workers"], feasible[0]["gpus_per_worker"]), comment
+
+    def _predict_throughput(
+        self, ir: IR, gpu_type: dict, num_gpus: int
+    ) -> tuple[float | None, float | None, str]:
+        """Predicted tokens per second and dollars per million tokens of
+        num_gpus GPUs of gpu_type, from the KB or else the analytic model"""
+        model_name_or_path = ir.tuning_config["model_name_or_path"]
+        tuning_strategy = ir.tuning_config.get("tuning_strategy", "full")
+        kb_run = use_kb_for_throughput(
+            model_name_or_path,
+            tuning_strategy,
+            int(ir.tuning_config.get("max_seq_length", 2048)),
+            gpu_type["gpu_model"],
+        )
+        dollars_per_million_tokens = None
+        if kb_run:
+            # throughput is assumed to scale linearly with the number of GPUs
+            tokens_per_second = (
+                kb_run["dataset_tokens_per_second"] / kb_run["number_gpus"] * num_gpus
+            )
+            dollars_per_million_tokens = kb_run["dollars_per_million_tokens"]
+            source = "knowledge base"
+        else:
+            try:
+                tokens_per_second = float(
+                    estimate_throughput(
+                        get_model_facts(model_name_or_path).config,
+                        tuning_strategy,
+                        num_gpus,
+                        gpu_type["gpu_model"],
+                    )
+                )
+            except (OSError, ValueError) as e:
+                logger.debug(f"Analytic throughput estimate failed: {e!r}")
+                return None, None, "unknown"
+            source = "analytic estimate"
+        if gpu_type.get("price_per_gpu_hour", None) is not None:
+            dollars_per_million_tokens = (
+                float(gpu_type["price_per_gpu_hour"])
+                * num_gpus
+                * 1e6
+                / (tokens_per_second * 3600)
+            )
+        return tokens_per_second, dollars_per_million_tokens, source
+
+    def _rank_gpu_types(
+        self, ir: IR, r_model_name: str, candidates: list[dict]
+    ) -> list[dict]:
+        """Min gpu shape, throughput and cost of every GPU type in compute config
+        gpu_types ranked by compute config rank_by (throughput or cost)"""
+        ranking = []
+        for gpu_type in ir.compute_config["gpu_types"]:
+            gpus_per_node = int(gpu_type.get("num_gpus_per_node", 8))
+            count = int(gpu_type.get("count", 0) or 0)
+            type_candidates = [
+                c
+                for c in candidates
+                if c["num_gpus_per_node"] <= gpus_per_node
+                and (not count or c["num_nodes"] * c["num_gpus_per_node"] <= count)
+            ]
+            shape, comment = self._min_gpu_shape(
+                ir, r_model_name, gpu_type["gpu_model"], type_candidates
+            )
+            entry = {
+                "gpu_model": gpu_type["gpu_model"],
+                "shape": shape,
+                "comment": comment,
+                "tokens_per_second": None,
+                "dollars_per_million_tokens": None,
+                "source": None,
+            }
+            if shape:
+                (
+                    entry["tokens_per_second"],
+                    entry["dollars_per_million_tokens"],
+                    entry["source"],
+                ) = self._predict_throughput(ir, gpu_type, shape[0] * shape[1])
+            ranking.append(entry)
+
+        rank_by = ir.compute_config.get("rank_by", "throughput")
+        if rank_by not in GPU_TYPE_RANKINGS:
+            raise ValueError(
+                f"rank_by should be one of {GPU_TYPE_RANKINGS}, got {rank_by}"
+            )
+
+        def _key(entry):
+            throughput = entry["tokens_per_second"] or 0.0
+            cost = entry["dollars_per_million_tokens"]
+            if rank_by == "cost":
+                return (
+                    entry["shape"] is None,
+                    cost is None,
+                    cost or 0.0,
+                    -throughput,
+                )
+            return (entry["shape"] is None, -throughput, cost or 0.0)
+
+        return sorted(ranking, key=_key)
+
     def apply(self, ir: IR, actions_meta: list[str]) -> IR:
         if "skip_estimator" in actions_meta:
             self.skip = True
@@ -78,60 +498,62 @@ class ApplyComputeConfig(Action):
         # Find a valid mapping for the model name
         r_model_name = self._infer_model_name(r_model_name)
 
-        # Check if tuning method is enabled, if not go for full
-        r_method = ir.tuning_config.get("tuning_strategy", "full")
-
-        # set GPU model - for now we assume it's for Vela
-        # TODO: obtain some information from the environment to determine which
-        # cluster, GPU, etc. are being targeted
-        r_gpu = "NVIDIA-A100-SXM4-80GB"
-
-        # set batch size - this is tricky because we get the per-device batch size from IR
-        # while the recommender model uses batch size across gpus.
-        # Current solution - test every #GPU in 1,2,4,8 and pick the smallest one that we get
-        # recommendation for
-        r_max_seq_length = ir.tuning_config.get("max_seq_length", 2048)
-        r_batch_size = ir.tuning_config.get("per_device_batch_size", 1)
-
-        for r_num_gpu in [1, 2, 4, 8]:
-            configuration = {
-                "model_name": r_model_name,
-                "method": r_method,
-                "gpu_model": r_gpu,  # Assume it's Vela
-                "tokens_per_sample": r_max_seq_length,
-                "batch_size": r_batch_size * r_num_gpu,
-                "gpus_per_worker": r_num_gpu,
-                "model_version": "2.0.0",
-            }
-            logger.debug(
-                f"Sending this configuration to min gpu recommender: {configuration}"
-            )
-            res = self._recommender.run(configuration, "min_gpu")
-            if res["gpus_per_worker"] == -1:
-                logger.debug(
-                    f"Recommender was not able to issue recommender for {configuration}"
-                )
-                continue
-            else:
-                num_gpus_per_node = res["gpus_per_worker"]
-                num_nodes = res["workers"]
-                logger.debug(
-                    f"recommender returned configuration workers:{num_nodes} gpus:{num_gpus_per_node}"
+        candidates = sorted(
+            ir.compute_config.get("candidate_shapes", None)
+            or DEFAULT_COMPUTE_CANDIDATE_SHAPES,
+            key=lambda c: (c["num_nodes"] * c["num_gpus_per_node"], c["num_nodes"]),
+        )
+        compute_config = {}
+        if ir.compute_config.get("gpu_types", None):
+            ranking = self._rank_gpu_types(ir, r_model_name, candidates)
+            comment = Comment(
+                "GPU types ranked by "
+                f"{ir.compute_config.get('rank_by', 'throughput')}: "
+                + "; ".join(
+                    f"{i}. {e['gpu_model']} "
+                    + (
+                        f"{e['shape'][0]}x{e['shape'][1]}"
+                        + (
+                            f" ~{e['tokens_per_second']:.0f} tokens/s"
+                            if e["tokens_per_second"]
+                            else ""
+                        )
+                        + (
+                            f" ${e['dollars_per_million_tokens']:.2f} per million tokens"
+                            if e["dollars_per_million_tokens"] is not None
+                            else ""
+                        )
+                        + (f" ({e['source']})" if e["source"] else "")
+                        if e["shape"]
+                        else "infeasible"
+                    )
+                    for i, e in enumerate(ranking, start=1)
                 )
-                break
+            )
+            top = ranking[0]
+            comment.add(f"{top['gpu_model']}: {top['comment']}")
+            if top["shape"]:
+                num_nodes, num_gpus_per_node = top["shape"]
+                compute_config["gpu_model"] = top["gpu_model"]
+        else:
+            # when the GPU type is not given we assume it's for Vela
+            r_gpu = ir.compute_config.get("gpu_model", DEFAULT_GPU_MODEL)
+            shape, comment = self._min_gpu_shape(ir, r_model_name, r_gpu, candidates)
+            comment = Comment(comment)
+            if shape:
+                num_nodes, num_gpus_per_node = shape
 
+        if num_nodes == 1 and num_gpus_per_node == 8:
+            comment.add("compute config for single node configuration")
         return_ir = IR(
             compute_config={
                 "num_nodes": num_nodes,
                 "num_gpus_per_node": num_gpus_per_node,
+                **compute_config,
             },
             type=PatchType.COMPATIBILITY,
             level=PatchLevel.SUGGESTION,
-            comment=Comment(
-                "compute config for single node configuration"
-                if (num_nodes == 1 and num_gpus_per_node == 8)
-                else ""
-            ),
+            comment=comment,
         )
         self.json_merge_patches.append(return_ir)
         self.skip = True
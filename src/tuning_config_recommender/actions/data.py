@@ -1,3 +1,5 @@
+from loguru import logger
+
 from tuning_config_recommender.utils.data_config import (
     determine_input_and_response_text,
     fetch_chat_template,
@@ -5,7 +7,11 @@ from tuning_config_recommender.utils.data_config import (
 )
 from tuning_config_recommender.utils.data_processing import (
     escape_newlines_in_strings,
-    load_training_data,
+    load_first_record,
+)
+from tuning_config_recommender.utils.padding_estimator import (
+    estimate_padding_modes,
+    probe_dataset,
 )
 
 from .actions import IR, Action, Comment, PatchLevel, PatchType
@@ -18,13 +24,11 @@ class ApplyDataFormat(Action):
         )
 
     def _is_data_tokenized(self, path):
-        data = load_training_data(path)
-        if not data or not isinstance(data, list):
-            return False
-        if not isinstance(data[0], dict):
+        data = load_first_record(path)
+        if not data:
             return False
         tokenized_fields = {"input_ids", "labels", "attention_mask"}
-        return any(field in data[0] for field in tokenized_fields)
+        return any(field in data for field in tokenized_fields)
 
     def heuristic_skip(self, ir):
         if ir.tuning_config.get(
@@ -58,9 +62,7 @@ class ApplyDataFormat(Action):
 
 class ApplyQAFormat(ApplyDataFormat):
     def _is_data_in_required_format(self, dataset_path: str) -> bool:
-        data = load_training_data(dataset_path)
-        if isinstance(data, list) and len(data) > 0:
-            data = data[0]
+        data = load_first_record(dataset_path) or {}
         COMMON_INPUT_KEYS = [
             "input",
             "instruction",
@@ -172,10 +174,8 @@ class ApplyChatFormat(ApplyDataFormat):
     CHAT_STYLE_KEYS = ["messages", "conversations", "dialogues", "chat", "turns"]
 
     def _is_data_in_required_format(self, dataset_path: str) -> bool:
-        data = load_training_data(dataset_path)
-        columns = data[0].keys()
-        if isinstance(data, list) and len(data) > 0:
-            data = data[0]
+        data = load_first_record(dataset_path) or {}
+        columns = data.keys()
         if has_any_key_containing(data, self.CHAT_STYLE_KEYS):
             for chat_key in self.CHAT_STYLE_KEYS:
                 if chat_key in columns:
@@ -205,8 +205,7 @@ class ApplyChatFormat(ApplyDataFormat):
         if chat_template:
             chat_template = escape_newlines_in_strings(chat_template)
             chat_template = "{% raw %}\n  " + chat_template + "\n  {% endraw %}"
-        data = load_training_data(dataset_path)
-        columns = data[0].keys()
+        columns = load_first_record(dataset_path).keys()
         for chat_key in self.CHAT_STYLE_KEYS:
             if chat_key in columns:
                 conversation_column_name = chat_key
@@ -277,3 +276,84 @@ class ApplyChatFormat(ApplyDataFormat):
         self.json_merge_patches.append(ir)
         self.skip = True
         return ir
+
+
+class ApplyPaddingStrategy(Action):
+    # packing changes the number of samples per step, so it is only
+    # recommended when it is clearly faster than padding free
+    MIN_PACKING_GAIN = 1.05
+
+    def _data_paths(self, ir: IR) -> list[str]:
+        if ir.tuning_data_config.get("datasets", None):
+            return [
+                path
+                for dataset in ir.tuning_data_config["datasets"]
+                for path in dataset.get("data_paths", [])
+            ]
+        if ir.tuning_config.get("training_data_path", None):
+            return [ir.tuning_config["training_data_path"]]
+        return []
+
+    def apply(self, ir: IR, actions_meta: list[str]) -> IR:
+        if self.heuristic_skip(ir) or self.skip:
+            self.skip = True
+            return
+        max_seq_length = int(ir.tuning_config.get("max_seq_length", 2048))
+        per_device_batch_size = int(
+            ir.tuning_config.get("per_device_train_batch_size", 1) or 1
+        )
+        num_samples, lengths = 0, []
+        for path in self._data_paths(ir):
+            try:
+                probe = probe_dataset(path)
+            except Exception as e:
+                logger.warning(f"Could not sample {path} for padding estimates: {e}")
+                continue
+            if probe:
+                num_samples += probe["num_samples"]
+                lengths.extend(probe["lengths"])
+        if num_samples:
+            modes = estimate_padding_modes(
+                lengths,
+                max_seq_length,
+                per_device_batch_size,
+            )
+            mode = "padding_free"
+            if (
+                modes["packing"]["relative_throughput"]
+                > modes["padding_free"]["relative_throughput"] * self.MIN_PACKING_GAIN
+            ):
+                mode = "packing"
+            comment = Comment(
+                f"Estimated from {num_samples} samples at max_seq_length "
+                f"{max_seq_length} and {per_device_batch_size} samples per device: "
+                + ", ".join(
+                    f"{m} {v['padding_fraction']:.0%} padding and "
+                    f"{v['relative_throughput']:.2f}x throughput"
+                    for m, v in modes.items()
+                )
+                + f". {mode} is expected to be "
+                f"{modes[mode]['relative_throughput']:.2f}x as fast as padding."
+            )
+            if mode == "packing":
+                comment.add(
+                    "Packing puts more samples in each step, consider reducing "
+                    "the number of steps or the learning rate accordingly."
+                )
+        else:
+            mode = "padding_free"
+            comment = Comment(
+                "padding_free with flash_attention provides throughput boost and memory savings."
+            )
+        tuning_config = {"padding_free": "huggingface"}
+        if mode == "packing":
+            tuning_config = {"packing": "True"}
+        return_ir = IR(
+            tuning_config=tuning_config,
+            type=PatchType.SYSTEM_PERFORMANCE,
+            level=PatchLevel.SUGGESTION,
+            comment=comment,
+        )
+        self.json_merge_patches.append(return_ir)
+        self.skip = True
+        return return_ir
@@ -1,11 +1,22 @@
 import math
 
 from tuning_config_recommender.constants import (
+    DEFAULT_GPU_MODEL,
+    DEFAULT_MEMORY_SAFETY_MARGIN,
     DEFAULT_NUM_GPUS_PER_NODE,
     DEFAULT_NUM_NODES,
 )
+from tuning_config_recommender.utils.batch_solver import solve_global_batch
+from tuning_config_recommender.utils.memory_estimator import (
+    estimate_throughput,
+    gpu_memory_bytes,
+    max_batch_size_that_fits,
+)
+from tuning_config_recommender.utils.model_facts import get_model_facts
+from tuning_config_recommender.utils.strategy_selector import (
+    select_distributed_strategy,
+)
 from tuning_config_recommender.utils.tuning_config import (
-    get_model_config,
     is_model_type_moe,
     use_kb_for_batch_size,
 )
@@ -13,12 +24,123 @@ from tuning_config_recommender.utils.tuning_config import (
 from .actions import IR, Action, Comment, PatchLevel, PatchType
 
 
+def _sharding_from_ir(ir: IR) -> tuple[str, int, bool]:
+    """Sharding strategy, sharding degree and param offload as set in the IR"""
+    num_nodes = int(ir.compute_config.get("num_nodes", DEFAULT_NUM_NODES))
+    num_gpus_per_node = int(
+        ir.compute_config.get("num_gpus_per_node", DEFAULT_NUM_GPUS_PER_NODE)
+    )
+    distributed_type = ir.accelerate_config.get("distributed_type", "FSDP")
+    if distributed_type != "FSDP":
+        return "NO_SHARD", 1, False
+    fsdp_config = ir.accelerate_config.get("fsdp_config", {}) or {}
+    strategy = fsdp_config.get("fsdp_sharding_strategy", "FULL_SHARD")
+    degree = num_gpus_per_node
+    if strategy != "HYBRID_SHARD":
+        degree = num_nodes * num_gpus_per_node
+    return strategy, degree, bool(fsdp_config.get("fsdp_offload_params", False))
+
+
+def _memory_estimate_kwargs(ir: IR, **overrides) -> dict:
+    """Arguments to memory_estimator functions for the configuration in the IR"""
+    strategy, degree, offload = _sharding_from_ir(ir)
+    kwargs = {
+        "tuning_strategy": ir.tuning_config.get("tuning_strategy", "full"),
+        "per_device_batch_size": int(
+            ir.tuning_config.get("per_device_train_batch_size", 1) or 1
+        ),
+        "seq_len": int(ir.tuning_config.get("max_seq_length", 2048)),
+        "sharding_degree": degree,
+        "sharding_strategy": strategy,
+        "dtype": ir.tuning_config.get("torch_dtype", "bfloat16"),
+        "gradient_checkpointing": ir.tuning_config.get("gradient_checkpointing", True)
+        in (True, "True", "true"),
+        "lora_r": int(ir.tuning_config.get("r", 8)),
+        "offload_params": offload,
+    }
+    kwargs.update(overrides)
+    return kwargs
+
+
+def _memory_budget(ir: IR) -> float:
+    margin = float(
+        ir.tuning_config.get("memory_safety_margin", DEFAULT_MEMORY_SAFETY_MARGIN)
+    )
+    return gpu_memory_bytes(ir.compute_config) * (1 - margin)
+
+
 class ApplyDistributedTraining(Action):
+    def _select_strategy(self, ir: IR, num_nodes: int, num_gpus_per_node: int):
+        """Strategy from the memory model, None when the model shape is unknown"""
+        kwargs = _memory_estimate_kwargs(ir)
+        try:
+            return select_distributed_strategy(
+                get_model_facts(ir.tuning_config["model_name_or_path"]).config,
+                num_nodes,
+                num_gpus_per_node,
+                _memory_budget(ir),
+                seq_len=kwargs["seq_len"],
+                tuning_strategy=kwargs["tuning_strategy"],
+                dtype=kwargs["dtype"],
+                gradient_checkpointing=kwargs["gradient_checkpointing"],
+                lora_r=kwargs["lora_r"],
+            )
+        except ValueError:
+            # config.json does not describe the model shape
+            return None
+
+    @staticmethod
+    def _strategy_comment(selection: dict, num_processes: int) -> Comment:
+        strategy = selection["strategy"]
+        batch = selection["per_device_batch_size"]
+        rejected = ", ".join(
+            f"{name} needs {gib} GiB" for name, gib in selection["rejected"].items()
+        )
+        if strategy == "DDP" and num_processes == 1:
+            comment = Comment(
+                f"Training fits on a single GPU ({selection['memory_gib']} GiB at "
+                f"batch size {batch}), no distributed strategy is needed."
+            )
+        elif strategy == "DDP":
+            comment = Comment(
+                f"DDP is used since a full replica of the model fits on every GPU "
+                f"({selection['memory_gib']} GiB at batch size {batch}), it avoids "
+                "the parameter gathering of FSDP."
+            )
+        else:
+            comment = Comment(
+                f"{strategy} is the fastest strategy that fits batch size {batch} "
+                f"per GPU ({selection['memory_gib']} GiB per GPU)."
+            )
+        if rejected:
+            comment.add(f"Faster strategies do not fit: {rejected} per GPU.")
+        if not selection["fits"]:
+            comment.add(
+                "Training is estimated not to fit even with CPU offload, "
+                "reduce max_seq_length or use more GPUs."
+            )
+        elif selection["fsdp_offload_params"]:
+            comment.add(
+                "Parameters and optimizer states are offloaded to CPU, "
+                "expect lower throughput."
+            )
+        if strategy != "DDP":
+            if selection["fsdp_forward_prefetch"]:
+                comment.add(
+                    f"{selection['headroom_gib']} GiB left per GPU allow prefetching "
+                    "the next layer in forward and backward."
+                )
+            elif selection["fsdp_backward_prefetch"] == "BACKWARD_POST":
+                comment.add(
+                    "BACKWARD_POST prefetch is used since less than a layer of memory "
+                    "is left per GPU."
+                )
+        return comment
+
     def apply(self, ir: IR, actions_meta: list[str]) -> IR:
         if self.heuristic_skip(ir) or self.skip:
             self.skip = True
             return
-        comment = Comment()
 
         num_nodes = int(ir.compute_config.get("num_nodes", DEFAULT_NUM_NODES))
         num_gpus_per_node = int(
@@ -26,46 +148,66 @@ class ApplyDistributedTraining(Action):
         )
         num_processes = num_nodes * num_gpus_per_node
 
-        fsdp_sharding_strategy = "FULL_SHARD"
-        if ir.compute_config.get("num_nodes", None):
-            if int(ir.compute_config.get("num_nodes")) > 1:
-                fsdp_sharding_strategy = "HYBRID_SHARD"
+        selection = self._select_strategy(ir, num_nodes, num_gpus_per_node)
+        if selection:
+            comment = self._strategy_comment(selection, num_processes)
+        else:
+            comment = Comment()
+            selection = {
+                "strategy": "FULL_SHARD",
+                "distributed_type": "FSDP",
+                "fsdp_sharding_strategy": "FULL_SHARD",
+                "fsdp_offload_params": False,
+                "fsdp_backward_prefetch": "BACKWARD_PRE",
+                "fsdp_forward_prefetch": False,
+            }
+            if num_nodes > 1:
+                selection["fsdp_sharding_strategy"] = "HYBRID_SHARD"
                 comment.add(
-                    f"fsdp_sharding_strategy as {fsdp_sharding_strategy}"
-                    "improves throughput reducing inter-node communication."
+                    "fsdp_sharding_strategy as HYBRID_SHARD "
+                    "improves throughput reducing inter-node communication. "
                     "However use FULL_SHARD if you hit OOM."
                 )
 
-        fsdp_state_dict_type = "FULL_STATE_DICT"
-        if is_model_type_moe(ir.tuning_config.get("model_name_or_path")):
-            fsdp_state_dict_type = "SHARDED_STATE_DICT"
-            comment.add("SHARDED_STATE_DICT is needed for compatibility")
-
         data = {
             "num_processes": num_processes,
             "compute_environment": "LOCAL_MACHINE",
-            "distributed_type": "FSDP",
-            "fsdp_config": {
+            "distributed_type": selection["distributed_type"],
+        }
+        if selection["distributed_type"] == "FSDP":
+            fsdp_state_dict_type = "FULL_STATE_DICT"
+            if is_model_type_moe(ir.tuning_config.get("model_name_or_path")):
+                fsdp_state_dict_type = "SHARDED_STATE_DICT"
+                comment.add("SHARDED_STATE_DICT is needed for compatibility")
+            data["fsdp_config"] = {
                 "fsdp_auto_wrap_policy": "TRANSFORMER_BASED_WRAP",
-                "fsdp_backward_prefetch": "BACKWARD_PRE",
-                "fsdp_backward_prefetch_policy": "BACKWARD_PRE",
-                "fsdp_forward_prefetch": False,
-                "fsdp_offload_params": False,
-                "fsdp_sharding_strategy": fsdp_sharding_strategy,
+                "fsdp_backward_prefetch": selection["fsdp_backward_prefetch"],
+                "fsdp_backward_prefetch_policy": selection["fsdp_backward_prefetch"],
+                "fsdp_forward_prefetch": selection["fsdp_forward_prefetch"],
+                "fsdp_offload_params": selection["fsdp_offload_params"],
+                "fsdp_sharding_strategy": selection["fsdp_sharding_strategy"],
                 "fsdp_state_dict_type": fsdp_state_dict_type,
                 "fsdp_cpu_ram_efficient_loading": True,
                 "fsdp_sync_module_states": True,
-            },
-            "machine_rank": "${RANK}",
-            "num_machines": "${WORLD_SIZE}",
-            "rdzv_backend": "static",
-            "same_network": True,
-            "main_process_ip": "${MASTER_ADDR}",
-            "main_process_port": "${MASTER_PORT}",
-        }
+            }
+        else:
+            # an fsdp_config of the input or an earlier action would survive
+            # the merge and contradict the distributed_type
+            data["fsdp_config"] = None
+        data.update(
+            {
+                "machine_rank": "${RANK}",
+                "num_machines": "${WORLD_SIZE}",
+                "rdzv_backend": "static",
+                "same_network": True,
+                "main_process_ip": "${MASTER_ADDR}",
+                "main_process_port": "${MASTER_PORT}",
+            }
+        )
         ir = IR(
             accelerate_config=data,
             type=PatchType.COMPATIBILITY,
+            effect=[PatchType.COMPATIBILITY, PatchType.SYSTEM_PERFORMANCE],
             level=PatchLevel.MANDATORY,
             comment=comment,
         )
@@ -89,6 +231,8 @@ class ApplyGradientCheckpointing(Action):
             gradient_checkpointing = False
             gradient_checkpointing_kwargs = None
             comment.add("Gradient checkpointing is not supported for ALoRA.")
+        # whether checkpointing pays off depends on the batch size it allows,
+        # ApplyOptimalBatchSize turns it off once the batch size is known
         ir = IR(
             tuning_config={
                 "gradient_checkpointing": gradient_checkpointing,
@@ -141,10 +285,7 @@ class ApplyLoRAConfig(Action):
 
 class ApplyMoEOptimization(Action):
     def _get_num_experts(self, model_name_or_path: str) -> int:
-        config = get_model_config(model_name_or_path)
-        num_local_experts = config.get("num_local_experts", None)
-        num_experts = config.get("num_experts", None)
-        return num_local_experts or num_experts
+        return get_model_facts(model_name_or_path).num_experts
 
     def heuristic_skip(self, ir):
         if self._get_num_experts(ir.tuning_config.get("model_name_or_path")):
@@ -177,6 +318,65 @@ class ApplyMoEOptimization(Action):
 
 
 class ApplyOptimalBatchSize(Action):
+    @staticmethod
+    def _choose_gradient_checkpointing(
+        ir: IR,
+        model_config: dict,
+        max_fitting_batch_size: dict,
+        output_dict: dict,
+        checkpointing_supported: bool,
+        comment: Comment,
+    ) -> dict:
+        """Keep gradient checkpointing only when the larger batch it allows
+        gives a higher estimated throughput than training without it.
+
+        Updates the batch size in output_dict and returns the tuning config
+        keys to patch.
+        """
+        batch_size = output_dict.get("per_device_train_batch_size", 1)
+        # KB runs are measured with gradient checkpointing
+        without = min(batch_size, max_fitting_batch_size[False])
+        if not checkpointing_supported:
+            if without and without < batch_size:
+                output_dict["per_device_train_batch_size"] = without
+                comment.add(
+                    "Batch size is reduced to fit in GPU memory without gradient "
+                    "checkpointing."
+                )
+            return {}
+        if not without:
+            return {}
+        seq_len = int(output_dict.get("model_max_length", 2048))
+        tokens_per_second = {
+            checkpointing: float(
+                estimate_throughput(
+                    model_config,
+                    ir.tuning_config.get("tuning_strategy", "full"),
+                    1,
+                    ir.compute_config.get("gpu_model", DEFAULT_GPU_MODEL),
+                    tokens_per_device=size * seq_len,
+                    gradient_checkpointing=checkpointing,
+                )
+            )
+            for checkpointing, size in ((True, batch_size), (False, without))
+        }
+        if tokens_per_second[True] > tokens_per_second[False]:
+            comment.add(
+                f"Gradient checkpointing is kept, batch size {batch_size} with it "
+                f"is estimated at {tokens_per_second[True]:.0f} tokens/sec per GPU "
+                f"against {tokens_per_second[False]:.0f} at batch size {without} "
+                "without it."
+            )
+            return {}
+        output_dict["per_device_train_batch_size"] = without
+        comment.add(
+            f"Gradient checkpointing is turned off, batch size {without} without "
+            f"recomputation is estimated at {tokens_per_second[False]:.0f} "
+            f"tokens/sec per GPU against {tokens_per_second[True]:.0f} at batch "
+            f"size {batch_size} with it."
+        )
+        return {"gradient_checkpointing": False, "gradient_checkpointing_kwargs": None}
+
     def apply(self, ir: IR, actions_meta: list[str]) -> IR:
         if self.heuristic_skip(ir) or self.skip:
             self.skip = True
@@ -186,14 +386,102 @@ class ApplyOptimalBatchSize(Action):
             "model_name_or_path": ir.tuning_config["model_name_or_path"],
             "tuning_strategy": ir.tuning_config["tuning_strategy"],
             "max_seq_length": ir.tuning_config.get("max_seq_length", 2048),
+            "objective": ir.tuning_config.get("batch_size_objective", None),
+            "memory_safety_margin": ir.tuning_config.get(
+                "memory_safety_margin", DEFAULT_MEMORY_SAFETY_MARGIN
+            ),
         }
         output_dict = use_kb_for_batch_size(input_dict)
+        comment = Comment(
+            "per_device_train_batch_size is modified to best use the GPU resources and not hit OOM."
+        )
+        checkpointing_supported = "alora" not in input_dict["tuning_strategy"]
+        try:
+            model_config = get_model_facts(
+                ir.tuning_config["model_name_or_path"]
+            ).config
+            max_fitting_batch_size = {
+                checkpointing: max_batch_size_that_fits(
+                    model_config,
+                    gpu_memory_bytes(ir.compute_config),
+                    float(input_dict["memory_safety_margin"]),
+                    **_memory_estimate_kwargs(
+                        ir,
+                        seq_len=input_dict["max_seq_length"],
+                        gradient_checkpointing=checkpointing,
+                    ),
+                )
+                for checkpointing in (True, False)
+            }
+        except ValueError:
+            model_config, max_fitting_batch_size = None, {}
+        if not output_dict and max_fitting_batch_size.get(checkpointing_supported):
+            output_dict = {
+                "per_device_train_batch_size": max_fitting_batch_size[
+                    checkpointing_supported
+                ],
+                "model_max_length": input_dict["max_seq_length"],
+            }
+            comment.add(
+                "Model is not in the knowledge base, batch size is the largest one "
+                "estimated to fit in GPU memory."
+            )
+        checkpointing_patch = {}
+        if max_fitting_batch_size:
+            checkpointing_patch = self._choose_gradient_checkpointing(
+                ir,
+                model_config,
+                max_fitting_batch_size,
+                output_dict,
+                checkpointing_supported,
+                comment,
+            )
+        if output_dict.get("neighbours"):
+            neighbours = ", ".join(
+                f"{n['model_name']} (bs={n['per_device_train_batch_size']}, seq={n['model_max_length']})"
+                for n in output_dict["neighbours"]
+            )
+            comment.add(
+                "Model is not in the knowledge base, batch size is interpolated from "
+                f"runs of architecturally similar models: {neighbours}"
+            )
+        objective = input_dict["objective"]
+        if objective and output_dict.get("selected_by") == objective:
+            comment.add(
+                f"Picked the KB run optimizing {objective} which used "
+                f"{output_dict['number_gpus']} GPUs and reached "
+                f"{output_dict.get('dataset_tokens_per_second', 'unknown')} tokens/sec "
+                f"at {output_dict.get('dollars_per_million_tokens', 'unknown')} dollars per million tokens."
+            )
+            if output_dict["model_max_length"] != input_dict["max_seq_length"]:
+                comment.add(
+                    f"The KB has no runs at {input_dict['max_seq_length']} tokens, "
+                    f"the run is at the nearest smaller length of "
+                    f"{output_dict['model_max_length']}."
+                )
+        elif objective:
+            if output_dict.get("neighbours"):
+                fallback = "the batch size interpolated from similar models is used"
+            elif "number_gpus" in output_dict:
+                fallback = (
+                    "the first KB run at the closest sequence length is used, "
+                    "regardless of the objective"
+                )
+            else:
+                fallback = "the batch size estimated to fit in memory is used"
+            comment.add(
+                f"No KB run of the model could be picked by the {objective} "
+                f"objective, {fallback} instead."
+            )
         return_ir = IR(
             tuning_config={
                 "per_device_train_batch_size": output_dict.get(
                     "per_device_train_batch_size", 1
                 ),
-                "max_seq_length": output_dict.get("model_max_length", 2048),
+                "max_seq_length": output_dict.get(
+                    "model_max_length", input_dict["max_seq_length"]
+                ),
+                **checkpointing_patch,
             },
             type=PatchType.COMPATIBILITY,
             effect=[
@@ -202,9 +490,84 @@ class ApplyOptimalBatchSize(Action):
                 PatchType.COMPATIBILITY,
             ],
             level=PatchLevel.SUGGESTION,
-            comment=Comment(
-                "per_device_train_batch_size is modified to best use the GPU resources and not hit OOM."
+            comment=comment,
+        )
+        self.json_merge_patches.append(return_ir)
+        self.skip = True
+        return return_ir
+
+
+class ApplyGlobalBatchSize(Action):
+    def heuristic_skip(self, ir):
+        return not (
+            ir.tuning_config.get("target_global_batch_size", None)
+            or ir.tuning_config.get("target_global_batch_tokens", None)
+        )
+
+    def apply(self, ir: IR, actions_meta: list[str]) -> IR:
+        if self.heuristic_skip(ir) or self.skip:
+            self.skip = True
+            return
+        num_processes = int(
+            ir.compute_config.get("num_nodes", DEFAULT_NUM_NODES)
+        ) * int(ir.compute_config.get("num_gpus_per_node", DEFAULT_NUM_GPUS_PER_NODE))
+        seq_len = int(ir.tuning_config.get("max_seq_length", 2048))
+        max_per_device_batch_size = int(
+            ir.tuning_config.get("per_device_train_batch_size", 1) or 1
+        )
+        try:
+            max_per_device_batch_size = max(
+                max_batch_size_that_fits(
+                    get_model_facts(ir.tuning_config["model_name_or_path"]).config,
+                    gpu_memory_bytes(ir.compute_config),
+                    float(
+                        ir.tuning_config.get(
+                            "memory_safety_margin", DEFAULT_MEMORY_SAFETY_MARGIN
+                        )
+                    ),
+                    **_memory_estimate_kwargs(ir, seq_len=seq_len),
+                ),
+                1,
+            )
+        except ValueError:
+            pass
+        solution = solve_global_batch(
+            num_processes,
+            max_per_device_batch_size,
+            target_global_batch_size=ir.tuning_config.get(
+                "target_global_batch_size", None
+            ),
+            target_global_batch_tokens=ir.tuning_config.get(
+                "target_global_batch_tokens", None
             ),
+            seq_len=seq_len,
+        )
+        reached = solution["global_batch_size"]
+        target = solution["target_global_batch_size"]
+        if reached == target:
+            outcome = "hits the target exactly."
+        else:
+            outcome = (
+                f"gets closest to the target of {target} samples, which cannot be "
+                f"split evenly across {num_processes} processes: off by "
+                f"{reached - target:+d} samples ({solution['relative_error']:.1%})."
+            )
+        comment = Comment(
+            f"Global batch of {reached} samples ({reached * seq_len} tokens) = "
+            f"{solution['per_device_train_batch_size']} per device x "
+            f"{solution['gradient_accumulation_steps']} accumulation steps x "
+            f"{num_processes} processes, per device batch is the largest one that "
+            f"fits in memory (up to {max_per_device_batch_size}) and {outcome}"
+        )
+        return_ir = IR(
+            tuning_config={
+                "per_device_train_batch_size": solution["per_device_train_batch_size"],
+                "gradient_accumulation_steps": solution["gradient_accumulation_steps"],
+            },
+            type=PatchType.MODEL_QUALITY,
+            effect=[PatchType.MODEL_QUALITY, PatchType.SYSTEM_PERFORMANCE],
+            level=PatchLevel.SUGGESTION,
+            comment=comment,
         )
         self.json_merge_patches.append(return_ir)
         self.skip = True
@@ -224,8 +587,8 @@ class ApplyFastKernelsOptimization(Action):
     ]
 
     def heuristic_skip(self, ir):
-        config = get_model_config(ir.tuning_config["model_name_or_path"])
-        if config.get("architectures", [""])[0] in self.supported_model_archs:
+        facts = get_model_facts(ir.tuning_config["model_name_or_path"])
+        if facts.architecture in self.supported_model_archs:
             return False
         return True
 
@@ -256,11 +619,11 @@ class ApplyTrainingOptimization(Action):
         # TODO: fast kernels are not supported for some optimizer classes
         # we should either edit this or skip this optimization
         return_ir = IR(
-            tuning_config={"padding_free": "huggingface", "use_flash_attn": True},
+            tuning_config={"use_flash_attn": True},
             type=PatchType.SYSTEM_PERFORMANCE,
             level=PatchLevel.SUGGESTION,
             comment=Comment(
-                "padding_free with flash_attention provides throughput boost and memory savings."
+                "flash_attention provides throughput boost and memory savings."
             ),
         )
         self.json_merge_patches.append(return_ir)
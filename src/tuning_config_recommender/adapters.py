@@ -1,17 +1,30 @@
-import json
+import time
 from copy import deepcopy
 from pathlib import Path
 
 from loguru import logger
 
 from tuning_config_recommender.actions import IR
+from tuning_config_recommender.constants import (
+    RECOMMENDER_ONLY_COMPUTE_KEYS,
+    RECOMMENDER_ONLY_TUNING_KEYS,
+)
+from tuning_config_recommender.metrics import STAGE_SECONDS
 from tuning_config_recommender.rule_engine import RuleEngine
+from tuning_config_recommender.sweep import SweepEngine
 from tuning_config_recommender.utils.adapter_utils import (
     build_launch_command,
+    dump_yaml,
     prepare_ir_for_accelerate,
-    write_yaml_preserving_templates,
 )
 from tuning_config_recommender.utils.data_processing import get_model_path
+from tuning_config_recommender.utils.helper import exhaust
+from tuning_config_recommender.utils.serialization import (
+    INCLUDE_OPTIONS,
+    check_include,
+    serialize_patches,
+    to_jsonable,
+)
 
 
 class Adapter:
@@ -19,6 +32,12 @@ class Adapter:
         pass
 
 
+def _stage_event(stage: str, start: float) -> dict:
+    seconds = time.perf_counter() - start
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    return {"event": "stage", "stage": stage, "seconds": seconds}
+
+
 class VanillaAdapter(Adapter):
     def execute(
         self,
@@ -28,8 +47,70 @@ class VanillaAdapter(Adapter):
         data_config,
         unique_tag,
         skip_estimator=None,
+        sweep_top_k=0,
+        include=INCLUDE_OPTIONS,
+    ):
+        return exhaust(
+            self.iter_execute(
+                tuning_config,
+                compute_config,
+                accelerate_config,
+                data_config,
+                unique_tag,
+                skip_estimator,
+                sweep_top_k,
+                include,
+            )
+        )
+
+    def iter_execute(
+        self,
+        tuning_config,
+        compute_config,
+        accelerate_config,
+        data_config,
+        unique_tag,
+        skip_estimator=None,
+        sweep_top_k=0,
+        include=INCLUDE_OPTIONS,
+    ):
+        """execute yielding progress events, see RuleEngine.iter_run_all_actions
+        for the action events. Stage events have event "stage", the stage name
+        and the seconds it took. Returns what execute returns: the IR and the
+        patches, and the sweep candidates third when sweep_top_k is set.
+
+        include lists the optional parts of the result to keep, see
+        INCLUDE_OPTIONS. Source IRs are only copied when they are included.
+        """
+        ir, patches, sweep = yield from self._iter_recommend(
+            tuning_config,
+            compute_config,
+            accelerate_config,
+            data_config,
+            unique_tag,
+            skip_estimator,
+            sweep_top_k,
+            include,
+        )
+        if sweep_top_k:
+            return ir, patches, sweep
+        return ir, patches
+
+    def _iter_recommend(
+        self,
+        tuning_config,
+        compute_config,
+        accelerate_config,
+        data_config,
+        unique_tag,
+        skip_estimator,
+        sweep_top_k,
+        include,
     ):
-        re = RuleEngine()
+        """iter_execute returning the IR, the patches and the sweep candidates,
+        None without sweep_top_k"""
+        include = check_include(include)
+        re = RuleEngine(keep_source_irs="source_irs" in include)
         re.register_all_inbuilt_actions()
         if hasattr(self, "additional_actions") and self.additional_actions:
             logger.info("Registering additional actions")
@@ -38,9 +119,11 @@ class VanillaAdapter(Adapter):
         if skip_estimator:
             re.add_to_actions_meta("skip_estimator")
         model_name_or_path = tuning_config["model_name_or_path"]
+        start = time.perf_counter()
         local_model_name_or_path = get_model_path(
             model_name_or_path, unique_tag=unique_tag
         )
+        yield _stage_event("resolve_model", start)
         tuning_config["model_name_or_path"] = local_model_name_or_path
         tuning_config["original_model_name_or_path"] = model_name_or_path
         if "tuning_strategy" not in tuning_config:
@@ -54,17 +137,50 @@ class VanillaAdapter(Adapter):
             accelerate_config=accelerate_config,
             tuning_data_config=data_config,
         )
-        ir_to_apply, json_patches = re.apply(ir=deepcopy(ir))
-        ir_to_apply.tuning_config.pop("tuning_strategy")
-        return ir_to_apply, json_patches
+        start = time.perf_counter()
+        ir_to_apply, json_patches = yield from re.iter_apply(ir=deepcopy(ir))
+        yield _stage_event("rule_engine", start)
+        sweep = None
+        if sweep_top_k:
+            start = time.perf_counter()
+            sweep = SweepEngine().sweep(ir_to_apply, top_k=sweep_top_k)
+            yield _stage_event("sweep", start)
+        for key in RECOMMENDER_ONLY_TUNING_KEYS:
+            ir_to_apply.tuning_config.pop(key, None)
+        for key in RECOMMENDER_ONLY_COMPUTE_KEYS:
+            ir_to_apply.compute_config.pop(key, None)
+        return ir_to_apply, json_patches, sweep
 
 
 class FMSAdapter(VanillaAdapter):
-    def __init__(self, base_dir: str | Path = "out/fms_final", additional_actions=None):
+    """Writes the recommended configs as YAML files under base_dir, or with
+    output_mode memory returns them as strings in artifacts of the result
+    without touching the disk."""
+
+    output_modes = ["disk", "memory"]
+    # order of the files in paths
+    sections = [
+        "tuning_config",
+        "compute_config",
+        "accelerate_config",
+        "tuning_data_config",
+    ]
+
+    def __init__(
+        self,
+        base_dir: str | Path = "out/fms_final",
+        additional_actions=None,
+        output_mode: str = "disk",
+    ):
+        if output_mode not in self.output_modes:
+            raise ValueError(
+                f"output_mode should be one of {self.output_modes}, got {output_mode}"
+            )
         self.base_dir = Path(base_dir)
         if not additional_actions:
             additional_actions = []
         self.additional_actions = additional_actions
+        self.output_mode = output_mode
 
     def _populate_data_config(self, data_paths: list[str]):
         # NOTE: The assumption is all the data paths are uniform
@@ -101,7 +217,37 @@ class FMSAdapter(VanillaAdapter):
         unique_tag,
         paths,
         skip_estimator=None,
+        sweep_top_k=0,
+        include=INCLUDE_OPTIONS,
     ):
+        return exhaust(
+            self.iter_execute(
+                tuning_config,
+                compute_config,
+                accelerate_config,
+                data_config,
+                unique_tag,
+                paths,
+                skip_estimator,
+                sweep_top_k,
+                include,
+            )
+        )
+
+    def iter_execute(
+        self,
+        tuning_config,
+        compute_config,
+        accelerate_config,
+        data_config,
+        unique_tag,
+        paths,
+        skip_estimator=None,
+        sweep_top_k=0,
+        include=INCLUDE_OPTIONS,
+    ):
+        """execute yielding the progress events of VanillaAdapter.iter_execute
+        and a render stage for the config files"""
         if not data_config and not tuning_config.get("training_data_path", None):
             # "paths" = {
             #     "chat_data": "",
@@ -113,73 +259,68 @@ class FMSAdapter(VanillaAdapter):
                     data_paths.append(path)
             data_config = self._populate_data_config(data_paths)
         data_config = self._resolve_data_paths_in_data_config(data_config)
-        ir, patches = super().execute(
+        ir, patches, sweep = yield from self._iter_recommend(
             tuning_config,
             compute_config,
             accelerate_config,
             data_config,
             unique_tag,
             skip_estimator,
+            sweep_top_k,
+            include,
         )
 
+        start = time.perf_counter()
         ir = ir.to_dict()
-        target_dir = (self.base_dir / unique_tag).resolve()
-        target_dir.mkdir(parents=True, exist_ok=True)
-
         orig = ir["tuning_config"].pop("original_model_name_or_path", None)
         if orig:
             ir["tuning_config"]["model_name_or_path"] = orig
 
         ir_clean, dynamic_args = prepare_ir_for_accelerate(ir)
-        data_path = target_dir / "tuning_data_config.yaml"
-        write_yaml_preserving_templates(
-            ir_clean.get("tuning_data_config", {}), data_path
-        )
-
-        accel_path = target_dir / "accelerate_config.yaml"
-        write_yaml_preserving_templates(
-            ir_clean.get("accelerate_config", {}), accel_path
-        )
-
-        tuning_config_path = target_dir / "tuning_config.yaml"
-        compute_config_path = target_dir / "compute_config.yaml"
-        write_yaml_preserving_templates(
-            ir_clean.get("tuning_config", {}), tuning_config_path
-        )
-        write_yaml_preserving_templates(
-            ir_clean.get("compute_config", {}), compute_config_path
-        )
-        launch_cmd = build_launch_command(ir_clean, data_path, accel_path, dynamic_args)
-        serializable_patches = []
-        for patch in patches:
-            serializable_patches.append(
-                {"json_patch": patch["json_patch"], "comment": str(patch["comment"])}
-            )
-        return json.loads(
-            json.dumps(
-                {
-                    "launch_command": launch_cmd,
-                    "paths": {
-                        "tuning_config": str(tuning_config_path),
-                        "compute_config": str(compute_config_path),
-                        "accelerate_config": str(accel_path),
-                        "tuning_data_config": str(data_path),
-                    },
-                    "dict_payload": {
-                        "step_config_section": {
-                            "tuning_data_config": ir_clean.get(
-                                "tuning_data_config", {}
-                            ),
-                            "tuning_config": ir_clean.get("tuning_config", {}),
-                            "compute_config": ir_clean.get("compute_config", {}),
-                            "acceleration_config": ir_clean.get(
-                                "accelerate_config", {}
-                            ),
-                        }
-                    },
-                    "patches": patches,
-                    "serializable_patches": serializable_patches,
-                },
-                default=str,
-            )
+        # converted once for the YAML files and the result
+        ir_clean = to_jsonable(ir_clean)
+        artifacts = {
+            f"{section}.yaml": dump_yaml(ir_clean.get(section, {}))
+            for section in self.sections
+        }
+        yield _stage_event("render", start)
+        if self.output_mode == "memory":
+            # bare names, the launch command refers to the files by them so
+            # callers saving artifacts elsewhere substitute their location
+            paths = {name.removesuffix(".yaml"): name for name in artifacts}
+        else:
+            start = time.perf_counter()
+            target_dir = (self.base_dir / unique_tag).resolve()
+            target_dir.mkdir(parents=True, exist_ok=True)
+            paths = {}
+            for name, content in artifacts.items():
+                path = target_dir / name
+                path.write_text(content, encoding="utf-8")
+                paths[name.removesuffix(".yaml")] = str(path)
+            yield _stage_event("write_files", start)
+        launch_cmd = build_launch_command(
+            ir_clean,
+            paths["tuning_data_config"],
+            paths["accelerate_config"],
+            dynamic_args,
         )
+        result = {
+            "launch_command": launch_cmd,
+            "paths": paths,
+            "dict_payload": {
+                "step_config_section": {
+                    "tuning_data_config": ir_clean.get("tuning_data_config", {}),
+                    "tuning_config": ir_clean.get("tuning_config", {}),
+                    "compute_config": ir_clean.get("compute_config", {}),
+                    "acceleration_config": ir_clean.get("accelerate_config", {}),
+                }
+            },
+            "serializable_patches": serialize_patches(patches, include=()),
+        }
+        if "patches" in include:
+            result["patches"] = serialize_patches(patches, include)
+        if sweep_top_k:
+            result["sweep"] = to_jsonable(sweep)
+        if self.output_mode == "memory":
+            result["artifacts"] = artifacts
+        return result
@@ -1,21 +1,230 @@
 import asyncio
+import multiprocessing
 import os
+import queue
+import re
+import threading
+import time
 import uuid
-from datetime import UTC, datetime, timezone
-from pathlib import Path
+from contextlib import asynccontextmanager
 from typing import Optional
 
 import yaml
-from fastapi import BackgroundTasks, FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from loguru import logger
 from pydantic import BaseModel
 
 from tuning_config_recommender.adapters import FMSAdapter
+from tuning_config_recommender.artifacts import ArtifactStore
+from tuning_config_recommender.cache_backends import get_cache_backend
+from tuning_config_recommender.jobs import (
+    FINISHED_STATUSES,
+    InMemoryJobStore,
+    JobStore,
+    SQLiteJobStore,
+)
+from tuning_config_recommender.metrics import (
+    CACHE_LOOKUPS,
+    IN_FLIGHT_REQUESTS,
+    QUEUE_DEPTH,
+    REGISTRY,
+    REQUEST_SECONDS,
+)
+from tuning_config_recommender.utils.helper import canonical_hash, exhaust
+from tuning_config_recommender.utils.isolation import BoundedWorkerPool, PoolFullError
+from tuning_config_recommender.utils.serialization import dumps, to_jsonable
+from tuning_config_recommender.utils.single_flight import AsyncSingleFlight
+from tuning_config_recommender.warmup import warm_up, warmup_models
+
+# process runs the pipeline in spawned worker processes, thread in the server
+PIPELINE_EXECUTOR = os.environ.get("TCR_PIPELINE_EXECUTOR", "process")
+_POOL: BoundedWorkerPool = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pipeline_pool() -> BoundedWorkerPool:
+    """Worker pool running recommendations, created on first use"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = BoundedWorkerPool(
+                max_concurrency=int(os.environ.get("TCR_MAX_CONCURRENCY", 4)),
+                max_queue=int(os.environ.get("TCR_MAX_QUEUE", 16)),
+                kind=PIPELINE_EXECUTOR,
+            )
+        return _POOL
+
+
+def _queue_depth() -> int:
+    if _POOL is None:
+        return 0
+    return max(_POOL.pending - _POOL.max_concurrency, 0)
+
+
+QUEUE_DEPTH.set_function(_queue_depth)
+
+
+def _run_with_metrics(fn, *args):
+    # runs in a worker process, its metrics go back to the server with the
+    # result. Metrics of failed calls stay in the worker until its next result.
+    return fn(*args), REGISTRY.drain()
+
+
+async def run_on_pool(fn, *args):
+    """Run fn(*args) on the pipeline pool, metrics recorded in worker processes
+    are merged into the metrics of the server"""
+    pool = get_pipeline_pool()
+    if pool.kind == "thread":
+        return await pool.run(fn, *args)
+    result, samples = await pool.run(_run_with_metrics, fn, *args)
+    REGISTRY.merge(samples)
+    return result
+
+
+_JOB_STORE: JobStore = None
+
+
+def get_job_store() -> JobStore:
+    """Job store given by TCR_JOB_STORE, memory or the path of a SQLite file"""
+    global _JOB_STORE
+    with _POOL_LOCK:
+        if _JOB_STORE is None:
+            location = os.environ.get("TCR_JOB_STORE", "memory")
+            ttl = float(os.environ.get("TCR_JOB_TTL", 24 * 3600))
+            if location == "memory":
+                _JOB_STORE = InMemoryJobStore(ttl=ttl)
+            else:
+                _JOB_STORE = SQLiteJobStore(location, ttl=ttl)
+        return _JOB_STORE
+
+
+_ARTIFACT_STORE: ArtifactStore = None
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Store of generated config files served under /artifacts"""
+    global _ARTIFACT_STORE
+    with _POOL_LOCK:
+        if _ARTIFACT_STORE is None:
+            _ARTIFACT_STORE = ArtifactStore(
+                ttl=float(os.environ.get("TCR_ARTIFACT_TTL", 600)),
+                max_bytes=int(
+                    os.environ.get("TCR_ARTIFACT_MAX_BYTES", 64 * 1024 * 1024)
+                ),
+            )
+        return _ARTIFACT_STORE
+
+
+_EVENT_MANAGER = None
+
+
+def _event_queue():
+    """Queue for the progress events of a streamed recommendation, proxied by a
+    manager process when the pipeline runs in worker processes"""
+    global _EVENT_MANAGER
+    if get_pipeline_pool().kind == "thread":
+        return queue.Queue()
+    with _POOL_LOCK:
+        if _EVENT_MANAGER is None:
+            _EVENT_MANAGER = multiprocessing.get_context("spawn").Manager()
+        return _EVENT_MANAGER.Queue()
+
+
+async def sweep_artifacts(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        get_artifact_store().sweep()
+
+
+async def warm_up_workers(app: FastAPI):
+    """Warm up every worker of the pipeline pool, /readyz reports ready once done
+
+    A failed warm up is retried TCR_WARMUP_RETRIES times (default 3) waiting
+    TCR_WARMUP_BACKOFF seconds (default 5) doubled on every retry. Once the
+    retries are used up the server is reported ready in a degraded state, the
+    workers then load what they need on their first requests.
+    """
+    pool = get_pipeline_pool()
+    models = warmup_models()
+    retries = int(os.environ.get("TCR_WARMUP_RETRIES", 3))
+    backoff = float(os.environ.get("TCR_WARMUP_BACKOFF", 5))
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        try:
+            # one call per worker, busy workers make the pool start the next one
+            results = await asyncio.gather(
+                *[run_on_pool(warm_up, models) for _ in range(pool.max_concurrency)]
+            )
+            break
+        except Exception as e:
+            error = repr(e)
+            if attempt == retries:
+                logger.error(
+                    f"Warm up failed {attempt + 1} times, last with {error}. "
+                    "Reporting ready in a degraded state, workers warm up on "
+                    "their first requests"
+                )
+                app.state.warmup = {
+                    "status": "degraded",
+                    "attempts": attempt + 1,
+                    "error": error,
+                }
+                return
+            delay = backoff * 2**attempt
+            logger.warning(f"Warm up failed with {error}, retrying in {delay}s")
+            app.state.warmup = {
+                "status": "warming_up",
+                "attempts": attempt + 1,
+                "error": error,
+            }
+            await asyncio.sleep(delay)
+    app.state.warmup = {
+        "status": "ready",
+        "seconds": time.perf_counter() - start,
+        "failed_models": sorted({m for r in results for m in r["failed_models"]}),
+    }
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # jobs beyond the limit wait in the queue of the semaphore
+    app.state.job_slots = asyncio.Semaphore(
+        int(os.environ.get("TCR_JOB_CONCURRENCY", 2))
+    )
+    app.state.jobs = {}
+    # batch items leave part of the pool to single requests
+    app.state.batch_slots = asyncio.Semaphore(
+        int(
+            os.environ.get(
+                "TCR_BATCH_CONCURRENCY",
+                max(int(os.environ.get("TCR_MAX_CONCURRENCY", 4)) // 2, 1),
+            )
+        )
+    )
+    app.state.background = {
+        asyncio.create_task(
+            sweep_artifacts(float(os.environ.get("TCR_ARTIFACT_SWEEP_INTERVAL", 60)))
+        )
+    }
+    if os.environ.get("TCR_WARMUP", "true").lower() in ("true", "1"):
+        app.state.warmup = {"status": "warming_up"}
+        app.state.background.add(asyncio.create_task(warm_up_workers(app)))
+    else:
+        app.state.warmup = {"status": "ready"}
+    yield
+    for task in [*app.state.jobs.values(), *app.state.background]:
+        task.cancel()
+    if _POOL is not None:
+        _POOL.shutdown()
+    if _EVENT_MANAGER is not None:
+        _EVENT_MANAGER.shutdown()
+    get_cache_backend().close()
 
-app = FastAPI(title="Recommender API")
+
+app = FastAPI(title="Recommender API", lifespan=lifespan)
 
 
 app.add_middleware(
@@ -27,14 +236,84 @@ app.add_middleware(
 )
 
 
-async def delete_files(file_paths: list[str]) -> None:
-    await asyncio.sleep(600)
-    for file_path in file_paths:
+@app.middleware("http")
+async def measure_requests(request: Request, call_next):
+    IN_FLIGHT_REQUESTS.inc()
+    start = time.perf_counter()
+
+    def _observe(status):
+        IN_FLIGHT_REQUESTS.dec()
+        # the route template keeps ids out of the labels
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=route.path if route else "unmatched",
+            status=status,
+        )
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        _observe(500)
+        raise
+    body = response.body_iterator
+
+    async def _measured_body():
+        # streamed responses, e.g. /recommend/stream, are timed until their
+        # last chunk is sent rather than until their headers are
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        except Exception as e:
-            logger.error(f"Failed to delete file {file_path}: {e}")
+            async for chunk in body:
+                yield chunk
+        finally:
+            _observe(response.status_code)
+
+    response.body_iterator = _measured_body()
+    return response
+
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness, the server is able to handle requests"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness, 503 until the warm up of the workers is done or has used up
+    its retries"""
+    warmup = app.state.warmup
+    if warmup["status"] not in ("ready", "degraded"):
+        return JSONResponse(status_code=503, content=jsonable_encoder(warmup))
+    return warmup
+
+
+@app.get("/metrics")
+async def metrics():
+    """Metrics in the Prometheus text format"""
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse encoding content with orjson when it is installed. The
+    content must hold JSON values already, it is not run through
+    jsonable_encoder."""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+ERR_MSG = "Generation failed, please provide correct inputs or report it to the team!"
+
+
+def _busy_response(e: PoolFullError) -> JSONResponse:
+    logger.warning(f"Rejecting recommendation request: {e}")
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(e.retry_after)},
+        content=jsonable_encoder({"message": "Server is busy, please retry later."}),
+    )
 
 
 class RecommendationsRequest(BaseModel):
@@ -45,45 +324,310 @@ class RecommendationsRequest(BaseModel):
     skip_estimator: bool | None = False
 
 
-def generate_unique_stamps():
-    timestamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%S")
-    random_id = uuid.uuid4().hex[:8]
-    return f"{timestamp}_{random_id}"
+def _iter_recommendation(req: dict, unique_tag: str = ""):
+    fms_adapter = FMSAdapter(additional_actions=[], output_mode="memory")
+    response = yield from fms_adapter.iter_execute(
+        tuning_config=req["tuning_config"],
+        compute_config=req["compute_config"],
+        accelerate_config=req["accelerate_config"],
+        data_config=req["tuning_data_config"],
+        unique_tag=unique_tag,
+        paths={},
+        skip_estimator=req["skip_estimator"],
+        # patches are not part of the response
+        include=(),
+    )
+    return response
 
 
-@app.post("/recommend")
-async def recommend(
-    background_tasks: BackgroundTasks,
-    req: RecommendationsRequest,
-):
-    err_msg = (
-        "Generation failed, please provide correct inputs or report it to the team!"
-    )
+def run_recommendation(req: dict, unique_tag: str = "") -> dict:
+    """Run the FMS adapter for a request, called in a worker of the pipeline pool.
+    Config files are rendered in memory and returned in artifacts."""
+    return exhaust(_iter_recommendation(req, unique_tag))
+
+
+def stream_recommendation(req: dict, events):
+    """run_recommendation putting its progress events on the events queue as
+    they happen, followed by a result or error event and None at the end"""
     try:
-        paths_to_delete = []
-        base_dir = Path(__file__).parent
-        output_dir = base_dir / "outputs" / generate_unique_stamps()
-
-        fms_adapter = FMSAdapter(base_dir=output_dir, additional_actions=[])
-
-        response = fms_adapter.execute(
-            tuning_config=req.tuning_config,
-            compute_config=req.compute_config,
-            accelerate_config=req.accelerate_config,
-            data_config=req.tuning_data_config,
-            unique_tag="",
-            paths={},
-            skip_estimator=req.skip_estimator,
+        generator = _iter_recommendation(req)
+        while True:
+            try:
+                events.put(to_jsonable(next(generator)))
+            except StopIteration as e:
+                events.put({"event": "result", "result": e.value})
+                break
+    except Exception as e:
+        logger.error(e)
+        events.put({"event": "error", "message": ERR_MSG})
+    finally:
+        events.put(None)
+
+
+def _relocate_artifacts(response: dict, base: str) -> dict:
+    """Point the paths of a response, and the files its launch command refers
+    to, at base/<name>"""
+    paths = {
+        section: f"{base}/{path.rsplit('/', 1)[-1]}"
+        for section, path in response["paths"].items()
+    }
+    if "launch_command" in response:
+        for section, path in response["paths"].items():
+            response["launch_command"] = re.sub(
+                rf"(?<=\s){re.escape(path)}(?=\s|$)",
+                paths[section],
+                response["launch_command"],
+            )
+    response["paths"] = paths
+    return response
+
+
+def _publish_artifacts(response: dict) -> dict:
+    """Move the config files of a response to the artifact store and point
+    its paths, and the files its launch command refers to, to them"""
+    artifact_id = get_artifact_store().put(response.pop("artifacts"))
+    response["artifact_id"] = artifact_id
+    # the adapter refers to the files by their bare names
+    return _relocate_artifacts(response, f"/artifacts/{artifact_id}")
+
+
+_FLIGHT = AsyncSingleFlight()
+
+
+async def _recommend_once(payload: dict) -> dict:
+    """Recommendation with its artifacts published"""
+    response, _ = await _recommend_with_artifacts(payload)
+    return response
+
+
+async def _recommend_with_artifacts(payload: dict) -> tuple[dict, dict]:
+    """Recommendation with its artifacts published, and the contents of the
+    artifacts. Concurrent identical requests, keyed by a canonical hash of the
+    payload, share one run and finished ones are reused from the cache
+    backend."""
+    digest = canonical_hash(payload)
+
+    async def _run():
+        key = f"recommendation:{digest}"
+        cache = get_cache_backend()
+        response = await asyncio.to_thread(cache.get_json, key)
+        CACHE_LOOKUPS.inc(
+            cache="recommendation", result="miss" if response is None else "hit"
         )
-        response.pop("patches")
-        for _, path in response["paths"].items():
-            paths_to_delete.append(path)
+        if response is None:
+            response = await run_on_pool(run_recommendation, payload)
+            await asyncio.to_thread(cache.set_json, key, response)
+        artifacts = response["artifacts"]
+        return _publish_artifacts(response), artifacts
 
-        background_tasks.add_task(delete_files, paths_to_delete)
-        return response
+    return await _FLIGHT.do(digest, _run)
+
+
+@app.post("/recommend")
+async def recommend(req: RecommendationsRequest):
+    try:
+        return FastJSONResponse(await _recommend_once(req.model_dump()))
+    except PoolFullError as e:
+        return _busy_response(e)
     except Exception as e:
         logger.error(e)
         return JSONResponse(
             status_code=500,
-            content=jsonable_encoder({"message": err_msg}),
+            content=jsonable_encoder({"message": ERR_MSG}),
+        )
+
+
+@app.post("/recommend/stream")
+async def recommend_stream(req: RecommendationsRequest):
+    """/recommend streamed as JSON lines: an action event with the merge patch,
+    json patch and comment of every action as soon as it ran, stage events
+    with timings and last a result event with the /recommend response or an
+    error event. Streamed requests are not shared with identical ones."""
+    events = await asyncio.to_thread(_event_queue)
+    run = asyncio.ensure_future(
+        run_on_pool(stream_recommendation, req.model_dump(), events)
+    )
+    # the pool admits or rejects the call before its first suspension
+    await asyncio.sleep(0)
+    if run.done() and isinstance(run.exception(), PoolFullError):
+        return _busy_response(run.exception())
+
+    async def _stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.to_thread(events.get, timeout=1)
+                except queue.Empty:
+                    if not run.done():
+                        continue
+                    # the worker died without finishing the stream
+                    logger.error(run.exception())
+                    event = {"event": "error", "message": ERR_MSG}
+                if event is None:
+                    break
+                if event["event"] == "result":
+                    _publish_artifacts(event["result"])
+                yield dumps(event) + b"\n"
+                if event["event"] == "error":
+                    break
+        finally:
+            # the call keeps its worker until it finishes, it cannot be stopped
+            run.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
+async def _run_when_pool_frees_up(
+    payload: dict, timeout: float | None = None
+) -> tuple[dict, dict]:
+    """_recommend_with_artifacts waiting while the pool is full instead of
+    being rejected, the PoolFullError is raised once it waited timeout seconds"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        try:
+            return await _recommend_with_artifacts(payload)
+        except PoolFullError as e:
+            wait = e.retry_after
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise
+                wait = min(wait, remaining)
+            await asyncio.sleep(wait)
+
+
+async def _run_job(job_id: str, req: dict):
+    store = get_job_store()
+    try:
+        async with app.state.job_slots:
+            store.update(job_id, status="running")
+            response, artifacts = await _run_when_pool_frees_up(req)
+        # the artifact store expires entries, a job keeps its own copy for as
+        # long as the job store keeps the job
+        result = {**response, "artifacts": artifacts}
+        result.pop("artifact_id")
+        result = _relocate_artifacts(result, f"/jobs/{job_id}/artifacts")
+        store.update(job_id, status="succeeded", result=result)
+    except asyncio.CancelledError:
+        store.update(job_id, status="cancelled")
+        raise
+    except Exception as e:
+        logger.error(f"Job {job_id} failed: {e}")
+        store.update(job_id, status="failed", error=str(e))
+    finally:
+        app.state.jobs.pop(job_id, None)
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(req: RecommendationsRequest):
+    """Queue a recommendation, poll GET /jobs/{id} for its result"""
+    job_id = uuid.uuid4().hex
+    job = get_job_store().create(job_id, req.model_dump())
+    app.state.jobs[job_id] = asyncio.create_task(_run_job(job_id, req.model_dump()))
+    return {"id": job_id, "status": job["status"]}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+    return job
+
+
+@app.get("/jobs/{job_id}/artifacts/{name}")
+async def get_job_artifact(job_id: str, name: str):
+    job = get_job_store().get(job_id)
+    content = ((job or {}).get("result") or {}).get("artifacts", {}).get(name)
+    if content is None:
+        raise HTTPException(
+            status_code=404, detail=f"artifact {name} of job {job_id} not found"
+        )
+    return PlainTextResponse(content, media_type="application/yaml")
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued or running job. A running recommendation is not
+    interrupted in its worker, its result is discarded."""
+    job = get_job_store().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"job {job_id} not found")
+    if job["status"] in FINISHED_STATUSES:
+        raise HTTPException(
+            status_code=409, detail=f"job {job_id} is already {job['status']}"
+        )
+    task = app.state.jobs.get(job_id)
+    if task is None:
+        # queued by another server process or lost on restart
+        return get_job_store().update(job_id, status="cancelled")
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return get_job_store().get(job_id)
+
+
+@app.post("/recommend/batch")
+async def recommend_batch(reqs: list[RecommendationsRequest]):
+    """Recommendations for many requests, streamed as one JSON line per item
+    with its index in the order they finish. Identical items are computed once
+    and distinct items run in parallel on the worker pool, at most
+    TCR_BATCH_CONCURRENCY at once across all batches. An item that finds the
+    pool full for TCR_BATCH_RETRY_TIMEOUT seconds fails with status 503."""
+    max_batch_size = int(os.environ.get("TCR_MAX_BATCH_SIZE", 256))
+    if len(reqs) > max_batch_size:
+        raise HTTPException(
+            status_code=413,
+            detail=f"batch has {len(reqs)} items, at most {max_batch_size} allowed",
+        )
+    indices = {}
+    payloads = {}
+    for index, req in enumerate(reqs):
+        key = canonical_hash(req.model_dump())
+        indices.setdefault(key, []).append(index)
+        payloads[key] = req.model_dump()
+
+    retry_timeout = float(os.environ.get("TCR_BATCH_RETRY_TIMEOUT", 60))
+
+    async def _item(key: str) -> tuple[str, dict]:
+        try:
+            async with app.state.batch_slots:
+                response, _ = await _run_when_pool_frees_up(
+                    payloads[key], retry_timeout
+                )
+            return key, {"status_code": 200, "response": response}
+        except PoolFullError as e:
+            logger.warning(f"Giving up on batch item: {e}")
+            return key, {
+                "status_code": 503,
+                "message": "Server is busy, please retry later.",
+                "retry_after": e.retry_after,
+            }
+        except Exception as e:
+            logger.error(e)
+            return key, {"status_code": 500, "message": ERR_MSG}
+
+    async def _stream():
+        tasks = [asyncio.create_task(_item(key)) for key in indices]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                key, result = await finished
+                for index in indices[key]:
+                    yield dumps({"index": index, **result}) + b"\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
+
+@app.get("/artifacts/{artifact_id}/{name}")
+async def get_artifact(artifact_id: str, name: str):
+    content = get_artifact_store().get(artifact_id, name)
+    if content is None:
+        raise HTTPException(
+            status_code=404, detail=f"artifact {artifact_id}/{name} not found"
         )
+    return PlainTextResponse(content, media_type="application/yaml")
@@ -0,0 +1,75 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from loguru import logger
+
+
+class ArtifactStore:
+    """Generated config files kept in memory for ttl seconds
+
+    Artifacts of a recommendation are stored together under one id. When the
+    store grows beyond max_bytes the oldest recommendations are dropped first.
+    Expired entries are not served and are removed by sweep, which the API
+    calls periodically.
+
+    Args:
+        ttl (float): seconds an entry is kept
+        max_bytes (int): total size of the contents kept
+    """
+
+    def __init__(self, ttl: float = 600.0, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(artifacts: dict[str, str]) -> int:
+        return sum(len(content.encode("utf-8")) for content in artifacts.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    def put(self, artifacts: dict[str, str]) -> str:
+        """Store artifacts (file name to contents) and return their id"""
+        artifact_id = uuid.uuid4().hex
+        size = self._size(artifacts)
+        with self._lock:
+            self._entries[artifact_id] = (time.monotonic(), size, dict(artifacts))
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, (_, dropped, _) = self._entries.popitem(last=False)
+                self._bytes -= dropped
+        return artifact_id
+
+    def get(self, artifact_id: str, name: str) -> str | None:
+        """Contents of the artifact, None when it does not exist or expired"""
+        with self._lock:
+            entry = self._entries.get(artifact_id)
+        if entry is None or time.monotonic() - entry[0] > self.ttl:
+            return None
+        return entry[2].get(name)
+
+    def sweep(self) -> int:
+        """Remove expired entries and return how many were removed"""
+        deadline = time.monotonic() - self.ttl
+        removed = 0
+        with self._lock:
+            # entries are in insertion order, so the expired ones come first
+            while self._entries:
+                artifact_id, (created, size, _) = next(iter(self._entries.items()))
+                if created > deadline:
+                    break
+                del self._entries[artifact_id]
+                self._bytes -= size
+                removed += 1
+        if removed:
+            logger.debug(f"Swept {removed} expired artifact entries")
+        return removed
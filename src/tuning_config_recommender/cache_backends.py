@@ -0,0 +1,354 @@
+import hashlib
+import json
+import math
+import os
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from loguru import logger
+
+DEFAULT_TTL = 600.0
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class CacheBackendError(RuntimeError):
+    """Error reply of a cache server"""
+
+
+class CacheBackend(ABC):
+    """Byte values by key, expiring after a time to live and bounded in size
+
+    Replicas using the same shared backend see each other's values. get_json
+    and set_json treat failures of the backend as misses, so an unavailable
+    cache slows requests down without failing them.
+
+    Args:
+        default_ttl (float): seconds a value is kept when set has no ttl,
+            None keeps values until they are evicted
+    """
+
+    def __init__(self, default_ttl: float | None = DEFAULT_TTL):
+        self.default_ttl = default_ttl
+
+    def _ttl(self, ttl: float | None) -> float | None:
+        return self.default_ttl if ttl is None else ttl
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        """Value of key, None when it is missing or expired"""
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        """Store value under key for ttl seconds"""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Remove key if present"""
+
+    @abstractmethod
+    def close(self):
+        """Release the resources of the backend, shared values are kept"""
+
+    def get_json(self, key: str):
+        try:
+            value = self.get(key)
+        except Exception as e:
+            logger.warning(f"Cache lookup of {key} failed: {e!r}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key: str, value, ttl: float | None = None):
+        try:
+            self.set(key, json.dumps(value, default=str).encode("utf-8"), ttl)
+        except Exception as e:
+            logger.warning(f"Caching {key} failed: {e!r}")
+
+
+class InProcessCache(CacheBackend):
+    """Values in a dict of this process, least recently used ones are dropped
+    beyond max_bytes"""
+
+    def __init__(
+        self,
+        default_ttl: float | None = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        super().__init__(default_ttl)
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        ttl = self._ttl(ttl)
+        expires = time.monotonic() + ttl if ttl is not None else math.inf
+        with self._lock:
+            self._remove(key)
+            if len(value) > self.max_bytes:
+                return
+            self._entries[key] = (expires, bytes(value))
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key: str):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry[1])
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+class FileSystemCache(CacheBackend):
+    """Values in files under root, shared by the replicas mounting it
+
+    Files are named by the hash of their key and start with their expiry
+    time. They are written to a temporary file and renamed so that readers
+    never see partial values. Least recently used files are removed when the
+    files written since the last check may have grown root beyond max_bytes.
+    """
+
+    _HEADER = struct.Struct(">d")
+
+    def __init__(
+        self,
+        root: str | Path,
+        default_ttl: float | None = DEFAULT_TTL,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        super().__init__(default_ttl)
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self._written = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.root / digest[:2] / digest
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        (expires,) = self._HEADER.unpack_from(content)
+        if expires <= time.time():
+            path.unlink(missing_ok=True)
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return content[self._HEADER.size :]
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        ttl = self._ttl(ttl)
+        expires = time.time() + ttl if ttl is not None else math.inf
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+        tmp.write_bytes(self._HEADER.pack(expires) + value)
+        os.replace(tmp, path)
+        with self._lock:
+            self._written += len(value)
+            # scanning root on every write is slow for large caches
+            check = self._written > self.max_bytes // 16
+            if check:
+                self._written = 0
+        if check:
+            self._evict()
+
+    def delete(self, key: str):
+        self._path(key).unlink(missing_ok=True)
+
+    def close(self):
+        # files are kept for the other replicas
+        pass
+
+    def _evict(self):
+        now = time.time()
+        files = []
+        for path in self.root.glob("*/*"):
+            try:
+                stat = path.stat()
+                with open(path, "rb") as f:
+                    (expires,) = self._HEADER.unpack(f.read(self._HEADER.size))
+            except (OSError, struct.error):
+                # removed meanwhile or still being written
+                continue
+            if expires <= now:
+                path.unlink(missing_ok=True)
+            else:
+                files.append((stat.st_mtime, stat.st_size - self._HEADER.size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+class RedisCache(CacheBackend):
+    """Values on a server speaking the Redis protocol (RESP), given by a
+    redis://[:password@]host:port/db url
+
+    Expiry and the size bound of the server are left to the server, its
+    maxmemory policy should evict least recently used keys. Values larger
+    than max_value_bytes are not sent. Keys are prefixed with prefix.
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        default_ttl: float | None = DEFAULT_TTL,
+        max_value_bytes: int = 16 * 1024 * 1024,
+        timeout: float = 1.0,
+        prefix: str = "tcr:",
+    ):
+        super().__init__(default_ttl)
+        parsed = urlparse(url)
+        if parsed.scheme != "redis":
+            raise ValueError(f"expected a redis:// url, got {url}")
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.strip("/") or 0)
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.max_value_bytes = max_value_bytes
+        self.timeout = timeout
+        self.prefix = prefix
+        self._sock = None
+        self._reader = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._reader = self._sock.makefile("rb")
+        if self.password:
+            self._call("AUTH", self.password)
+        if self.db:
+            self._call("SELECT", self.db)
+
+    def _call(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line.endswith(b"\r\n"):
+            raise ConnectionError("connection to the cache server was closed")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise CacheBackendError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise CacheBackendError(f"unexpected reply {line!r}")
+
+    def command(self, *args):
+        """Send a command and return its reply, reconnecting once when the
+        connection was lost"""
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._call(*args)
+                except OSError:
+                    self._close()
+                    if attempt:
+                        raise
+
+    def get(self, key: str) -> bytes | None:
+        return self.command("GET", self.prefix + key)
+
+    def set(self, key: str, value: bytes, ttl: float | None = None):
+        if len(value) > self.max_value_bytes:
+            return
+        ttl = self._ttl(ttl)
+        if ttl is None:
+            self.command("SET", self.prefix + key, value)
+        else:
+            self.command("SET", self.prefix + key, value, "PX", max(int(ttl * 1000), 1))
+
+    def delete(self, key: str):
+        self.command("DEL", self.prefix + key)
+
+    def _close(self):
+        for resource in (self._reader, self._sock):
+            if resource is not None:
+                try:
+                    resource.close()
+                except OSError:
+                    pass
+        self._sock = self._reader = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def create_cache_backend(location: str, **kwargs) -> CacheBackend:
+    """Backend for location: memory, a redis:// url or a directory"""
+    if location == "memory":
+        return InProcessCache(**kwargs)
+    if location.startswith("redis://"):
+        kwargs.pop("max_bytes", None)
+        return RedisCache(location, **kwargs)
+    return FileSystemCache(location.removeprefix("file://"), **kwargs)
+
+
+_BACKEND: CacheBackend = None
+_BACKEND_LOCK = threading.Lock()
+
+
+def get_cache_backend() -> CacheBackend:
+    """Process wide backend given by TCR_CACHE_BACKEND, bounded by
+    TCR_CACHE_TTL and TCR_CACHE_MAX_BYTES"""
+    global _BACKEND
+    with _BACKEND_LOCK:
+        if _BACKEND is None:
+            _BACKEND = create_cache_backend(
+                os.environ.get("TCR_CACHE_BACKEND", "memory"),
+                default_ttl=float(os.environ.get("TCR_CACHE_TTL", DEFAULT_TTL)),
+                max_bytes=int(os.environ.get("TCR_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES)),
+            )
+        return _BACKEND
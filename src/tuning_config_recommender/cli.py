@@ -1,6 +1,7 @@
 import argparse
 import importlib
 import json
+import os
 import pkgutil
 import sys
 from pathlib import Path
@@ -10,6 +11,7 @@ from loguru import logger
 
 from tuning_config_recommender.actions import Action
 from tuning_config_recommender.adapters import FMSAdapter
+from tuning_config_recommender.utils.kb_ingest import ingest_runs
 
 
 def load_actions_from_folder(folder_path):
@@ -35,8 +37,45 @@ def load_actions_from_folder(folder_path):
     return classes
 
 
+def ingest(args):
+    appended = ingest_runs(
+        args.runs_dir,
+        kb_path=args.kb_path,
+        architectures_path=args.architectures_path,
+    )
+    print(f"Ingested {appended} new runs from {args.runs_dir}")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Recommender CLI interface")
+    subparsers = parser.add_subparsers(dest="command")
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="Ingest completed training runs into the knowledge base"
+    )
+    ingest_parser.add_argument(
+        "--runs-dir",
+        required=True,
+        type=str,
+        help="Path to folder containing fms-hf-tuning run output folders",
+    )
+    # the packaged KB is part of the installation, runs are appended to the
+    # files the recommender is pointed at instead
+    ingest_parser.add_argument(
+        "--kb-path",
+        required="TCR_TUNING_RUN_DATA_PATH" not in os.environ,
+        type=str,
+        default=os.environ.get("TCR_TUNING_RUN_DATA_PATH", None),
+        help="Path to tuning run data csv to append to, defaults to "
+        "TCR_TUNING_RUN_DATA_PATH",
+    )
+    ingest_parser.add_argument(
+        "--architectures-path",
+        required="TCR_MODEL_ARCHITECTURES_PATH" not in os.environ,
+        type=str,
+        default=os.environ.get("TCR_MODEL_ARCHITECTURES_PATH", None),
+        help="Path to model architectures csv to append to, defaults to "
+        "TCR_MODEL_ARCHITECTURES_PATH",
+    )
     parser.add_argument(
         "--rules-dir",
         required=False,
@@ -76,7 +115,17 @@ def main():
         default=False,
         help="Path to compute config",
     )
+    parser.add_argument(
+        "--sweep-top-k",
+        required=False,
+        type=int,
+        default=0,
+        help="Also rank this many variations of the recommended config by predicted throughput",
+    )
     args = parser.parse_args()
+    if args.command == "ingest":
+        ingest(args)
+        return
     additional_actions = load_actions_from_folder(args.rules_dir)
     fms_adapter = FMSAdapter(
         base_dir=args.output_dir, additional_actions=additional_actions
@@ -90,6 +139,7 @@ def main():
         unique_tag="",
         paths={},
         skip_estimator=args.skip_estimator,
+        sweep_top_k=args.sweep_top_k,
     )
     print(result["patches"])
     json.dump(
@@ -97,6 +147,12 @@ def main():
         open(str(Path(args.output_dir) / "stdout.json"), "w"),
         default=str,
     )
+    if args.sweep_top_k:
+        sweep_path = Path(args.output_dir) / "sweep.json"
+        json.dump(result["sweep"], open(str(sweep_path), "w"), indent=2)
+        for rank, candidate in enumerate(result["sweep"], start=1):
+            print(f"{rank}. {candidate}")
+        print(f"Sweep results available at {sweep_path}")
     print(
         f"Available at {args.output_dir} and parsable stdout at {Path(args.output_dir) / 'stdout.json'}"
     )
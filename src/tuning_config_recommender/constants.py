@@ -1,2 +1,39 @@
 DEFAULT_NUM_NODES = 1
 DEFAULT_NUM_GPUS_PER_NODE = 1
+
+DEFAULT_GPU_MODEL = "NVIDIA-A100-SXM4-80GB"
+GPU_TYPE_RANKINGS = ["throughput", "cost"]
+
+# compute shapes evaluated by the min gpu recommender unless
+# candidate_shapes is given in the compute config
+DEFAULT_COMPUTE_CANDIDATE_SHAPES = [
+    {"num_nodes": 1, "num_gpus_per_node": 1},
+    {"num_nodes": 1, "num_gpus_per_node": 2},
+    {"num_nodes": 1, "num_gpus_per_node": 4},
+    {"num_nodes": 1, "num_gpus_per_node": 8},
+    {"num_nodes": 2, "num_gpus_per_node": 8},
+    {"num_nodes": 4, "num_gpus_per_node": 8},
+    {"num_nodes": 8, "num_gpus_per_node": 8},
+]
+
+# objectives to pick among KB runs for batch size selection
+BATCH_SIZE_OBJECTIVES = ["throughput", "cost", "pareto"]
+# fraction of GPU memory kept free when picking runs on the pareto frontier
+DEFAULT_MEMORY_SAFETY_MARGIN = 0.1
+
+# tuning_config keys that are only inputs to the recommender
+# and are dropped before emitting the final tuning config
+RECOMMENDER_ONLY_TUNING_KEYS = [
+    "tuning_strategy",
+    "batch_size_objective",
+    "memory_safety_margin",
+    "target_global_batch_size",
+    "target_global_batch_tokens",
+]
+
+# compute_config keys that are only inputs to the recommender
+RECOMMENDER_ONLY_COMPUTE_KEYS = [
+    "candidate_shapes",
+    "gpu_types",
+    "rank_by",
+]
@@ -0,0 +1,174 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+JOB_STATUSES = ["queued", "running", "succeeded", "failed", "cancelled"]
+FINISHED_STATUSES = ["succeeded", "failed", "cancelled"]
+
+
+def _check_fields(fields: dict):
+    unknown = set(fields) - {"status", "result", "error"}
+    if unknown:
+        raise ValueError(f"cannot update {sorted(unknown)} of a job")
+    if fields.get("status", "queued") not in JOB_STATUSES:
+        raise ValueError(f"status should be one of {JOB_STATUSES}")
+
+
+class JobStore(ABC):
+    """Keeps status and result of recommendation jobs
+
+    A job is a dict with id, status (one of JOB_STATUSES), request, result,
+    error, created_at and updated_at.
+    """
+
+    @abstractmethod
+    def create(self, job_id: str, request: dict) -> dict:
+        """Add a queued job"""
+
+    @abstractmethod
+    def get(self, job_id: str) -> dict | None:
+        """Job with job_id, None when it does not exist"""
+
+    @abstractmethod
+    def update(self, job_id: str, **fields) -> dict | None:
+        """Set status, result or error of a job and return it"""
+
+
+class InMemoryJobStore(JobStore):
+    """Jobs in a dict, lost on restart. Finished jobs are dropped ttl seconds
+    after they finished and the oldest ones beyond max_jobs."""
+
+    def __init__(self, max_jobs: int = 1000, ttl: float | None = None):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, job_id: str, request: dict) -> dict:
+        now = time.time()
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "request": request,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            finished = [
+                k for k, v in self._jobs.items() if v["status"] in FINISHED_STATUSES
+            ]
+            if self.ttl is not None:
+                expired = {
+                    k for k in finished if self._jobs[k]["updated_at"] < now - self.ttl
+                }
+                for k in expired:
+                    del self._jobs[k]
+                finished = [k for k in finished if k not in expired]
+            for k in finished[: max(len(self._jobs) - self.max_jobs, 0)]:
+                del self._jobs[k]
+            return dict(job)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update(self, job_id: str, **fields) -> dict | None:
+        _check_fields(fields)
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(fields, updated_at=time.time())
+            return dict(job)
+
+
+class SQLiteJobStore(JobStore):
+    """Jobs in a SQLite file, kept across restarts and readable by every
+    server process sharing the file. Finished jobs are dropped like in
+    InMemoryJobStore. Jobs still queued or running when the file is opened
+    were lost with the process that ran them and are marked failed, processes
+    sharing a file should therefore be started together."""
+
+    def __init__(self, path: str, max_jobs: int = 1000, ttl: float | None = None):
+        self.path = str(path)
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, status TEXT, request TEXT, result TEXT, "
+                "error TEXT, created_at REAL, updated_at REAL)"
+            )
+            self._connection.execute(
+                "UPDATE jobs SET status = 'failed', "
+                "error = 'interrupted by a server restart', updated_at = ? "
+                "WHERE status IN ('queued', 'running')",
+                (time.time(),),
+            )
+
+    def _evict(self, now: float):
+        finished = ", ".join("?" * len(FINISHED_STATUSES))
+        if self.ttl is not None:
+            self._connection.execute(
+                f"DELETE FROM jobs WHERE status IN ({finished}) AND updated_at < ?",
+                (*FINISHED_STATUSES, now - self.ttl),
+            )
+        (count,) = self._connection.execute("SELECT COUNT(*) FROM jobs").fetchone()
+        self._connection.execute(
+            "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs "
+            f"WHERE status IN ({finished}) ORDER BY created_at LIMIT ?)",
+            (*FINISHED_STATUSES, max(count - self.max_jobs, 0)),
+        )
+
+    @staticmethod
+    def _to_job(row) -> dict | None:
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ("request", "result"):
+            job[key] = json.loads(job[key]) if job[key] is not None else None
+        return job
+
+    def create(self, job_id: str, request: dict) -> dict:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs VALUES (?, 'queued', ?, NULL, NULL, ?, ?)",
+                (job_id, json.dumps(request, default=str), now, now),
+            )
+            self._evict(now)
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return self._to_job(row)
+
+    def update(self, job_id: str, **fields) -> dict | None:
+        _check_fields(fields)
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], default=str)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id),
+            )
+        return self.get(job_id)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
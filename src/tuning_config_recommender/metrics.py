@@ -0,0 +1,296 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# seconds, recommendations for a model that is not cached yet take minutes
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra: dict | None = None) -> str:
+    pairs = list(zip(names, values, strict=True)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Registry:
+    """Metrics rendered together in the Prometheus text format
+
+    Counters and histograms of a worker process can be moved to the registry
+    of the server with drain in the worker and merge in the server.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def drain(self) -> dict:
+        """Values of the counters and histograms, which are reset to zero"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.drain() for m in metrics if m.type != "gauge"}
+
+    def merge(self, samples: dict):
+        """Add values returned by drain of another registry"""
+        for name, values in samples.items():
+            metric = self._metrics.get(name)
+            if metric is not None:
+                metric.merge(values)
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = ""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        registry: Registry | None = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {list(self.labelnames)}, got {list(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def drain(self) -> dict:
+        with self._lock:
+            values, self._values = self._values, {}
+        return values
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        if amount < 0:
+            raise ValueError("counters can only be increased")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, value in values.items():
+                self._values[key] = self._values.get(key, 0.0) + value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Value that goes up and down. set_function reads it at render time
+    instead, which suits values owned by other objects such as queue depth."""
+
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self._function = function
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            return float(self._function())
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> list[str]:
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self.value())}"]
+        with self._lock:
+            values = dict(self._values)
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels), ([0], 0.0))
+            return sum(counts)
+
+    def merge(self, values: dict):
+        with self._lock:
+            for key, (counts, total) in values.items():
+                own, own_total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+                self._values[key] = (
+                    [a + b for a, b in zip(own, counts, strict=True)],
+                    own_total + total,
+                )
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = {key: (list(c), t) for key, (c, t) in self._values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                labels = _format_labels(
+                    self.labelnames, key, {"le": _format_value(bound)}
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram(
+    "tcr_request_seconds",
+    "Latency of API requests until the response is sent",
+    ("endpoint", "status"),
+)
+IN_FLIGHT_REQUESTS = Gauge("tcr_in_flight_requests", "API requests being handled")
+QUEUE_DEPTH = Gauge(
+    "tcr_queue_depth", "Recommendations waiting for a worker of the pipeline pool"
+)
+STAGE_SECONDS = Histogram(
+    "tcr_stage_seconds",
+    "Duration of the stages of a recommendation: resolve_model (model metadata "
+    "fetch), dataset_probe, estimator, rule_engine, sweep, render (serialization) "
+    "and write_files",
+    ("stage",),
+)
+ACTION_SECONDS = Histogram(
+    "tcr_action_seconds", "Duration of an action of the rule engine", ("action",)
+)
+ENGINE_ITERATIONS = Counter(
+    "tcr_engine_iterations_total", "Passes of the rule engine over all actions"
+)
+CACHE_LOOKUPS = Counter(
+    "tcr_cache_lookups_total",
+    "Lookups of the model store, dataset and estimator caches and of the cache backend",
+    ("cache", "result"),
+)
+ESTIMATOR_FALLBACKS = Counter(
+    "tcr_estimator_fallbacks_total",
+    "Compute recommendations that could not use the min gpu estimator",
+    ("source",),
+)
+
+_LOOKUP = threading.local()
+
+
+@contextmanager
+def cache_lookup(cache: str):
+    """Counts the lookup of cache done in the block as a miss when record_miss
+    was called in the same thread meanwhile, as a hit otherwise"""
+    outer = getattr(_LOOKUP, "missed", None)
+    _LOOKUP.missed = False
+    try:
+        yield
+        CACHE_LOOKUPS.inc(cache=cache, result="miss" if _LOOKUP.missed else "hit")
+    finally:
+        _LOOKUP.missed = outer
+
+
+def record_miss():
+    """Called by cached functions when they compute a value"""
+    _LOOKUP.missed = True
@@ -1,11 +1,14 @@
 import os
+import time
 from copy import deepcopy
 
 from loguru import logger
 from tqdm import tqdm
 
 from tuning_config_recommender.actions import ACTIONS, IR, Action
+from tuning_config_recommender.metrics import ACTION_SECONDS, ENGINE_ITERATIONS
 from tuning_config_recommender.utils import set_difference, set_issubset
+from tuning_config_recommender.utils.helper import exhaust
 
 
 class RuleEngine:
@@ -15,8 +18,14 @@ class RuleEngine:
     # for now meta is common across actions
     actions_meta: list[str] = []
 
-    def __init__(self):
-        pass
+    def __init__(self, keep_source_irs: bool = True):
+        # engine and action state is kept per instance so that
+        # engines created for different requests do not share it
+        self.actions = []
+        self.ir_pipeline = []
+        self.actions_meta = []
+        # copies of the IR each patch was made on, only kept when asked for
+        self.keep_source_irs = keep_source_irs
 
     def add_to_actions_meta(self, meta: str):
         self.actions_meta.append(meta)
@@ -31,6 +40,8 @@ class RuleEngine:
 
     def register_action(self, action: Action):
         self._validate_action(action=action)
+        action.json_merge_patches = []
+        action.json_patches_and_comment_wrt_source = []
         self.actions.append(action)
         logger.debug(f"action {action.__class__.__name__} registered!")
 
@@ -45,12 +56,21 @@ class RuleEngine:
         ir_to_patch.update(json_merge_patch=json_merge_patch)
         return source_ir.get_json_patch(ir_to_patch)
 
-    def run_all_actions(self, ir: IR):
+    def iter_run_all_actions(self, ir: IR, iteration: int = 0):
+        """run_all_actions yielding an event as soon as an action produced a patch
+
+        Events are dicts with event "action", the action name, the iteration of
+        the engine, seconds the action took, its json_merge_patch, json_patch
+        and comment. Returns the patched IR.
+        """
         running_ir = ir
         for action in tqdm(
             self.actions, total=(len(self.actions)), desc="Iterating over actions"
         ):
+            start = time.perf_counter()
             json_merge_patch: IR = action.apply(deepcopy(running_ir), self.actions_meta)
+            seconds = time.perf_counter() - start
+            ACTION_SECONDS.observe(seconds, action=action.__class__.__name__)
             if not json_merge_patch:
                 continue
             json_patch = self._get_json_patch_from_merge_patch(
@@ -59,17 +79,29 @@ class RuleEngine:
             logger.debug(
                 f"action {action.__class__.__name__} applied, returned json merge patch {json_merge_patch} and json patch {json_patch}"
             )
-            action.json_patches_and_comment_wrt_source.append(
-                {
-                    "comment": json_merge_patch.comment,
-                    "json_patch": json_patch,
-                    "json_merge_patch": json_merge_patch,
-                    "stage_source_ir": deepcopy(running_ir),
-                }
-            )
+            patch = {
+                "comment": json_merge_patch.comment,
+                "json_patch": json_patch,
+                "json_merge_patch": json_merge_patch,
+            }
+            if self.keep_source_irs:
+                patch["stage_source_ir"] = deepcopy(running_ir)
+            action.json_patches_and_comment_wrt_source.append(patch)
             running_ir.update(json_merge_patch)
+            yield {
+                "event": "action",
+                "action": action.__class__.__name__,
+                "iteration": iteration,
+                "seconds": seconds,
+                "json_merge_patch": json_merge_patch,
+                "json_patch": json_patch,
+                "comment": json_merge_patch.comment,
+            }
         return running_ir
 
+    def run_all_actions(self, ir: IR):
+        return exhaust(self.iter_run_all_actions(ir))
+
     def validate_and_maybe_fix_ir(self, ir: IR):
         if not os.path.exists(ir.tuning_config.get("model_name_or_path", None)):
             raise ValueError(
@@ -95,14 +127,22 @@ class RuleEngine:
         return ir
 
     def apply(self, ir: IR):
+        return exhaust(self.iter_apply(ir))
+
+    def iter_apply(self, ir: IR):
+        """apply yielding the events of iter_run_all_actions as they happen,
+        returns the final IR and the json patches with comments"""
         max_iterations = 20
         ir_to_apply: IR = deepcopy(ir)
         self.ir_pipeline.append(deepcopy(ir))
+        iteration = 0
         while any([not action.skip for action in self.actions]) and max_iterations:
             ir_to_apply = self.validate_and_maybe_fix_ir(ir_to_apply)
-            ir_to_apply = self.run_all_actions(ir_to_apply)
+            ir_to_apply = yield from self.iter_run_all_actions(ir_to_apply, iteration)
+            ENGINE_ITERATIONS.inc()
             self.ir_pipeline.append(deepcopy(ir_to_apply))
             max_iterations -= 1
+            iteration += 1
         # extracting comments for json patches
         json_patches = self.ir_pipeline[0].get_json_patch(ir_to_apply)
         final_json_patches_with_comment: list[dict] = []
@@ -0,0 +1,308 @@
+from copy import deepcopy
+
+import numpy as np
+from loguru import logger
+
+from tuning_config_recommender.actions import IR
+from tuning_config_recommender.actions.train import ApplyFastKernelsOptimization
+from tuning_config_recommender.constants import (
+    DEFAULT_GPU_MODEL,
+    DEFAULT_MEMORY_SAFETY_MARGIN,
+    DEFAULT_NUM_GPUS_PER_NODE,
+    DEFAULT_NUM_NODES,
+)
+from tuning_config_recommender.utils.batch_solver import target_global_batch
+from tuning_config_recommender.utils.memory_estimator import (
+    GIB,
+    HALF_SATURATION_TOKENS,
+    SHARDING_STRATEGIES,
+    estimate_memory,
+    estimate_throughput,
+    gpu_memory_bytes,
+)
+from tuning_config_recommender.utils.model_facts import get_model_facts
+from tuning_config_recommender.utils.tuning_config import use_kb_for_throughput
+
+SWEEP_SPACE = {
+    "per_device_train_batch_size": [1, 2, 4, 8, 16, 32, 64, 128],
+    "gradient_accumulation_steps": [1, 2, 4, 8, 16],
+    "fsdp_sharding_strategy": SHARDING_STRATEGIES,
+    "gradient_checkpointing": [False, True],
+    "padding": ["padded", "padding_free", "packing"],
+    "fast_kernels": [False, True],
+}
+
+# Relative throughput model, calibrated against the KB run (or the analytic
+# estimate) of the recommended configuration.
+# checkpointing recomputes the forward pass, 8 instead of 6 flops per param and token
+GRADIENT_CHECKPOINTING_SPEED = 0.75
+FAST_KERNELS_SPEED = 1.1
+# fraction of computed tokens that are not padding
+PADDING_USEFUL_FRACTION = {"padded": 0.6, "padding_free": 1.0, "packing": 0.98}
+# cost of gathering parameters and reducing gradients across GPUs
+SHARDING_SPEED = {
+    "NO_SHARD": 1.0,
+    "SHARD_GRAD_OP": 0.97,
+    "FULL_SHARD": 0.93,
+    "HYBRID_SHARD": 0.95,
+}
+# optimizer step and gradient sync relative to one micro batch
+STEP_OVERHEAD = 0.1
+
+
+class SweepEngine:
+    """Ranks variations of a recommended configuration by predicted throughput.
+
+    Candidates span the cartesian product of the values in space. They are
+    evaluated at once with numpy, infeasible ones are pruned with the analytic
+    memory model, as are those whose global batch is further off the target
+    than the closest one (the
+    target_global_batch_size or target_global_batch_tokens of the tuning
+    config, the global batch of the recommended configuration otherwise) and
+    the rest are scored with a throughput model anchored at the KB run of the
+    model (or the analytic throughput estimate).
+
+    Args:
+        space (dict): values to sweep per setting, defaults to SWEEP_SPACE
+    """
+
+    def __init__(self, space: dict | None = None):
+        self.space = {**SWEEP_SPACE, **(space or {})}
+
+    def _grid(self, num_nodes: int, supports_fast_kernels: bool) -> dict:
+        space = dict(self.space)
+        if num_nodes == 1:
+            # without a second node hybrid sharding is full sharding
+            space["fsdp_sharding_strategy"] = [
+                s for s in space["fsdp_sharding_strategy"] if s != "HYBRID_SHARD"
+            ]
+        if not supports_fast_kernels:
+            space["fast_kernels"] = [False]
+        indices = np.meshgrid(
+            *[np.arange(len(values)) for values in space.values()], indexing="ij"
+        )
+        return {
+            key: np.asarray(values)[index.ravel()]
+            for (key, values), index in zip(space.items(), indices, strict=True)
+        }
+
+    @staticmethod
+    def _relative_speed(
+        per_device_batch_size,
+        gradient_accumulation_steps,
+        sharding_strategy,
+        gradient_checkpointing,
+        padding,
+        fast_kernels,
+        seq_len: int,
+        num_gpus: int,
+    ):
+        tokens = np.asarray(per_device_batch_size) * seq_len
+        speed = tokens / (tokens + HALF_SATURATION_TOKENS)
+        speed = (
+            speed
+            * gradient_accumulation_steps
+            / (np.asarray(gradient_accumulation_steps) + STEP_OVERHEAD)
+        )
+        speed = speed * np.where(
+            gradient_checkpointing, GRADIENT_CHECKPOINTING_SPEED, 1.0
+        )
+        speed = speed * np.where(fast_kernels, FAST_KERNELS_SPEED, 1.0)
+        speed = speed * np.vectorize(PADDING_USEFUL_FRACTION.get, otypes=[float])(
+            padding
+        )
+        if num_gpus > 1:
+            speed = speed * np.vectorize(SHARDING_SPEED.get, otypes=[float])(
+                sharding_strategy
+            )
+        return speed
+
+    def _reference_throughput(self, ir: IR, model_config: dict):
+        """Tokens per second of one GPU and the per device batch it was measured at"""
+        tuning_strategy = ir.tuning_config.get("tuning_strategy", "full")
+        kb_run = use_kb_for_throughput(
+            ir.tuning_config["model_name_or_path"],
+            tuning_strategy,
+            int(ir.tuning_config.get("max_seq_length", 2048)),
+            ir.compute_config.get("gpu_model", DEFAULT_GPU_MODEL),
+        )
+        if kb_run:
+            return (
+                kb_run["dataset_tokens_per_second"] / kb_run["number_gpus"],
+                kb_run["per_device_train_batch_size"],
+                "knowledge base",
+            )
+        per_gpu = float(
+            estimate_throughput(
+                model_config,
+                tuning_strategy,
+                1,
+                ir.compute_config.get("gpu_model", DEFAULT_GPU_MODEL),
+            )
+        )
+        return (
+            per_gpu,
+            int(ir.tuning_config.get("per_device_train_batch_size", 1) or 1),
+            "analytic estimate",
+        )
+
+    @staticmethod
+    def _target_global_batch(ir: IR, num_gpus: int, seq_len: int) -> int:
+        if ir.tuning_config.get("target_global_batch_size", None) or (
+            ir.tuning_config.get("target_global_batch_tokens", None)
+        ):
+            return target_global_batch(
+                ir.tuning_config.get("target_global_batch_size", None),
+                ir.tuning_config.get("target_global_batch_tokens", None),
+                seq_len,
+            )
+        return (
+            int(ir.tuning_config.get("per_device_train_batch_size", 1) or 1)
+            * int(ir.tuning_config.get("gradient_accumulation_steps", 1) or 1)
+            * num_gpus
+        )
+
+    def sweep(self, ir: IR, top_k: int = 10) -> list[dict]:
+        """Top k feasible candidates around the recommended configuration in ir
+
+        Args:
+            ir (IR): IR as produced by the rule engine, model_name_or_path
+                must be a local folder
+            top_k (int): number of candidates to return
+
+        Returns:
+            list[dict]: candidates best first with their settings, the global
+            batch size and its target, predicted_tokens_per_second and
+            memory_gib per GPU
+        """
+        model_config = get_model_facts(ir.tuning_config["model_name_or_path"]).config
+        num_nodes = int(ir.compute_config.get("num_nodes", DEFAULT_NUM_NODES))
+        num_gpus_per_node = int(
+            ir.compute_config.get("num_gpus_per_node", DEFAULT_NUM_GPUS_PER_NODE)
+        )
+        num_gpus = num_nodes * num_gpus_per_node
+        seq_len = int(ir.tuning_config.get("max_seq_length", 2048))
+        tuning_strategy = ir.tuning_config.get("tuning_strategy", "full")
+        margin = float(
+            ir.tuning_config.get("memory_safety_margin", DEFAULT_MEMORY_SAFETY_MARGIN)
+        )
+        supports_fast_kernels = (
+            get_model_facts(ir.tuning_config["model_name_or_path"]).architecture
+            in ApplyFastKernelsOptimization.supported_model_archs
+        )
+        grid = self._grid(num_nodes, supports_fast_kernels)
+
+        memory = np.zeros(len(grid["per_device_train_batch_size"]))
+        for strategy in np.unique(grid["fsdp_sharding_strategy"]):
+            mask = grid["fsdp_sharding_strategy"] == strategy
+            memory[mask] = estimate_memory(
+                model_config,
+                tuning_strategy,
+                per_device_batch_size=grid["per_device_train_batch_size"][mask],
+                seq_len=seq_len,
+                sharding_degree=(
+                    num_gpus_per_node if strategy == "HYBRID_SHARD" else num_gpus
+                ),
+                sharding_strategy=strategy,
+                dtype=ir.tuning_config.get("torch_dtype", "bfloat16"),
+                gradient_checkpointing=grid["gradient_checkpointing"][mask],
+                lora_r=int(ir.tuning_config.get("r", 8)),
+            ).total
+        feasible = memory <= gpu_memory_bytes(ir.compute_config) * (1 - margin)
+
+        target = self._target_global_batch(ir, num_gpus, seq_len)
+        global_batch = (
+            grid["per_device_train_batch_size"]
+            * grid["gradient_accumulation_steps"]
+            * num_gpus
+        )
+        batch_error = np.abs(global_batch - target)
+        if feasible.any():
+            # larger accumulation always predicts faster, only candidates as
+            # close to the target global batch as possible are comparable
+            feasible &= batch_error == batch_error[feasible].min()
+
+        reference_tps, reference_batch, source = self._reference_throughput(
+            ir, model_config
+        )
+        # the reference is measured with the recommender's defaults, fast
+        # kernels are only enabled for the models supporting them
+        reference_speed = self._relative_speed(
+            reference_batch,
+            1,
+            "FULL_SHARD",
+            True,
+            "padding_free",
+            supports_fast_kernels,
+            seq_len,
+            num_gpus,
+        )
+        speed = self._relative_speed(
+            grid["per_device_train_batch_size"],
+            grid["gradient_accumulation_steps"],
+            grid["fsdp_sharding_strategy"],
+            grid["gradient_checkpointing"],
+            grid["padding"],
+            grid["fast_kernels"],
+            seq_len,
+            num_gpus,
+        )
+        tokens_per_second = reference_tps * num_gpus * speed / reference_speed
+        logger.debug(
+            f"Swept {len(feasible)} candidates, {int(feasible.sum())} fit in memory"
+        )
+
+        order = np.lexsort((memory, -tokens_per_second))
+        order = order[feasible[order]][:top_k]
+        return [
+            {
+                "per_device_train_batch_size": int(
+                    grid["per_device_train_batch_size"][i]
+                ),
+                "gradient_accumulation_steps": int(
+                    grid["gradient_accumulation_steps"][i]
+                ),
+                "fsdp_sharding_strategy": str(grid["fsdp_sharding_strategy"][i]),
+                "gradient_checkpointing": bool(grid["gradient_checkpointing"][i]),
+                "padding": str(grid["padding"][i]),
+                "fast_kernels": bool(grid["fast_kernels"][i]),
+                "global_batch_size": int(global_batch[i]),
+                "target_global_batch_size": target,
+                "predicted_tokens_per_second": round(float(tokens_per_second[i]), 1),
+                "memory_gib": round(float(memory[i]) / GIB, 2),
+                "throughput_source": source,
+            }
+            for i in order
+        ]
+
+    @staticmethod
+    def candidate_ir(ir: IR, candidate: dict) -> IR:
+        """Copy of ir with the settings of a candidate applied"""
+        ir = deepcopy(ir)
+        ir.tuning_config["per_device_train_batch_size"] = candidate[
+            "per_device_train_batch_size"
+        ]
+        ir.tuning_config["gradient_accumulation_steps"] = candidate[
+            "gradient_accumulation_steps"
+        ]
+        ir.tuning_config["gradient_checkpointing"] = candidate["gradient_checkpointing"]
+        ir.tuning_config.pop("padding_free", None)
+        ir.tuning_config.pop("packing", None)
+        if candidate["padding"] == "padding_free":
+            ir.tuning_config["padding_free"] = "huggingface"
+        elif candidate["padding"] == "packing":
+            ir.tuning_config["packing"] = "True"
+        if candidate["fast_kernels"]:
+            ir.tuning_config["fast_kernels"] = ["True", "True", "True"]
+        else:
+            ir.tuning_config.pop("fast_kernels", None)
+        if candidate["fsdp_sharding_strategy"] == "NO_SHARD":
+            ir.accelerate_config["distributed_type"] = "MULTI_GPU"
+            ir.accelerate_config.pop("fsdp_config", None)
+            return ir
+        ir.accelerate_config["distributed_type"] = "FSDP"
+        ir.accelerate_config["fsdp_config"] = {
+            **(ir.accelerate_config.get("fsdp_config", None) or {}),
+            "fsdp_sharding_strategy": candidate["fsdp_sharding_strategy"],
+        }
+        return ir
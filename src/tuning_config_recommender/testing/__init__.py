@@ -0,0 +1,7 @@
+"""Offline stand-ins for the HF hub, the min gpu estimator, a Redis server and
+training datasets to run, load test and profile the full pipeline without network access"""
+
+from .datasets import generate_dataset, generate_records
+from .estimator import StubMinGpuRecommender, stub_estimator
+from .fake_hub import SYNTHETIC_MODELS, fake_hub, seed_mirror, synthetic_models
+from .fake_redis import FakeRedisServer, fake_redis
@@ -0,0 +1,102 @@
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DATASET_KINDS = ["chat", "qa"]
+DATASET_FORMATS = [".jsonl", ".json", ".parquet", ".csv"]
+
+_VOCABULARY = (
+    "the model training data batch token sequence gradient memory kernel "
+    "throughput accelerator shard layer attention weight optimizer step loss "
+    "learning rate schedule checkpoint adapter rank cluster node device "
+    "question answer explain describe summarize compare list why how what"
+).split()
+
+
+def _texts(rng: np.random.Generator, count: int, min_words: int, max_words: int):
+    lengths = rng.integers(min_words, max_words + 1, size=count)
+    words = np.asarray(_VOCABULARY)[rng.integers(0, len(_VOCABULARY), lengths.sum())]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return [
+        " ".join(words[start:end])
+        for start, end in zip(offsets[:-1], offsets[1:], strict=True)
+    ]
+
+
+def generate_records(
+    num_samples: int = 1000,
+    kind: str = "qa",
+    seed: int = 0,
+    min_words: int = 16,
+    max_words: int = 256,
+    turns: int = 2,
+) -> list[dict]:
+    """Reproducible synthetic training samples
+
+    Args:
+        num_samples (int): number of samples
+        kind (str): qa for instruction/response records, chat for records
+            with a messages list of role/content turns
+        seed (int): random seed
+        min_words (int): minimum words per text field
+        max_words (int): maximum words per text field
+        turns (int): user/assistant exchanges per chat sample
+
+    Returns:
+        list[dict]: samples
+    """
+    if kind not in DATASET_KINDS:
+        raise ValueError(f"kind should be one of {DATASET_KINDS}, got {kind}")
+    rng = np.random.default_rng(seed)
+    if kind == "qa":
+        questions = _texts(rng, num_samples, min_words, max_words)
+        answers = _texts(rng, num_samples, min_words, max_words)
+        return [
+            {"instruction": q, "response": a}
+            for q, a in zip(questions, answers, strict=True)
+        ]
+    texts = _texts(rng, num_samples * turns * 2, min_words, max_words)
+    return [
+        {
+            "messages": [
+                {"role": "user" if j % 2 == 0 else "assistant", "content": text}
+                for j, text in enumerate(texts[i * turns * 2 : (i + 1) * turns * 2])
+            ]
+        }
+        for i in range(num_samples)
+    ]
+
+
+def generate_dataset(
+    path: str | Path, num_samples: int = 1000, kind: str = "qa", **kwargs
+) -> Path:
+    """Write synthetic samples to path in the format given by its extension
+    (.jsonl, .json, .parquet or .csv). Remaining keyword arguments are passed
+    to generate_records.
+
+    Returns:
+        Path: path of the written dataset
+    """
+    path = Path(path)
+    if path.suffix not in DATASET_FORMATS:
+        raise ValueError(
+            f"format should be one of {DATASET_FORMATS}, got {path.suffix}"
+        )
+    if kind == "chat" and path.suffix == ".csv":
+        raise ValueError("chat samples hold a list of messages, which csv cannot")
+    records = generate_records(num_samples, kind, **kwargs)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".jsonl":
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+    elif path.suffix == ".json":
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(records, f)
+    elif path.suffix == ".parquet":
+        pd.DataFrame.from_records(records).to_parquet(path)
+    else:
+        pd.DataFrame.from_records(records).to_csv(path, index=False)
+    return path
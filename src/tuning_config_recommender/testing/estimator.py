@@ -0,0 +1,113 @@
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from tuning_config_recommender.actions import compute
+from tuning_config_recommender.constants import DEFAULT_MEMORY_SAFETY_MARGIN
+from tuning_config_recommender.utils.isolation import ProcessIsolatedRunner
+from tuning_config_recommender.utils.memory_estimator import (
+    gpu_memory_bytes,
+    max_batch_size_that_fits,
+)
+
+from .fake_hub import SYNTHETIC_MODELS
+
+INFEASIBLE = {"workers": -1, "gpus_per_worker": -1}
+
+
+class StubMinGpuRecommender:
+    """Deterministic stand-in for fm_training_estimator's MinGpuRecommenderCaller.
+
+    A configuration is feasible when the analytic memory model fits the per
+    device batch on gpus_per_worker GPUs with FULL_SHARD. Models are looked up
+    by name in models, unknown models are feasible from 8 GPUs on. Every call
+    sleeps latency seconds to mimic the cost of the real regressor.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        models: dict | None = None,
+        memory_safety_margin: float = DEFAULT_MEMORY_SAFETY_MARGIN,
+    ):
+        self.latency = latency
+        self.memory_safety_margin = memory_safety_margin
+        self.models = {
+            repo_id.split("/")[-1].lower(): config
+            for repo_id, config in (models or SYNTHETIC_MODELS).items()
+        }
+
+    def run(self, configuration: dict, y: str = "min_gpu") -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        gpus = int(configuration["gpus_per_worker"])
+        model_config = self.models.get(str(configuration["model_name"]).lower())
+        if model_config is None:
+            return {"workers": 1, "gpus_per_worker": gpus} if gpus >= 8 else INFEASIBLE
+        per_device_batch_size = max(int(configuration["batch_size"]) // gpus, 1)
+        fits = max_batch_size_that_fits(
+            model_config,
+            gpu_memory_bytes({"gpu_model": configuration["gpu_model"]}),
+            self.memory_safety_margin,
+            tuning_strategy=configuration["method"],
+            seq_len=int(configuration["tokens_per_sample"]),
+            sharding_degree=gpus,
+        )
+        if fits < per_device_batch_size:
+            return INFEASIBLE
+        return {"workers": 1, "gpus_per_worker": gpus}
+
+
+@contextmanager
+def stub_estimator(
+    latency: float = 0.0,
+    models: dict | None = None,
+    isolation: str = "inline",
+    timeout: float = 30.0,
+):
+    """Route ApplyComputeConfig to StubMinGpuRecommender for the duration of
+    the context, also when autoconf is not installed.
+
+    Args:
+        latency (float): seconds every estimator call takes
+        models (dict): repo id to config.json known to the stub
+        isolation (str): inline to call the stub in the request thread or
+            process to go through the isolated worker pool like the real one
+        timeout (float): per call timeout of the worker pool
+
+    Yields:
+        StubMinGpuRecommender: the stub, in process isolation a copy of it
+        lives in each worker
+    """
+    stub = StubMinGpuRecommender(latency=latency, models=models)
+    patched = {
+        "skip_autoconf": False,
+        "ESTIMATOR_ISOLATION": isolation,
+        "_RECOMMENDER": stub,
+        "_RUNNER": None,
+    }
+    if isolation == "process":
+        patched["_RUNNER"] = ProcessIsolatedRunner(
+            initializer=compute._init_estimator_worker,
+            initargs=(partial(StubMinGpuRecommender, latency=latency, models=models),),
+            timeout=timeout,
+        )
+    if compute.skip_autoconf:
+        # model names are used as is without autoconf's name mapping
+        patched["map_valid_model_name"] = lambda name: name
+    missing = object()
+    previous = {name: getattr(compute, name, missing) for name in patched}
+    for name, value in patched.items():
+        setattr(compute, name, value)
+    compute._run_min_gpu_recommender.cache_clear()
+    try:
+        yield stub
+    finally:
+        if patched["_RUNNER"] is not None:
+            patched["_RUNNER"].shutdown()
+        for name, value in previous.items():
+            if value is missing:
+                delattr(compute, name)
+            else:
+                setattr(compute, name, value)
+        compute._run_min_gpu_recommender.cache_clear()
@@ -0,0 +1,186 @@
+import json
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from tuning_config_recommender.utils import model_store
+from tuning_config_recommender.utils.model_store import ModelMetadataStore
+
+CHAT_TEMPLATE = (
+    "{%- for message in messages %}"
+    "{{- '<|start_of_role|>' + message['role'] + '<|end_of_role|>' "
+    "+ message['content'] + '<|end_of_text|>\n' }}"
+    "{%- endfor %}"
+    "{%- if add_generation_prompt %}"
+    "{{- '<|start_of_role|>assistant<|end_of_role|>' }}"
+    "{%- endif %}"
+)
+SPECIAL_TOKENS = ["<|start_of_role|>", "<|end_of_role|>", "<|end_of_text|>"]
+
+
+def _decoder(
+    model_type: str,
+    architecture: str,
+    hidden_size: int,
+    num_hidden_layers: int,
+    num_attention_heads: int,
+    num_key_value_heads: int,
+    intermediate_size: int,
+    vocab_size: int,
+    **extra,
+) -> dict:
+    return {
+        "architectures": [architecture],
+        "model_type": model_type,
+        "hidden_size": hidden_size,
+        "num_hidden_layers": num_hidden_layers,
+        "num_attention_heads": num_attention_heads,
+        "num_key_value_heads": num_key_value_heads,
+        "intermediate_size": intermediate_size,
+        "vocab_size": vocab_size,
+        "max_position_embeddings": 131072,
+        "torch_dtype": "bfloat16",
+        **extra,
+    }
+
+
+# config.json of popular architectures with the shapes of the real models
+SYNTHETIC_MODELS = {
+    "ibm-granite/granite-3.1-2b-base": _decoder(
+        "granite", "GraniteForCausalLM", 2048, 40, 32, 8, 8192, 49155
+    ),
+    "ibm-granite/granite-3.1-2b-instruct": _decoder(
+        "granite", "GraniteForCausalLM", 2048, 40, 32, 8, 8192, 49155
+    ),
+    "ibm-granite/granite-3.1-8b-base": _decoder(
+        "granite", "GraniteForCausalLM", 4096, 40, 32, 8, 12800, 49155
+    ),
+    "ibm-granite/granite-3.1-8b-instruct": _decoder(
+        "granite", "GraniteForCausalLM", 4096, 40, 32, 8, 12800, 49155
+    ),
+    "ibm-granite/granite-3.1-3b-a800m-instruct": _decoder(
+        "granitemoe",
+        "GraniteMoeForCausalLM",
+        1536,
+        32,
+        24,
+        8,
+        512,
+        49155,
+        num_local_experts=40,
+        num_experts_per_tok=8,
+    ),
+    "meta-llama/Llama-3.1-8B": _decoder(
+        "llama", "LlamaForCausalLM", 4096, 32, 32, 8, 14336, 128256
+    ),
+    "meta-llama/Llama-3.1-8B-Instruct": _decoder(
+        "llama", "LlamaForCausalLM", 4096, 32, 32, 8, 14336, 128256
+    ),
+    "meta-llama/Llama-3.1-70B": _decoder(
+        "llama", "LlamaForCausalLM", 8192, 80, 64, 8, 28672, 128256
+    ),
+    "mistralai/Mistral-7B-v0.1": _decoder(
+        "mistral", "MistralForCausalLM", 4096, 32, 32, 8, 14336, 32000
+    ),
+    "mistralai/Mixtral-8x7B-v0.1": _decoder(
+        "mixtral",
+        "MixtralForCausalLM",
+        4096,
+        32,
+        32,
+        8,
+        14336,
+        32000,
+        num_local_experts=8,
+        num_experts_per_tok=2,
+    ),
+    "Qwen/Qwen2.5-7B-Instruct": _decoder(
+        "qwen2", "Qwen2ForCausalLM", 3584, 28, 28, 4, 18944, 152064
+    ),
+    "bigcode/starcoder": {
+        "architectures": ["GPTBigCodeForCausalLM"],
+        "model_type": "gpt_bigcode",
+        "n_embd": 6144,
+        "n_layer": 40,
+        "n_head": 48,
+        "n_inner": 24576,
+        "multi_query": True,
+        "vocab_size": 49152,
+    },
+}
+
+
+def synthetic_models(count: int, seed: int = 0) -> dict:
+    """count llama style models of random but reproducible sizes, named
+    synthetic/model-<i>, for load tests over many distinct models"""
+    rng = np.random.default_rng(seed)
+    models = {}
+    for i in range(count):
+        num_heads = int(rng.choice([8, 16, 32, 64]))
+        hidden_size = num_heads * 128
+        models[f"synthetic/model-{i}"] = _decoder(
+            "llama",
+            "LlamaForCausalLM",
+            hidden_size,
+            int(rng.integers(12, 81)),
+            num_heads,
+            int(rng.choice([1, 4, 8])),
+            int(hidden_size * rng.choice([2.75, 3.5, 4])),
+            int(rng.choice([32000, 49155, 128256])),
+        )
+    return models
+
+
+def tokenizer_config_for(repo_id: str) -> dict:
+    tokenizer_config = {"model_max_length": 131072, "eos_token": "<|end_of_text|>"}
+    if "instruct" in repo_id.lower():
+        tokenizer_config["chat_template"] = CHAT_TEMPLATE
+        tokenizer_config["additional_special_tokens"] = SPECIAL_TOKENS
+    return tokenizer_config
+
+
+def seed_mirror(mirror_dir: str | Path, models: dict | None = None) -> list[str]:
+    """Write config.json and tokenizer_config.json of models into mirror_dir
+    laid out as the model metadata store expects (<repo_id>/<file>)
+
+    Args:
+        mirror_dir: folder to seed
+        models (dict): repo id to config.json, defaults to SYNTHETIC_MODELS
+
+    Returns:
+        list[str]: seeded repo ids
+    """
+    models = SYNTHETIC_MODELS if models is None else models
+    for repo_id, config in models.items():
+        model_dir = Path(mirror_dir) / repo_id
+        model_dir.mkdir(parents=True, exist_ok=True)
+        (model_dir / "config.json").write_text(json.dumps(config, indent=2))
+        (model_dir / "tokenizer_config.json").write_text(
+            json.dumps(tokenizer_config_for(repo_id), indent=2)
+        )
+    return list(models)
+
+
+@contextmanager
+def fake_hub(root: str | Path, models: dict | None = None):
+    """Serve model metadata from a seeded mirror without reaching the HF hub.
+
+    Replaces the process wide model metadata store with an offline store
+    under root for the duration of the context.
+
+    Yields:
+        ModelMetadataStore: the offline store
+    """
+    root = Path(root)
+    seed_mirror(root / "mirror", models)
+    store = ModelMetadataStore(
+        root=root / "store", mirror_dir=root / "mirror", offline=True
+    )
+    with model_store._STORE_GUARD:
+        previous, model_store._STORE = model_store._STORE, store
+    try:
+        yield store
+    finally:
+        with model_store._STORE_GUARD:
+            model_store._STORE = previous
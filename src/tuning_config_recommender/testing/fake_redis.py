@@ -0,0 +1,133 @@
+import socket
+import socketserver
+import threading
+import time
+from contextlib import contextmanager
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """Local stand-in for a Redis server with the commands used by RedisCache:
+    PING, AUTH, SELECT, GET, SET (with EX or PX), DEL and FLUSHALL. Values are
+    kept in memory of the test process, expiry uses its monotonic clock.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password: str | None = None):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.password = password
+        self.data = {}
+        self.commands = []
+        self.connections = set()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}127.0.0.1:{self.server_address[1]}/0"
+
+    def drop_connections(self):
+        """Close the connections of all clients as a restarted server would"""
+        with self.lock:
+            connections, self.connections = self.connections, set()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def execute(self, args: list[bytes], authenticated: bool):
+        name = args[0].decode().upper()
+        with self.lock:
+            self.commands.append(name)
+            if name == "AUTH":
+                if args[1].decode() != self.password:
+                    return _CommandError("WRONGPASS invalid password")
+                return "OK"
+            if self.password and not authenticated:
+                return _CommandError("NOAUTH Authentication required.")
+            if name == "PING":
+                return "PONG"
+            if name == "SELECT":
+                return "OK"
+            if name == "FLUSHALL":
+                self.data.clear()
+                return "OK"
+            if name == "GET":
+                value = self.data.get(args[1])
+                if value is None:
+                    return None
+                if value[1] <= time.monotonic():
+                    del self.data[args[1]]
+                    return None
+                return value[0]
+            if name == "SET":
+                expires = float("inf")
+                options = [a.decode().upper() for a in args[3::2]]
+                for option, amount in zip(options, args[4::2], strict=True):
+                    scale = 1.0 if option == "EX" else 0.001
+                    expires = time.monotonic() + int(amount) * scale
+                self.data[args[1]] = (args[2], expires)
+                return "OK"
+            if name == "DEL":
+                return sum(self.data.pop(key, None) is not None for key in args[1:])
+            return _CommandError(f"ERR unknown command '{name}'")
+
+
+class _CommandError(str):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+        authenticated = False
+        while True:
+            args = self._read_command()
+            if args is None:
+                return
+            reply = self.server.execute(args, authenticated)
+            if args[0].upper() == b"AUTH" and reply == "OK":
+                authenticated = True
+            self.wfile.write(_encode(reply))
+
+    def _read_command(self) -> list[bytes] | None:
+        line = self.rfile.readline()
+        if not line.startswith(b"*"):
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+
+def _encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, _CommandError):
+        return f"-{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    return f"${len(reply)}\r\n".encode() + reply + b"\r\n"
+
+
+@contextmanager
+def fake_redis(password: str | None = None):
+    """Run a FakeRedisServer on a free local port for the duration of the context
+
+    Yields:
+        FakeRedisServer: the server, its url is passed to RedisCache
+    """
+    server = FakeRedisServer(password)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
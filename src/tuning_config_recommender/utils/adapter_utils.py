@@ -8,22 +8,9 @@ import yaml
 DYNAMIC_PATTERN = re.compile(r"^\$\{([A-Za-z0-9_]+)\}$")
 
 
-def safe_serialize(obj):
-    if obj is None or isinstance(obj, (str, int, float, bool)):
-        return obj
-    if isinstance(obj, (list, tuple, set)):
-        return [safe_serialize(o) for o in obj]
-    if isinstance(obj, dict):
-        return {str(k): safe_serialize(v) for k, v in obj.items()}
-    if hasattr(obj, "__dict__"):
-        return safe_serialize(obj.__dict__)
-    return str(obj)
-
-
-def write_yaml_preserving_templates(obj: Any, path: Path):
-    clean_obj = safe_serialize(obj)
-    with path.open("w", encoding="utf-8") as f:
-        yaml.safe_dump(clean_obj, f, sort_keys=False, allow_unicode=True, width=10000)
+def dump_yaml(clean_obj: Any) -> str:
+    """YAML of an object that holds plain values only, see to_jsonable"""
+    return yaml.safe_dump(clean_obj, sort_keys=False, allow_unicode=True, width=10000)
 
 
 def split_static_and_dynamic(cfg: dict):
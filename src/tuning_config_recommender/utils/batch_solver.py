@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def target_global_batch(
+    target_global_batch_size: int | None = None,
+    target_global_batch_tokens: int | None = None,
+    seq_len: int = 2048,
+) -> int:
+    """Target global batch in samples, a token target is converted with seq_len"""
+    if target_global_batch_size is None:
+        if target_global_batch_tokens is None:
+            raise ValueError(
+                "either target_global_batch_size or target_global_batch_tokens is required"
+            )
+        return max(round(int(target_global_batch_tokens) / int(seq_len)), 1)
+    return int(target_global_batch_size)
+
+
+def solve_global_batch(
+    num_processes: int,
+    max_per_device_batch_size: int,
+    target_global_batch_size: int | None = None,
+    target_global_batch_tokens: int | None = None,
+    seq_len: int = 2048,
+) -> dict:
+    """Split a target global batch into per device batch and gradient accumulation.
+
+    global batch = per_device_train_batch_size * gradient_accumulation_steps
+    * num_processes. Among per device batch sizes up to the largest that fits,
+    the one whose global batch is closest to the target is picked, preferring
+    larger per device batches (fewer accumulation steps) on ties. The result
+    only depends on the target and num_processes, so the global batch stays
+    the same when nodes are added as long as it divides evenly.
+
+    Args:
+        num_processes (int): number of data parallel processes
+        max_per_device_batch_size (int): largest per device batch that fits
+        target_global_batch_size (int): target in samples
+        target_global_batch_tokens (int): target in tokens, used when
+            target_global_batch_size is not given
+        seq_len (int): tokens per sample to convert a token target
+
+    Returns:
+        dict: per_device_train_batch_size, gradient_accumulation_steps,
+        global_batch_size, target_global_batch_size and relative_error
+    """
+    target = target_global_batch(
+        target_global_batch_size, target_global_batch_tokens, seq_len
+    )
+    num_processes = max(int(num_processes), 1)
+    per_device = np.arange(1, max(int(max_per_device_batch_size), 1) + 1)
+    accumulation = np.maximum(np.rint(target / (per_device * num_processes)), 1)
+    global_batch = per_device * accumulation * num_processes
+    error = np.abs(global_batch - target)
+    # smallest error first, then the largest per device batch
+    best = np.lexsort((-per_device, error))[0]
+    return {
+        "per_device_train_batch_size": int(per_device[best]),
+        "gradient_accumulation_steps": int(accumulation[best]),
+        "global_batch_size": int(global_batch[best]),
+        "target_global_batch_size": target,
+        "relative_error": float(error[best] / target),
+    }
@@ -5,9 +5,10 @@ from pathlib import Path
 import yaml
 
 from tuning_config_recommender.utils.data_processing import (
+    load_first_record,
     load_model_file_from_hf,
-    load_training_data,
 )
+from tuning_config_recommender.utils.model_facts import get_model_facts
 from tuning_config_recommender.utils.tuning_config import (
     fetch_from_knowledge_base,
 )
@@ -16,8 +17,7 @@ from tuning_config_recommender.utils.tuning_config import (
 def fetch_chat_template(model_name_or_path: str):
     """Given a model HF ID or Path, fetch the chat template (instruct model)"""
     if os.path.isdir(model_name_or_path):
-        with open(f"{model_name_or_path}/tokenizer_config.json", encoding="utf-8") as f:
-            config = json.load(f)
+        config = get_model_facts(model_name_or_path).tokenizer_config
 
     elif (
         result := fetch_from_knowledge_base(
@@ -48,8 +48,7 @@ def fetch_chat_template(model_name_or_path: str):
 
 def determine_input_and_response_text(training_data_path: str) -> dict:
     """Determine the input and response field for the data formating template (Q/A format dataset)"""
-    data = load_training_data(training_data_path)
-    data_item = data[0]
+    data_item = load_first_record(training_data_path)
     columns = list(data_item.keys())
     columns = [k.lower() for k in columns]
 
@@ -3,13 +3,24 @@ import json
 import os
 import re
 import shutil
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
 
 import pandas as pd
+import pyarrow.parquet as pq
 from datasets import load_dataset
 from huggingface_hub import hf_hub_download
 from loguru import logger
 
+from tuning_config_recommender.metrics import STAGE_SECONDS, cache_lookup, record_miss
+from tuning_config_recommender.utils.model_store import get_model_store
+from tuning_config_recommender.utils.single_flight import SingleFlight
+
+# first records of datasets kept per process, full datasets are not cached
+DATASET_CACHE_SIZE = int(os.environ.get("TCR_DATASET_CACHE_SIZE", 64))
+_DATASET_FLIGHT = SingleFlight()
+
 
 def extract_data_from_general_file(file_path) -> dict:
     """Data extraction function from json/jsonl/parquet/arrow files"""
@@ -56,10 +67,28 @@ def pick_train_split(dataset) -> str:
     return splits[0]
 
 
+def _file_version(training_data_path: str) -> tuple | None:
+    try:
+        stat = os.stat(training_data_path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
 def load_training_data(training_data_path: str) -> dict:
-    """Load and validate training data based on training_data_path."""
-    _dataset_cache = {}
+    """Load and validate training data based on training_data_path.
+
+    Concurrent loads of the same dataset wait for a single load and share its
+    result, it must not be modified. Loaded datasets are not cached, use
+    load_first_record or load_training_data_head when a part is enough.
+    """
+    with STAGE_SECONDS.time(stage="dataset_probe"):
+        key = (training_data_path, _file_version(training_data_path))
+        return _DATASET_FLIGHT.do(key, _load_training_data, *key)
+
 
+def _load_training_data(training_data_path: str, version: tuple | None):
+    # version is part of the single flight key so that updated files are loaded again
     # Check if path is a file
     if os.path.isfile(training_data_path):
         data = extract_data_from_general_file(training_data_path)
@@ -80,6 +109,59 @@ def load_training_data(training_data_path: str) -> dict:
     )
 
 
+def load_first_record(training_data_path: str) -> dict | None:
+    """First record of a dataset, None when it holds no records
+
+    Format checks only look at the first record. Records are cached keyed by
+    path and file version and shared by all callers, they must not be
+    modified.
+    """
+    with cache_lookup("dataset"):
+        key = (training_data_path, _file_version(training_data_path))
+        return _DATASET_FLIGHT.do(("first_record", *key), _load_first_record, *key)
+
+
+@lru_cache(maxsize=DATASET_CACHE_SIZE)
+def _load_first_record(training_data_path: str, version: tuple | None):
+    record_miss()
+    head = load_training_data_head(training_data_path, 1)
+    if isinstance(head, list) and head and isinstance(head[0], dict):
+        return head[0]
+    return None
+
+
+def load_training_data_head(training_data_path: str, max_records: int) -> list[dict]:
+    """First max_records records of a dataset without loading all of it
+
+    jsonl, csv and parquet files are read up to max_records, folders and HF
+    dataset ids are streamed. Other files are loaded fully and cut.
+    """
+    with STAGE_SECONDS.time(stage="dataset_probe"):
+        if os.path.isfile(training_data_path):
+            ext = os.path.splitext(training_data_path)[-1].lower()
+            if ext == ".jsonl":
+                with open(training_data_path, encoding="utf-8") as f:
+                    lines = (line for line in f if line.strip())
+                    return [json.loads(line) for line in islice(lines, max_records)]
+            if ext == ".csv":
+                with open(training_data_path, encoding="utf-8") as f:
+                    return list(islice(csv.DictReader(f), max_records))
+            if ext == ".parquet":
+                batches = pq.ParquetFile(training_data_path).iter_batches(
+                    batch_size=max(max_records, 1)
+                )
+                batch = next(batches, None)
+                return batch.to_pylist()[:max_records] if batch is not None else []
+            data = load_training_data(training_data_path)
+            return data[:max_records] if isinstance(data, list) else data
+        try:
+            dataset = load_dataset(training_data_path, streaming=True)
+            split = pick_train_split(dataset)
+            return [dict(example) for example in islice(dataset[split], max_records)]
+        except Exception as e:
+            raise ValueError(f"Error loading dataset from folder or hf id: {e}") from e
+
+
 def load_model_file_from_hf(model_name_or_path: str, file_name: str) -> dict:
     """Load contens of a specific file of a model. Supports both the local file system and HF hub."""
     try:
@@ -111,27 +193,16 @@ def escape_newlines_in_strings(template_str: str) -> str:
     return re.sub(pattern, replace_newlines, template_str, flags=re.DOTALL)
 
 
-def get_model_path(model_name_or_path: str, unique_tag: str) -> str:
-    """Given an indirect model name or path, pick out the exact model name"""
-    model_name_or_path = Path(model_name_or_path)
-    files_to_download = [
-        "config.json",
-        "tokenizer_config.json",
-    ]
+def get_model_path(
+    model_name_or_path: str, unique_tag: str = "", revision: str = "main"
+) -> str:
+    """Given an indirect model name or path, pick out the exact model name
 
+    Local folders are returned as is, HF model IDs are resolved to a folder
+    holding config.json and tokenizer_config.json from the model metadata store.
+    unique_tag is kept for backward compatibility, the store is keyed by
+    (model, revision) and shared across tags.
+    """
     if os.path.isdir(model_name_or_path):
         return str(model_name_or_path)
-    else:
-        BASE_DIR = Path(__file__).parent.parent
-        cached_model_path = (
-            BASE_DIR / "cached_files" / "models" / model_name_or_path / unique_tag
-        )
-        os.makedirs(cached_model_path, exist_ok=True)
-
-        for filename in files_to_download:
-            src = hf_hub_download(str(model_name_or_path), filename=filename)
-            dst = os.path.join(cached_model_path, filename)
-            shutil.copy(src, dst)
-        model_name_or_path = cached_model_path
-
-    return str(model_name_or_path)
+    return get_model_store().get(str(model_name_or_path), revision=revision)
@@ -1,3 +1,7 @@
+import hashlib
+import json
+
+
 def set_difference(l1, l2):
     # l1 - l2
     diff = []
@@ -14,3 +18,19 @@ def set_issubset(l1, l2):
         if item not in l1:
             return False
     return issubset
+
+
+def canonical_hash(payload) -> str:
+    # equal for payloads that only differ in the order of their keys
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def exhaust(generator):
+    # run a generator to its end and return its return value
+    while True:
+        try:
+            next(generator)
+        except StopIteration as e:
+            return e.value
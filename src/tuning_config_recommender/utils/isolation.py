@@ -0,0 +1,333 @@
+import asyncio
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from loguru import logger
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class PoolFullError(RuntimeError):
+    def __init__(self, retry_after: int):
+        super().__init__(f"worker pool is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for cooldown seconds after
+    failure_threshold consecutive failures, a single trial call is let
+    through once the cooldown is over."""
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.cooldown:
+                # half open, the next failure opens the circuit again
+                self._opened_at = None
+                self._failures = self.failure_threshold - 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._opened_at is None:
+                logger.warning(
+                    f"Circuit opened after {self._failures} consecutive failures"
+                )
+                self._opened_at = time.monotonic()
+
+
+def _ready() -> bool:
+    return True
+
+
+def _terminate(executor: ProcessPoolExecutor):
+    # shutdown does not stop a worker stuck in a call, kill them
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _IsolatedWorker:
+    """Single worker process of a ProcessIsolatedRunner, in its own executor so
+    that it can be killed without breaking the calls of the other workers"""
+
+    def __init__(self, runner: "ProcessIsolatedRunner"):
+        self.runner = runner
+        self._executor = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def launch(self):
+        """Spawn the process if needed, returns the executor and the future of
+        its start up call without waiting for it"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.runner.initializer,
+                    initargs=self.runner.initargs,
+                )
+                # the start up cost is not charged against the timeout of a call
+                self._started = self._executor.submit(_ready)
+            return self._executor, self._started
+
+    def executor(self) -> ProcessPoolExecutor:
+        """Executor of the worker once it is started"""
+        executor, started = self.launch()
+        try:
+            started.result(timeout=self.runner.startup_timeout)
+        except Exception:
+            self.recycle(executor)
+            raise
+        return executor
+
+    def recycle(self, executor: ProcessPoolExecutor | None = None):
+        with self._lock:
+            if executor is None or executor is self._executor:
+                executor, self._executor = self._executor, None
+        if executor is not None:
+            _terminate(executor)
+
+
+class ProcessIsolatedRunner:
+    """Runs functions in dedicated worker processes with a per call timeout.
+
+    Workers are spawned (not forked) so that they do not inherit locks held
+    by threads of the server and are prepared with initializer. A call waits
+    for an idle worker first, its timeout starts once a worker is running it.
+    A call that times out or crashes its worker kills that worker only, it is
+    started again on its next call. Failures are tracked by a circuit breaker
+    so that a dependency that keeps failing is not called until its cooldown
+    is over.
+
+    Args:
+        initializer: called with initargs in every worker on start
+        timeout (float): seconds to wait for a single call once it runs
+        startup_timeout (float): seconds to wait for a worker to start and
+            run initializer
+        max_workers (int): number of worker processes
+        breaker (CircuitBreaker): breaker to record call outcomes on
+    """
+
+    def __init__(
+        self,
+        initializer=None,
+        initargs: tuple = (),
+        timeout: float = 30.0,
+        startup_timeout: float = 300.0,
+        max_workers: int = 2,
+        breaker: CircuitBreaker | None = None,
+    ):
+        self.initializer = initializer
+        self.initargs = initargs
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.max_workers = max_workers
+        self.breaker = breaker or CircuitBreaker()
+        self._workers = [_IsolatedWorker(self) for _ in range(max_workers)]
+        self._idle = queue.SimpleQueue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def start(self):
+        """Start the workers now instead of on their first call"""
+        launched = [worker.launch() for worker in self._workers]
+        for worker, (executor, started) in zip(self._workers, launched, strict=True):
+            try:
+                started.result(timeout=self.startup_timeout)
+            except Exception:
+                worker.recycle(executor)
+                raise
+
+    def recycle(self):
+        """Kill all workers, they are started again on their next call"""
+        logger.warning("Recycling isolated worker pool")
+        for worker in self._workers:
+            worker.recycle()
+
+    def call(self, fn, *args):
+        """Run fn(*args) in a worker and return its result.
+
+        Raises:
+            CircuitOpenError: when the breaker is open
+            TimeoutError: when the call did not finish within timeout
+            Exception: raised by fn or when the worker died
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(
+                "isolated calls are disabled after repeated failures"
+            )
+        worker = self._idle.get()
+        try:
+            return self._call_on(worker, fn, *args)
+        finally:
+            self._idle.put(worker)
+
+    def _call_on(self, worker: _IsolatedWorker, fn, *args):
+        # the circuit may have opened while waiting for the worker
+        if not self.breaker.allow():
+            raise CircuitOpenError(
+                "isolated calls are disabled after repeated failures"
+            )
+        try:
+            executor = worker.executor()
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        try:
+            result = executor.submit(fn, *args).result(timeout=self.timeout)
+        except FutureTimeoutError as e:
+            self.breaker.record_failure()
+            logger.warning("Killing isolated worker after a timed out call")
+            worker.recycle(executor)
+            raise TimeoutError(
+                f"{getattr(fn, '__name__', fn)} did not finish in {self.timeout}s"
+            ) from e
+        except BrokenProcessPool:
+            self.breaker.record_failure()
+            worker.recycle(executor)
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.recycle()
+
+
+class BoundedWorkerPool:
+    """Runs blocking functions off the event loop on a bounded pool of workers.
+
+    At most max_concurrency calls run at once and at most max_queue more wait
+    for a worker, further calls are rejected right away with PoolFullError so
+    that a burst of expensive calls cannot queue up without bound. Workers are
+    spawned processes by default, kind thread runs them in threads of the
+    server instead.
+
+    Args:
+        max_concurrency (int): number of workers
+        max_queue (int): calls allowed to wait for a worker
+        kind (str): process or thread
+        initializer: called with initargs in every worker on start
+    """
+
+    # weight of the latest call in the average latency
+    DURATION_SMOOTHING = 0.2
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        max_queue: int = 16,
+        kind: str = "process",
+        initializer=None,
+        initargs: tuple = (),
+    ):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"kind should be process or thread, got {kind}")
+        self.max_concurrency = max(int(max_concurrency), 1)
+        self.max_queue = max(int(max_queue), 0)
+        self.kind = kind
+        self.initializer = initializer
+        self.initargs = initargs
+        self._executor = None
+        self._pending = 0
+        self._average_duration = 1.0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        """Calls running or waiting for a worker"""
+        return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "thread":
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_concurrency,
+                        thread_name_prefix="tcr-worker",
+                        initializer=self.initializer,
+                        initargs=self.initargs,
+                    )
+                else:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_concurrency,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=self.initializer,
+                        initargs=self.initargs,
+                    )
+            return self._executor
+
+    def retry_after(self) -> int:
+        """Seconds to wait before retrying a rejected call, the recent average
+        latency of calls including their time in the queue"""
+        return max(math.ceil(self._average_duration), 1)
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in a worker and return its result.
+
+        Raises:
+            PoolFullError: when max_concurrency calls run and max_queue wait
+            Exception: raised by fn or when the worker died
+        """
+        with self._lock:
+            if self._pending >= self.max_concurrency + self.max_queue:
+                raise PoolFullError(self.retry_after())
+            self._pending += 1
+        executor = self._get_executor()
+        start = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            self.recycle(executor)
+            raise
+        finally:
+            duration = time.monotonic() - start
+            with self._lock:
+                self._pending -= 1
+                self._average_duration += self.DURATION_SMOOTHING * (
+                    duration - self._average_duration
+                )
+
+    def recycle(self, executor=None):
+        """Tear down the pool, the next call starts a new one"""
+        with self._lock:
+            if executor is None or executor is self._executor:
+                executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self.recycle()
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from tuning_config_recommender.utils.kb_table import (
+    load_model_architectures,
+    load_tuning_run_data,
+)
+
+ARCH_FEATURES = [
+    "hidden_size",
+    "num_hidden_layers",
+    "num_attention_heads",
+    "vocab_size",
+    "num_experts",
+]
+
+# alternative config.json keys used by some architectures
+_ARCH_FEATURE_ALIASES = {
+    "hidden_size": ["hidden_size", "n_embd", "d_model"],
+    "num_hidden_layers": ["num_hidden_layers", "n_layer", "num_layers"],
+    "num_attention_heads": ["num_attention_heads", "n_head"],
+    "vocab_size": ["vocab_size"],
+    "num_experts": ["num_local_experts", "num_experts"],
+}
+
+
+def architecture_features(model_config: dict) -> dict:
+    """Extract the architecture features used for neighbour search from a config.json"""
+    features = {}
+    for feature, keys in _ARCH_FEATURE_ALIASES.items():
+        value = next((model_config[k] for k in keys if model_config.get(k)), 0)
+        features[feature] = int(value or 0)
+    return features
+
+
+def _kb_runs_with_features(tuning_strategy: str) -> pd.DataFrame:
+    runs = load_tuning_run_data()
+    runs = runs[runs["method"] == tuning_strategy]
+    if runs.empty:
+        return runs
+    archs = load_model_architectures()
+    # instruct and base variants share the architecture
+    archs = pd.concat(
+        [
+            archs,
+            archs.assign(
+                model_name=archs["model_name"].str.replace("base", "instruct")
+            ),
+        ]
+    ).drop_duplicates(subset="model_name")
+    return runs.merge(archs, on="model_name", how="inner")
+
+
+def estimate_batch_size_from_neighbours(
+    model_config: dict,
+    tuning_strategy: str,
+    max_seq_length: int,
+    k: int = 3,
+) -> dict:
+    """Estimate per device batch size for a model not present in the KB
+    by interpolating over the k nearest KB runs in architecture space.
+
+    Only runs with the same tuning method are considered. Runs with the same
+    sequence length are preferred, otherwise batch sizes of runs with other
+    sequence lengths are rescaled to keep tokens per device constant.
+
+    Args:
+        model_config (dict): contents of config.json of the model
+        tuning_strategy (str): tuning method such as full, lora
+        max_seq_length (int): sequence length to estimate batch size for
+        k (int): number of neighbours to interpolate over
+
+    Returns:
+        dict: per_device_train_batch_size, model_max_length, number_gpus and
+        neighbours used. Empty when the KB has no usable runs.
+    """
+    runs = _kb_runs_with_features(tuning_strategy)
+    if runs.empty:
+        logger.debug(f"No KB runs with features available for {tuning_strategy}")
+        return {}
+
+    same_length = runs[runs["model_max_length"] == max_seq_length]
+    if not same_length.empty:
+        runs = same_length
+
+    query = np.log2(
+        1 + np.array(list(architecture_features(model_config).values()), dtype=float)
+    )
+    points = np.log2(1 + runs[ARCH_FEATURES].to_numpy(dtype=float))
+    scale = points.std(axis=0)
+    scale[scale == 0] = 1.0
+    distances = np.linalg.norm((points - query) / scale, axis=1)
+
+    k = min(k, len(distances))
+    nearest = np.argsort(distances, kind="stable")[:k]
+    weights = 1.0 / (distances[nearest] + 1e-6)
+    tokens_per_device = (
+        runs["per_device_train_batch_size"].to_numpy(dtype=float)[nearest]
+        * runs["model_max_length"].to_numpy(dtype=float)[nearest]
+    )
+    # interpolate in log space since batch sizes are mostly powers of 2
+    batch_sizes = tokens_per_device / max_seq_length
+    batch_size = np.exp(np.sum(weights * np.log(batch_sizes)) / np.sum(weights))
+
+    neighbours = runs.iloc[nearest]
+    return {
+        "per_device_train_batch_size": max(1, int(np.floor(batch_size))),
+        "model_max_length": int(max_seq_length),
+        "number_gpus": int(neighbours["number_gpus"].iloc[0]),
+        "neighbours": [
+            {
+                "model_name": row["model_name"],
+                "model_max_length": int(row["model_max_length"]),
+                "per_device_train_batch_size": int(row["per_device_train_batch_size"]),
+                "distance": round(float(distance), 4),
+            }
+            for (_, row), distance in zip(
+                neighbours.iterrows(), distances[nearest], strict=True
+            )
+        ],
+    }
@@ -0,0 +1,313 @@
+import csv
+import json
+import os
+import shutil
+from collections.abc import Iterator
+from pathlib import Path
+
+import pandas as pd
+import yaml
+from loguru import logger
+
+from tuning_config_recommender.utils import kb_table
+from tuning_config_recommender.utils.kb_estimator import (
+    ARCH_FEATURES,
+    architecture_features,
+)
+
+KB_RUN_COLUMNS = [
+    "model_name",
+    "method",
+    "number_nodes",
+    "model_max_length",
+    "rnk",
+    "batch_size",
+    "per_device_train_batch_size",
+    "gpu_model",
+    "number_gpus",
+    "dollars_per_million_tokens",
+    "gpu_hours_per_million_tokens",
+    "dataset_tokens_per_second",
+    "gpu_memory_utilization_max",
+    "train_samples_per_second",
+    "experiment_id",
+]
+TRAINER_STATE_FILE = "trainer_state.json"
+# optional per run file to provide values that are not part of the training outputs
+# such as gpu_model, price_per_gpu_hour, gpu_memory_utilization_max, experiment_id
+RUN_METADATA_FILE = "run_metadata.json"
+
+
+def _load_optional(path: Path) -> dict:
+    if not path.is_file():
+        return {}
+    with open(path, encoding="utf-8") as f:
+        if path.suffix == ".json":
+            return json.load(f) or {}
+        return yaml.safe_load(f) or {}
+
+
+def _first_present(*dicts, keys, default=None):
+    for d in dicts:
+        for key in keys:
+            if d.get(key) not in (None, ""):
+                return d[key]
+    return default
+
+
+def iter_run_dirs(runs_dir: str | Path) -> Iterator[Path]:
+    """Lazily walk runs_dir and yield every directory holding a trainer_state.json"""
+    for root, dirs, files in os.walk(runs_dir):
+        if TRAINER_STATE_FILE in files:
+            # checkpoint-* subfolders have their own partial trainer states
+            dirs[:] = []
+            yield Path(root)
+        else:
+            dirs.sort()
+
+
+def _default_experiment_id(run_dir: Path, runs_dir: str | Path | None) -> str:
+    run_dir = run_dir.resolve()
+    if runs_dir is not None:
+        try:
+            return run_dir.relative_to(Path(runs_dir).resolve()).as_posix()
+        except ValueError:
+            pass
+    return run_dir.as_posix()
+
+
+def extract_run_record(
+    run_dir: str | Path, runs_dir: str | Path | None = None
+) -> dict | None:
+    """Build a tuning_run_data.csv row from the outputs of a finished fms-hf-tuning run.
+
+    The tuning and compute configuration is read from the tuning_config.yaml,
+    compute_config.yaml and accelerate_config.yaml files written by the recommender
+    (or training_args.json), throughput from the final summary entry of
+    trainer_state.json and the rest from an optional run_metadata.json.
+    experiment_id defaults to the path of run_dir relative to runs_dir, or its
+    absolute path, so that runs in different folders with the same name are
+    told apart.
+
+    Returns:
+        dict | None: row for the KB, None if the run did not finish or
+        has no throughput logged.
+    """
+    run_dir = Path(run_dir)
+    trainer_state = _load_optional(run_dir / TRAINER_STATE_FILE)
+    summary = next(
+        (
+            entry
+            for entry in reversed(trainer_state.get("log_history", []))
+            if "train_runtime" in entry
+        ),
+        None,
+    )
+    if summary is None:
+        logger.debug(f"Skipping {run_dir} since training has not finished")
+        return None
+
+    metadata = _load_optional(run_dir / RUN_METADATA_FILE)
+    tuning_config = {
+        **_load_optional(run_dir / "training_args.json"),
+        **_load_optional(run_dir / "tuning_config.yaml"),
+    }
+    compute_config = _load_optional(run_dir / "compute_config.yaml")
+    accelerate_config = _load_optional(run_dir / "accelerate_config.yaml")
+
+    model_name = _first_present(
+        metadata, tuning_config, keys=["model_name", "model_name_or_path"]
+    )
+    if not model_name:
+        logger.debug(f"Skipping {run_dir} since model name is unknown")
+        return None
+    model_name = str(model_name).rstrip("/").split("/")[-1]
+
+    model_max_length = _first_present(
+        metadata, tuning_config, keys=["model_max_length", "max_seq_length"]
+    )
+    if not model_max_length:
+        logger.debug(f"Skipping {run_dir} since sequence length is unknown")
+        return None
+
+    method = _first_present(
+        metadata, tuning_config, keys=["method", "tuning_strategy", "peft_method"]
+    )
+    number_nodes = int(
+        _first_present(
+            metadata, compute_config, keys=["number_nodes", "num_nodes"], default=1
+        )
+    )
+    number_gpus = _first_present(metadata, keys=["number_gpus"])
+    if number_gpus is None:
+        if compute_config.get("num_gpus_per_node"):
+            number_gpus = number_nodes * int(compute_config["num_gpus_per_node"])
+        else:
+            number_gpus = accelerate_config.get("num_processes", 1)
+    number_gpus = int(number_gpus)
+    per_device_train_batch_size = int(
+        _first_present(
+            metadata,
+            tuning_config,
+            trainer_state,
+            keys=["per_device_train_batch_size", "train_batch_size"],
+            default=1,
+        )
+    )
+    gradient_accumulation_steps = int(
+        tuning_config.get("gradient_accumulation_steps", 1) or 1
+    )
+
+    tokens_per_second = _first_present(metadata, keys=["dataset_tokens_per_second"])
+    if tokens_per_second is None and summary.get("train_tokens_per_second"):
+        # HF trainer logs tokens per second per device
+        tokens_per_second = float(summary["train_tokens_per_second"]) * number_gpus
+    if not tokens_per_second:
+        logger.debug(f"Skipping {run_dir} since no tokens/sec was logged")
+        return None
+    tokens_per_second = float(tokens_per_second)
+
+    gpu_hours_per_million_tokens = number_gpus * 1e6 / (tokens_per_second * 3600)
+    price_per_gpu_hour = metadata.get("price_per_gpu_hour", None)
+    dollars_per_million_tokens = metadata.get(
+        "dollars_per_million_tokens",
+        gpu_hours_per_million_tokens * float(price_per_gpu_hour)
+        if price_per_gpu_hour is not None
+        else None,
+    )
+
+    return {
+        "model_name": model_name,
+        "method": method or ("lora" if tuning_config.get("r") else "full"),
+        "number_nodes": number_nodes,
+        "model_max_length": int(model_max_length),
+        "rnk": int(
+            _first_present(metadata, tuning_config, keys=["rnk", "r"], default=0)
+        ),
+        "batch_size": per_device_train_batch_size
+        * gradient_accumulation_steps
+        * number_gpus,
+        "per_device_train_batch_size": per_device_train_batch_size,
+        "gpu_model": metadata.get("gpu_model", None),
+        "number_gpus": number_gpus,
+        "dollars_per_million_tokens": dollars_per_million_tokens,
+        "gpu_hours_per_million_tokens": round(gpu_hours_per_million_tokens, 6),
+        "dataset_tokens_per_second": tokens_per_second,
+        "gpu_memory_utilization_max": metadata.get("gpu_memory_utilization_max", None),
+        "train_samples_per_second": summary.get("train_samples_per_second", None),
+        "experiment_id": str(
+            metadata.get("experiment_id", _default_experiment_id(run_dir, runs_dir))
+        ),
+    }
+
+
+def _existing_values(path: Path, column: str) -> set:
+    if not path.is_file() or path.stat().st_size == 0:
+        return set()
+    return set(pd.read_csv(path, usecols=[column])[column].astype(str))
+
+
+class _CSVAppender:
+    """Appends rows to an existing KB CSV keeping its column order"""
+
+    def __init__(self, path: Path, default_columns: list[str]):
+        self.path = Path(path)
+        self._file = None
+        self._writer = None
+        self._default_columns = default_columns
+
+    def write(self, row: dict):
+        if self._writer is None:
+            self._open()
+        self._writer.writerow(row)
+        # flush per row so that a crash midway does not lose ingested runs
+        self._file.flush()
+
+    def _open(self):
+        columns = self._default_columns
+        needs_header = not self.path.is_file() or self.path.stat().st_size == 0
+        needs_newline = False
+        if not needs_header:
+            with open(self.path, encoding="utf-8") as f:
+                columns = next(csv.reader(f))
+            with open(self.path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(self.path, "a", encoding="utf-8", newline="")
+        if needs_newline:
+            self._file.write("\n")
+        self._writer = csv.DictWriter(
+            self._file, fieldnames=columns, extrasaction="ignore"
+        )
+        if needs_header:
+            self._writer.writeheader()
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def ingest_runs(
+    runs_dir: str | Path,
+    kb_path: str | Path | None = None,
+    architectures_path: str | Path | None = None,
+) -> int:
+    """Stream over the run outputs in runs_dir and append new runs to the KB.
+
+    Runs already present in the KB (by experiment_id) are skipped. Rows are
+    appended to the CSV, existing content is never rewritten. CSVs that do not
+    exist yet are created as copies of the packaged KB. Architecture
+    features of models not yet known are added from the run's config.json
+    when present so that new models are also usable for neighbour estimation.
+
+    Args:
+        runs_dir: directory containing fms-hf-tuning run output directories
+        kb_path: tuning run data CSV, defaults to the one the recommender reads
+            (TCR_TUNING_RUN_DATA_PATH)
+        architectures_path: model architectures CSV, defaults to the one the
+            recommender reads (TCR_MODEL_ARCHITECTURES_PATH)
+
+    Returns:
+        int: number of runs appended
+    """
+    kb_path = Path(kb_path or kb_table.TUNING_RUN_DATA_PATH)
+    architectures_path = Path(architectures_path or kb_table.MODEL_ARCHITECTURES_PATH)
+    # new files start from the packaged KB so that its runs are not lost
+    for path, packaged in (
+        (kb_path, kb_table.KB_DIR / "tuning_run_data.csv"),
+        (architectures_path, kb_table.KB_DIR / "model_architectures.csv"),
+    ):
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(packaged, path)
+    seen_experiments = _existing_values(kb_path, "experiment_id")
+    known_models = _existing_values(architectures_path, "model_name")
+    runs = _CSVAppender(kb_path, KB_RUN_COLUMNS)
+    archs = _CSVAppender(architectures_path, ["model_name", *ARCH_FEATURES])
+    appended = 0
+    try:
+        for run_dir in iter_run_dirs(runs_dir):
+            try:
+                record = extract_run_record(run_dir, runs_dir)
+            except Exception as e:
+                logger.warning(f"Failed to extract run from {run_dir}: {e}")
+                continue
+            if record is None or record["experiment_id"] in seen_experiments:
+                continue
+            runs.write(record)
+            seen_experiments.add(record["experiment_id"])
+            appended += 1
+            if (
+                record["model_name"] not in known_models
+                and (run_dir / "config.json").is_file()
+            ):
+                features = architecture_features(
+                    _load_optional(run_dir / "config.json")
+                )
+                archs.write({"model_name": record["model_name"], **features})
+                known_models.add(record["model_name"])
+    finally:
+        runs.close()
+        archs.close()
+    logger.info(f"Ingested {appended} runs from {runs_dir} into {kb_path}")
+    return appended
@@ -1,10 +1,23 @@
 import fnmatch
+import os
 from pathlib import Path
 
+import pandas as pd
 import yaml
 
 _KB = None
 _KB_TABLE = None
+_RUN_DATA = {}
+_MODEL_ARCHS = {}
+
+KB_DIR = Path(__file__).resolve().parents[1] / "knowledge_base"
+# run history can be pointed to a writable location for ingesting new runs
+TUNING_RUN_DATA_PATH = Path(
+    os.environ.get("TCR_TUNING_RUN_DATA_PATH", KB_DIR / "tuning_run_data.csv")
+)
+MODEL_ARCHITECTURES_PATH = Path(
+    os.environ.get("TCR_MODEL_ARCHITECTURES_PATH", KB_DIR / "model_architectures.csv")
+)
 
 
 def _load_kb_yaml():
@@ -88,3 +101,29 @@ def query_kb(model_name: str, section: str):
             return row["payload"], row["model_pattern"] != "*"
 
     return {}, False
+
+
+def _load_csv_cached(cache: dict, path: Path):
+    """
+    Load a KB CSV once per (path, mtime) so that appended rows are picked up.
+    """
+    path = Path(path)
+    key = (str(path), path.stat().st_mtime_ns)
+    if key not in cache:
+        cache.clear()
+        cache[key] = pd.read_csv(path)
+    return cache[key]
+
+
+def load_tuning_run_data(path: str | Path | None = None):
+    """
+    Load the tuning run history (tuning_run_data.csv) as a dataframe.
+    """
+    return _load_csv_cached(_RUN_DATA, path or TUNING_RUN_DATA_PATH)
+
+
+def load_model_architectures(path: str | Path | None = None):
+    """
+    Load architecture features of the models present in the tuning run history.
+    """
+    return _load_csv_cached(_MODEL_ARCHS, path or MODEL_ARCHITECTURES_PATH)
@@ -0,0 +1,323 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+GIB = 1024**3
+
+GPU_MEMORY_GB = {
+    "NVIDIA-A100-SXM4-80GB": 80,
+    "NVIDIA-A100-80GB-PCIe": 80,
+    "NVIDIA-A100-SXM4-40GB": 40,
+    "NVIDIA-A100-PCIE-40GB": 40,
+    "NVIDIA-H100-80GB-HBM3": 80,
+    "NVIDIA-H100-PCIe": 80,
+    "NVIDIA-L40S": 48,
+}
+DEFAULT_GPU_MEMORY_GB = 80
+
+# dense bf16 peak of the GPU without sparsity
+GPU_PEAK_TFLOPS = {
+    "NVIDIA-A100-SXM4-80GB": 312,
+    "NVIDIA-A100-80GB-PCIe": 312,
+    "NVIDIA-A100-SXM4-40GB": 312,
+    "NVIDIA-A100-PCIE-40GB": 312,
+    "NVIDIA-H100-80GB-HBM3": 989,
+    "NVIDIA-H100-PCIe": 756,
+    "NVIDIA-L40S": 362,
+}
+DEFAULT_GPU_PEAK_TFLOPS = 312
+# model flops utilization typically reached by FSDP fine tuning
+DEFAULT_MFU = 0.4
+# tokens per micro batch at which a GPU reaches half of its attainable throughput
+HALF_SATURATION_TOKENS = 2048
+
+DTYPE_BYTES = {"bfloat16": 2, "float16": 2, "float32": 4}
+# adam keeps two moments per trainable parameter, counted in fp32
+OPTIMIZER_BYTES_PER_PARAM = 8
+# trainable adapter weights and their gradients are kept in fp32
+ADAPTER_BYTES_PER_PARAM = 4
+# CUDA context, NCCL buffers and allocator fragmentation
+DEFAULT_OVERHEAD_BYTES = 3 * GIB
+
+SHARDING_STRATEGIES = ["NO_SHARD", "SHARD_GRAD_OP", "FULL_SHARD", "HYBRID_SHARD"]
+
+
+def gpu_memory_bytes(compute_config: dict) -> int:
+    """Memory of a single GPU from compute config (gpu_memory_gb or gpu_model)"""
+    if compute_config.get("gpu_memory_gb", None):
+        return int(float(compute_config["gpu_memory_gb"]) * GIB)
+    return int(
+        GPU_MEMORY_GB.get(compute_config.get("gpu_model", ""), DEFAULT_GPU_MEMORY_GB)
+        * GIB
+    )
+
+
+@dataclass
+class ModelShape:
+    hidden_size: int
+    num_layers: int
+    num_heads: int
+    num_kv_heads: int
+    head_dim: int
+    intermediate_size: int
+    vocab_size: int
+    num_experts: int = 0
+    num_experts_per_tok: int = 0
+    shared_intermediate_size: int = 0
+    mlp_matrices: int = 3
+    tie_word_embeddings: bool = False
+
+    @classmethod
+    def from_config(cls, config: dict) -> "ModelShape":
+        hidden_size = int(config.get("hidden_size", config.get("n_embd", 0)) or 0)
+        num_layers = int(config.get("num_hidden_layers", config.get("n_layer", 0)) or 0)
+        if not hidden_size or not num_layers:
+            raise ValueError("config.json does not describe a transformer shape")
+        num_heads = int(config.get("num_attention_heads", config.get("n_head", 1)))
+        num_experts = int(
+            config.get("num_local_experts", None) or config.get("num_experts", 0) or 0
+        )
+        model_type = config.get("model_type", "")
+        return cls(
+            hidden_size=hidden_size,
+            num_layers=num_layers,
+            num_heads=num_heads,
+            num_kv_heads=int(
+                config.get("num_key_value_heads", None)
+                or (1 if config.get("multi_query", False) else num_heads)
+            ),
+            head_dim=int(config.get("head_dim", None) or hidden_size // num_heads),
+            intermediate_size=int(
+                config.get("intermediate_size", None)
+                or config.get("n_inner", None)
+                or 4 * hidden_size
+            ),
+            vocab_size=int(config.get("vocab_size", 0) or 0),
+            num_experts=num_experts,
+            num_experts_per_tok=int(
+                config.get("num_experts_per_tok", 0) or (1 if num_experts else 0)
+            ),
+            shared_intermediate_size=int(
+                config.get("shared_intermediate_size", 0) or 0
+            ),
+            # gated MLPs (llama, granite, mistral) have 3 matrices, gpt style 2
+            mlp_matrices=2 if model_type in ("gpt_bigcode", "gpt2") else 3,
+            tie_word_embeddings=bool(config.get("tie_word_embeddings", False)),
+        )
+
+    @property
+    def attention_parameters(self) -> int:
+        kv_dim = self.num_kv_heads * self.head_dim
+        q_dim = self.num_heads * self.head_dim
+        return 2 * self.hidden_size * q_dim + 2 * self.hidden_size * kv_dim
+
+    @property
+    def mlp_parameters(self) -> int:
+        expert = self.mlp_matrices * self.hidden_size * self.intermediate_size
+        shared = self.mlp_matrices * self.hidden_size * self.shared_intermediate_size
+        if self.num_experts:
+            return (
+                expert * self.num_experts + shared + self.hidden_size * self.num_experts
+            )
+        return expert + shared
+
+    @property
+    def layer_parameters(self) -> int:
+        return self.attention_parameters + self.mlp_parameters + 2 * self.hidden_size
+
+    @property
+    def num_parameters(self) -> int:
+        embeddings = self.vocab_size * self.hidden_size
+        lm_head = 0 if self.tie_word_embeddings else embeddings
+        return embeddings + lm_head + self.num_layers * self.layer_parameters
+
+    def lora_parameters(self, r: int) -> int:
+        """Adapter parameters for target_modules all-linear, experts are not targeted"""
+        kv_dim = self.num_kv_heads * self.head_dim
+        q_dim = self.num_heads * self.head_dim
+        h = self.hidden_size
+        per_layer = r * ((h + q_dim) * 2 + (h + kv_dim) * 2)
+        if not self.num_experts:
+            per_layer += r * self.mlp_matrices * (h + self.intermediate_size)
+        return self.num_layers * per_layer
+
+    def activation_bytes_per_token(
+        self, dtype_bytes: int, gradient_checkpointing
+    ) -> np.ndarray:
+        """Bytes kept for backward per token across all layers, with flash attention.
+
+        Without checkpointing each layer keeps attention (~11h), layernorm (~4h)
+        and MLP (~2h + 4 intermediates) activations. With checkpointing only the
+        layer inputs are kept plus one layer being recomputed.
+        """
+        h = self.hidden_size
+        mlp_width = self.intermediate_size * max(self.num_experts_per_tok, 1)
+        mlp_width += self.shared_intermediate_size
+        per_layer = dtype_bytes / 2 * (17 * h + 8 * mlp_width)
+        checkpointed = dtype_bytes * h * self.num_layers + per_layer
+        full = per_layer * self.num_layers
+        return np.where(gradient_checkpointing, checkpointed, full)
+
+
+@dataclass
+class MemoryEstimate:
+    parameters: float
+    gradients: float
+    optimizer_states: float
+    activations: float
+    overhead: float = DEFAULT_OVERHEAD_BYTES
+
+    @property
+    def total(self):
+        return (
+            self.parameters
+            + self.gradients
+            + self.optimizer_states
+            + self.activations
+            + self.overhead
+        )
+
+    def to_gib(self) -> dict:
+        return {
+            k: round(float(v) / GIB, 2)
+            for k, v in {**self.__dict__, "total": self.total}.items()
+        }
+
+
+def estimate_memory(
+    model_config: dict,
+    tuning_strategy: str = "full",
+    per_device_batch_size=1,
+    seq_len=2048,
+    sharding_degree=1,
+    sharding_strategy: str = "FULL_SHARD",
+    dtype: str = "bfloat16",
+    gradient_checkpointing=True,
+    lora_r: int = 8,
+    offload_params: bool = False,
+) -> MemoryEstimate:
+    """Analytic estimate of the peak memory of one GPU while training.
+
+    Numeric arguments accept numpy arrays to evaluate many configurations at once.
+
+    Args:
+        model_config (dict): contents of config.json of the model
+        tuning_strategy (str): full, lora or alora
+        per_device_batch_size: samples per GPU per step
+        seq_len: tokens per sample
+        sharding_degree: number of GPUs model states are sharded across
+        sharding_strategy (str): FSDP sharding strategy, NO_SHARD for DDP,
+            SHARD_GRAD_OP shards only gradients and optimizer states
+        dtype (str): dtype of the model weights
+        gradient_checkpointing: whether activations are recomputed in backward
+        lora_r (int): LoRA rank
+        offload_params (bool): parameters and optimizer states live on CPU
+
+    Returns:
+        MemoryEstimate: breakdown in bytes
+    """
+    shape = ModelShape.from_config(model_config)
+    dtype_bytes = DTYPE_BYTES.get(dtype, 2)
+    sharding_degree = np.maximum(sharding_degree, 1)
+    shard_params = sharding_strategy in ("FULL_SHARD", "HYBRID_SHARD")
+    shard_states = sharding_strategy != "NO_SHARD"
+    params_divisor = sharding_degree if shard_params else 1
+    states_divisor = sharding_degree if shard_states else 1
+
+    base_parameters = shape.num_parameters * dtype_bytes
+    if tuning_strategy in ("lora", "alora"):
+        trainable = shape.lora_parameters(lora_r)
+        parameters = (
+            base_parameters / params_divisor + trainable * ADAPTER_BYTES_PER_PARAM
+        )
+        gradients = trainable * ADAPTER_BYTES_PER_PARAM
+        optimizer_states = trainable * OPTIMIZER_BYTES_PER_PARAM
+    else:
+        parameters = base_parameters / params_divisor
+        gradients = base_parameters / states_divisor
+        optimizer_states = (
+            shape.num_parameters * OPTIMIZER_BYTES_PER_PARAM / states_divisor
+        )
+    if shard_params:
+        # layers are gathered one at a time plus one prefetched
+        parameters = parameters + 2 * shape.layer_parameters * dtype_bytes
+    if offload_params:
+        # parameters, gradients and optimizer states live on CPU
+        # only the layers being computed are on the GPU
+        working_set = 2 * shape.layer_parameters * dtype_bytes
+        parameters = working_set
+        gradients = np.minimum(gradients, working_set)
+        optimizer_states = np.zeros_like(optimizer_states)
+
+    tokens = np.asarray(per_device_batch_size) * np.asarray(seq_len)
+    # logits are upcasted to fp32 and kept along with their gradient
+    logits = tokens * shape.vocab_size * 4 * 2
+    activations = (
+        tokens * shape.activation_bytes_per_token(dtype_bytes, gradient_checkpointing)
+        + logits
+    )
+    return MemoryEstimate(
+        parameters=parameters,
+        gradients=gradients,
+        optimizer_states=optimizer_states,
+        activations=activations,
+    )
+
+
+def max_batch_size_that_fits(
+    model_config: dict,
+    gpu_memory: int,
+    memory_safety_margin: float = 0.1,
+    max_batch_size: int = 128,
+    **kwargs,
+):
+    """Largest per device batch size that fits in gpu_memory leaving the safety margin.
+
+    Remaining keyword arguments are passed to estimate_memory. Returns 0 when
+    not even a single sample fits. Accepts numpy arrays like estimate_memory.
+    """
+    kwargs["per_device_batch_size"] = 1
+    one_sample = estimate_memory(model_config, **kwargs)
+    budget = gpu_memory * (1 - memory_safety_margin)
+    fixed = one_sample.total - one_sample.activations
+    batch_size = np.floor((budget - fixed) / one_sample.activations)
+    batch_size = np.clip(batch_size, 0, max_batch_size).astype(int)
+    return batch_size if batch_size.ndim else int(batch_size)
+
+
+def estimate_throughput(
+    model_config: dict,
+    tuning_strategy: str = "full",
+    num_gpus=1,
+    gpu_model: str = "",
+    mfu: float = DEFAULT_MFU,
+    tokens_per_device=None,
+    gradient_checkpointing: bool = False,
+):
+    """Analytic training throughput in tokens per second across num_gpus.
+
+    A training step costs ~6 flops per parameter and token (forward 2,
+    backward 4), without weight gradients for frozen weights in LoRA ~4.
+    Gradient checkpointing recomputes the forward pass, 2 more. When
+    tokens_per_device (per device batch x sequence length) is given mfu is
+    scaled by tokens / (tokens + HALF_SATURATION_TOKENS). Attention flops are
+    ignored. Accepts numpy arrays for num_gpus and tokens_per_device.
+    """
+    shape = ModelShape.from_config(model_config)
+    active_parameters = shape.num_parameters
+    if shape.num_experts:
+        expert = shape.mlp_matrices * shape.hidden_size * shape.intermediate_size
+        active_parameters -= (
+            shape.num_layers
+            * expert
+            * (shape.num_experts - max(shape.num_experts_per_tok, 1))
+        )
+    flops_per_token = (
+        (4 if tuning_strategy in ("lora", "alora") else 6)
+        + (2 if gradient_checkpointing else 0)
+    ) * active_parameters
+    if tokens_per_device is not None:
+        tokens_per_device = np.asarray(tokens_per_device)
+        mfu = mfu * tokens_per_device / (tokens_per_device + HALF_SATURATION_TOKENS)
+    peak = GPU_PEAK_TFLOPS.get(gpu_model, DEFAULT_GPU_PEAK_TFLOPS) * 1e12
+    return np.asarray(num_gpus) * peak * mfu / flops_per_token
@@ -0,0 +1,94 @@
+import json
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+MOE_TAGS = ["granitemoe", ""]
+
+
+@dataclass(frozen=True)
+class ModelFacts:
+    """Facts derived from config.json and tokenizer_config.json of a model folder.
+
+    Instances are shared across actions and requests, config and
+    tokenizer_config must be treated as read only.
+    """
+
+    config: dict = field(default_factory=dict)
+    tokenizer_config: dict = field(default_factory=dict)
+
+    @property
+    def architecture(self) -> str:
+        return (self.config.get("architectures") or [""])[0]
+
+    @property
+    def num_experts(self) -> int | None:
+        return self.config.get("num_local_experts", None) or self.config.get(
+            "num_experts", None
+        )
+
+    @property
+    def is_moe(self) -> bool:
+        model_type = self.config.get("model_type", None)
+        if model_type is not None and (model_type in MOE_TAGS or "moe" in model_type):
+            return True
+        if "architectures" in self.config and (
+            self.architecture.lower() in MOE_TAGS or "moe" in self.architecture.lower()
+        ):
+            return True
+        if (self.config.get("num_experts_per_tok", None) or 0) > 0:
+            return True
+        return False
+
+    @property
+    def chat_template(self) -> str | None:
+        return self.tokenizer_config.get("chat_template", None)
+
+    @property
+    def additional_special_tokens(self) -> list | None:
+        return self.tokenizer_config.get("additional_special_tokens", None)
+
+
+def _read_json(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _mtime(path: str) -> int | None:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+@lru_cache(maxsize=256)
+def _load_model_facts(
+    model_dir: str, config_mtime: int | None, tokenizer_config_mtime: int | None
+) -> ModelFacts:
+    # mtimes are part of the cache key so that updated files are parsed again
+    return ModelFacts(
+        config=_read_json(os.path.join(model_dir, "config.json")),
+        tokenizer_config=(
+            _read_json(os.path.join(model_dir, "tokenizer_config.json"))
+            if tokenizer_config_mtime is not None
+            else {}
+        ),
+    )
+
+
+def get_model_facts(model_name_or_path: str) -> ModelFacts:
+    """Parse the metadata files of a local model folder once and share the result
+
+    Args:
+        model_name_or_path (str): local folder holding config.json and
+            optionally tokenizer_config.json
+
+    Returns:
+        ModelFacts: cached facts keyed by folder and file modification times
+    """
+    model_dir = os.path.realpath(model_name_or_path)
+    return _load_model_facts(
+        model_dir,
+        _mtime(os.path.join(model_dir, "config.json")),
+        _mtime(os.path.join(model_dir, "tokenizer_config.json")),
+    )
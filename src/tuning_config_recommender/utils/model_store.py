@@ -0,0 +1,242 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from huggingface_hub import hf_hub_download
+from loguru import logger
+
+from tuning_config_recommender.cache_backends import get_cache_backend
+from tuning_config_recommender.metrics import CACHE_LOOKUPS
+
+try:
+    import fcntl
+except ImportError:  # not available on windows, locking is then per process only
+    fcntl = None
+
+# outside of the package, which may be read only once installed
+DEFAULT_STORE_DIR = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache"))
+    / "tuning_config_recommender"
+    / "models"
+)
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+REQUIRED_FILES = ["config.json"]
+OPTIONAL_FILES = ["tokenizer_config.json"]
+
+
+class ModelMetadataStore:
+    """Content addressed store of model metadata files keyed by (repo, revision).
+
+    Layout under root
+        blobs/<sha[:2]>/<sha256>             file contents, stored once
+        refs/<repo_id>/<revision>/<filename> hardlinks to blobs
+        locks/<key hash>.lock                cross process per key locks
+
+    Lookups are offline first, the store is checked first, then mirror_dir
+    (laid out as <repo_id>/<revision>/<filename> or <repo_id>/<filename>) and
+    finally the HF hub unless offline. Concurrent lookups of the same key
+    wait on a per key lock so that a model is fetched only once. Least
+    recently used refs are evicted when the store grows beyond max_bytes.
+    """
+
+    def __init__(
+        self,
+        root: str | Path = DEFAULT_STORE_DIR,
+        mirror_dir: str | Path | None = None,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        offline: bool = False,
+    ):
+        self.root = Path(root)
+        self.mirror_dir = Path(mirror_dir) if mirror_dir else None
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self._locks: dict[tuple[str, str], threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def ref_dir(self, repo_id: str, revision: str = "main") -> Path:
+        return self.root / "refs" / repo_id / revision
+
+    def _is_complete(self, ref_dir: Path) -> bool:
+        return all((ref_dir / f).is_file() for f in REQUIRED_FILES)
+
+    def get(self, repo_id: str, revision: str = "main") -> str:
+        """Return local folder holding the metadata files of the model"""
+        ref_dir = self.ref_dir(repo_id, revision)
+        if self._is_complete(ref_dir):
+            CACHE_LOOKUPS.inc(cache="model_store", result="hit")
+            os.utime(ref_dir)
+            return str(ref_dir)
+        CACHE_LOOKUPS.inc(cache="model_store", result="miss")
+        with self._lock(repo_id, revision):
+            # another request may have fetched it while we waited
+            if not self._is_complete(ref_dir):
+                self._fetch(repo_id, revision, ref_dir)
+        self._maybe_evict(keep=ref_dir)
+        return str(ref_dir)
+
+    @contextmanager
+    def _lock(self, repo_id: str, revision: str):
+        key = (repo_id, revision)
+        with self._locks_guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            lock_dir = self.root / "locks"
+            lock_dir.mkdir(parents=True, exist_ok=True)
+            key_hash = hashlib.sha256(f"{repo_id}@{revision}".encode()).hexdigest()
+            with open(lock_dir / f"{key_hash}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _find_in_mirror(self, repo_id: str, revision: str, filename: str):
+        if not self.mirror_dir:
+            return None
+        candidates = [self.mirror_dir / repo_id / revision / filename]
+        if revision == "main":
+            candidates.append(self.mirror_dir / repo_id / filename)
+        return next((c for c in candidates if c.is_file()), None)
+
+    def _download(self, repo_id: str, revision: str, filename: str):
+        if self.offline:
+            return None
+        try:
+            return Path(
+                hf_hub_download(repo_id=repo_id, filename=filename, revision=revision)
+            )
+        except Exception as e:
+            if filename in REQUIRED_FILES:
+                raise
+            logger.warning(f"Could not download {filename} for {repo_id}: {e}")
+            return None
+
+    def _fetch(self, repo_id: str, revision: str, ref_dir: Path):
+        ref_dir.mkdir(parents=True, exist_ok=True)
+        for filename in REQUIRED_FILES + OPTIONAL_FILES:
+            src = self._find_in_mirror(repo_id, revision, filename)
+            if src is None:
+                # fetched by another replica sharing the cache backend
+                src = self._from_shared_cache(repo_id, revision, filename)
+            if src is None:
+                src = self._download(repo_id, revision, filename)
+                if src is not None:
+                    self._to_shared_cache(repo_id, revision, filename, src)
+            if src is None:
+                if filename in REQUIRED_FILES:
+                    raise FileNotFoundError(
+                        f"{filename} for {repo_id}@{revision} is neither in the model "
+                        f"store nor in the mirror {self.mirror_dir} and hub access is offline"
+                    )
+                continue
+            self._link(self._add_blob(src), ref_dir / filename)
+        logger.debug(f"Stored metadata of {repo_id}@{revision} at {ref_dir}")
+
+    @staticmethod
+    def _cache_key(repo_id: str, revision: str, filename: str) -> str:
+        return f"model_metadata:{repo_id}@{revision}/{filename}"
+
+    def _from_shared_cache(self, repo_id: str, revision: str, filename: str):
+        try:
+            content = get_cache_backend().get(
+                self._cache_key(repo_id, revision, filename)
+            )
+        except Exception as e:
+            logger.warning(f"Cache lookup of {filename} for {repo_id} failed: {e!r}")
+            return None
+        CACHE_LOOKUPS.inc(
+            cache="model_metadata", result="miss" if content is None else "hit"
+        )
+        return content
+
+    def _to_shared_cache(self, repo_id: str, revision: str, filename: str, src):
+        try:
+            get_cache_backend().set(
+                self._cache_key(repo_id, revision, filename), src.read_bytes()
+            )
+        except Exception as e:
+            logger.warning(f"Caching {filename} for {repo_id} failed: {e!r}")
+
+    def _add_blob(self, src: Path | bytes) -> Path:
+        # contents are copied once so that blobs never share inodes with
+        # files outside the store (mirror, HF cache) which may change
+        content = src if isinstance(src, bytes) else src.read_bytes()
+        digest = hashlib.sha256(content).hexdigest()
+        blob = self.root / "blobs" / digest[:2] / digest
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+            tmp.write_bytes(content)
+            os.replace(tmp, blob)
+        else:
+            os.utime(blob)
+        return blob
+
+    def _link(self, blob: Path, dst: Path):
+        tmp = dst.with_suffix(f".tmp{os.getpid()}.{threading.get_ident()}")
+        try:
+            os.link(blob, tmp)
+        except OSError:
+            # hardlinks are not supported on the filesystem
+            shutil.copyfile(blob, tmp)
+        os.replace(tmp, dst)
+
+    def _size(self) -> int:
+        seen, total = set(), 0
+        for path in self.root.rglob("*"):
+            if path.is_file() and path.parent.name != "locks":
+                stat = path.stat()
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_size
+        return total
+
+    def _maybe_evict(self, keep: Path):
+        if self._size() <= self.max_bytes:
+            return
+        refs = sorted(
+            {p.parent for p in (self.root / "refs").rglob("config.json")} - {keep},
+            key=lambda p: p.stat().st_mtime,
+        )
+        for ref_dir in refs:
+            logger.debug(f"Evicting {ref_dir} from model store")
+            shutil.rmtree(ref_dir, ignore_errors=True)
+            now = time.time()
+            for blob in (self.root / "blobs").rglob("*"):
+                if not blob.is_file():
+                    continue
+                stat = blob.stat()
+                # blob is only linked from the blobs folder itself, recent blobs
+                # are skipped as they may be about to be linked by another request
+                if stat.st_nlink <= 1 and now - stat.st_mtime > 60:
+                    blob.unlink(missing_ok=True)
+            if self._size() <= self.max_bytes:
+                return
+
+
+_STORE = None
+_STORE_GUARD = threading.Lock()
+
+
+def get_model_store() -> ModelMetadataStore:
+    """Process wide model metadata store configured from the environment"""
+    global _STORE
+    with _STORE_GUARD:
+        if _STORE is None:
+            _STORE = ModelMetadataStore(
+                root=os.environ.get("TCR_MODEL_STORE_DIR", DEFAULT_STORE_DIR),
+                mirror_dir=os.environ.get("TCR_MODEL_MIRROR_DIR", None),
+                max_bytes=int(
+                    os.environ.get("TCR_MODEL_STORE_MAX_BYTES", DEFAULT_MAX_BYTES)
+                ),
+                offline=os.environ.get("HF_HUB_OFFLINE", "0").lower()
+                in ("1", "true", "yes"),
+            )
+        return _STORE
@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+
+from tuning_config_recommender.cache_backends import get_cache_backend
+from tuning_config_recommender.metrics import CACHE_LOOKUPS
+from tuning_config_recommender.utils.data_processing import (
+    _file_version,
+    load_training_data_head,
+)
+from tuning_config_recommender.utils.helper import canonical_hash
+
+PADDING_MODES = ["padded", "padding_free", "packing"]
+# rough average for English text and code with BPE tokenizers
+CHARS_PER_TOKEN = 4.0
+# role and turn delimiters added by chat templates
+CHAT_TOKENS_PER_MESSAGE = 4
+# fixed cost of a step (optimizer, communication, kernel launches) relative to
+# the compute of a step that is full with max_seq_length tokens per sample
+STEP_OVERHEAD = 0.15
+# context length at which attention costs as much compute per token as the
+# rest of the model, about 6x the hidden size of a 8B model
+ATTENTION_EQUAL_TOKENS = 24576
+DEFAULT_MAX_SAMPLES = 2000
+# records read from the start of a dataset to sample lengths from, large
+# datasets are not loaded fully for an estimate
+PROBE_MAX_RECORDS = 10 * DEFAULT_MAX_SAMPLES
+
+
+def _chars_and_messages(value) -> tuple[int, int]:
+    if isinstance(value, str):
+        return len(value), 0
+    if (
+        isinstance(value, list | np.ndarray)
+        and len(value)
+        and isinstance(value[0], dict)
+    ):
+        return sum(len(str(m.get("content", ""))) for m in value), len(value)
+    return 0, 0
+
+
+def estimate_sample_lengths(
+    records: list[dict], max_samples: int = DEFAULT_MAX_SAMPLES, seed: int = 0
+) -> np.ndarray:
+    """Estimated tokens per sample of a random subset of records
+
+    Tokenized records are measured by input_ids, text fields and chat
+    messages are converted from characters with CHARS_PER_TOKEN.
+    """
+    if len(records) > max_samples:
+        rng = np.random.default_rng(seed)
+        records = [records[i] for i in rng.choice(len(records), max_samples, False)]
+    df = pd.DataFrame.from_records(records)
+    if "input_ids" in df.columns:
+        return df["input_ids"].map(len).to_numpy(dtype=float)
+    chars = np.zeros(len(df))
+    messages = np.zeros(len(df))
+    for column in df.columns:
+        if df[column].dtype != object:
+            continue
+        counts = np.array(df[column].map(_chars_and_messages).tolist(), dtype=float)
+        chars += counts[:, 0]
+        messages += counts[:, 1]
+    return np.ceil(chars / CHARS_PER_TOKEN) + messages * CHAT_TOKENS_PER_MESSAGE
+
+
+def probe_dataset(
+    training_data_path: str, max_records: int = PROBE_MAX_RECORDS
+) -> dict | None:
+    """estimate_sample_lengths of the first max_records records of a dataset
+    and the number of records they were estimated from, None when it holds no
+    records
+
+    Probes of files are shared with other replicas through the cache backend,
+    keyed by path and file version.
+    """
+    version = _file_version(training_data_path)
+    key = None
+    if version is not None:
+        key = "dataset_probe:" + canonical_hash(
+            [training_data_path, version, max_records, DEFAULT_MAX_SAMPLES]
+        )
+        probe = get_cache_backend().get_json(key)
+        CACHE_LOOKUPS.inc(
+            cache="dataset_probe", result="miss" if probe is None else "hit"
+        )
+        if probe is not None:
+            return probe
+    data = load_training_data_head(training_data_path, max_records)
+    if not isinstance(data, list) or not data:
+        return None
+    lengths = estimate_sample_lengths(data)
+    probe = {"num_samples": len(lengths), "lengths": lengths.tolist()}
+    if key is not None:
+        get_cache_backend().set_json(key, probe)
+    return probe
+
+
+def estimate_padding_modes(
+    lengths: np.ndarray,
+    max_seq_length: int,
+    per_device_batch_size: int = 1,
+    seed: int = 0,
+) -> dict:
+    """Step time of a device under each padding mode for the same samples
+
+    padded        batches are padded to their longest sample
+    padding_free  samples of a batch are concatenated without padding, a step
+                  computes the tokens of its batch and attends within samples
+    packing       samples are concatenated and cut into max_seq_length chunks,
+                  fewer but full steps that attend across the whole chunk
+
+    The time of a step is its computed tokens, its attention (quadratic in the
+    attended length, see ATTENTION_EQUAL_TOKENS) and STEP_OVERHEAD.
+
+    Returns:
+        dict: per mode steps, useful_tokens_per_step, computed_tokens_per_step,
+        padding_fraction and relative_throughput (useful tokens per unit of
+        time, padded is 1)
+    """
+    lengths = np.minimum(np.asarray(lengths, dtype=float), max_seq_length)
+    lengths = np.maximum(lengths, 1)
+    batch = max(int(per_device_batch_size), 1)
+    capacity = batch * max_seq_length
+    shuffled = np.random.default_rng(seed).permutation(lengths)
+    num_batches = max(len(shuffled) // batch, 1)
+    batches = np.resize(shuffled, num_batches * batch).reshape(num_batches, batch)
+    useful = batches.sum()
+    longest = batches.max(axis=1)
+
+    steps = {
+        "padded": num_batches,
+        "padding_free": num_batches,
+        "packing": max(np.ceil(useful / capacity), 1),
+    }
+    computed = {
+        "padded": batch * longest.sum(),
+        "padding_free": useful,
+        "packing": useful,
+    }
+    attention = {
+        "padded": batch * (longest**2).sum(),
+        "padding_free": (batches**2).sum(),
+        "packing": useful * min(max_seq_length, useful),
+    }
+    time = {
+        mode: computed[mode]
+        + attention[mode] / ATTENTION_EQUAL_TOKENS
+        + steps[mode] * STEP_OVERHEAD * capacity
+        for mode in PADDING_MODES
+    }
+    return {
+        mode: {
+            "steps": int(steps[mode]),
+            "useful_tokens_per_step": float(useful / steps[mode]),
+            "computed_tokens_per_step": float(computed[mode] / steps[mode]),
+            "padding_fraction": float(1 - useful / computed[mode]),
+            "relative_throughput": float(time["padded"] / time[mode]),
+        }
+        for mode in PADDING_MODES
+    }
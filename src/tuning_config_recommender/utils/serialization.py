@@ -0,0 +1,100 @@
+import json
+from enum import Enum
+from pathlib import Path
+
+from loguru import logger
+
+from tuning_config_recommender.actions import IR, Comment
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    logger.debug("orjson is not installed, responses are encoded with json")
+
+# optional parts of an adapter result, patches holds the json merge patch of
+# every action and source_irs the IR each action was applied to
+INCLUDE_OPTIONS = ("patches", "source_irs")
+IR_SECTIONS = (
+    "tuning_config",
+    "compute_config",
+    "accelerate_config",
+    "tuning_data_config",
+)
+
+
+def check_include(include) -> tuple:
+    include = tuple(include)
+    unknown = set(include) - set(INCLUDE_OPTIONS)
+    if unknown:
+        raise ValueError(
+            f"include should be a subset of {list(INCLUDE_OPTIONS)}, got {sorted(unknown)}"
+        )
+    return include
+
+
+def to_jsonable(obj):
+    """Convert obj to JSON and YAML safe values in a single walk
+
+    IRs become dicts of their sections and patch metadata, comments their
+    text, enums their value, numpy values plain numbers and lists, anything
+    else that is not a JSON type its str.
+    """
+    if obj is None or type(obj) in (str, int, float, bool):
+        return obj
+    if isinstance(obj, dict):
+        return {str(k): to_jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, list | tuple | set):
+        return [to_jsonable(o) for o in obj]
+    if isinstance(obj, Enum):
+        return to_jsonable(obj.value)
+    # subclasses such as numpy floats
+    if isinstance(obj, float):
+        return float(obj)
+    if isinstance(obj, int):
+        return int(obj)
+    if isinstance(obj, str):
+        return str(obj)
+    if isinstance(obj, IR):
+        return {
+            **{section: to_jsonable(getattr(obj, section)) for section in IR_SECTIONS},
+            "level": to_jsonable(obj.level),
+            "type": to_jsonable(obj.type),
+            "effect": to_jsonable(obj.effect),
+            "comment": to_jsonable(obj.comment),
+        }
+    if isinstance(obj, Comment):
+        return str(obj)
+    if isinstance(obj, Path):
+        return str(obj)
+    if hasattr(obj, "tolist"):
+        # numpy arrays and scalars
+        return to_jsonable(obj.tolist())
+    return str(obj)
+
+
+def serialize_patches(patches: list[dict], include=INCLUDE_OPTIONS) -> list[dict]:
+    """JSON patches with their comment of RuleEngine.apply, with the json merge
+    patch and source IR of every action when asked for in include"""
+    fields = ["json_patch", "comment"]
+    if "patches" in include:
+        fields.append("json_merge_patch")
+        if "source_irs" in include:
+            fields.append("stage_source_ir")
+    return [
+        {field: to_jsonable(patch[field]) for field in fields if field in patch}
+        for patch in patches
+    ]
+
+
+def dumps(obj) -> bytes:
+    """JSON encoding of obj, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=str).encode("utf-8")
+
+
+def loads(data: bytes | str):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
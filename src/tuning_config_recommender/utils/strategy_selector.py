@@ -0,0 +1,117 @@
+import math
+
+from tuning_config_recommender.utils.memory_estimator import (
+    DTYPE_BYTES,
+    GIB,
+    ModelShape,
+    estimate_memory,
+)
+
+# fastest first, FULL_SHARD_OFFLOAD is FULL_SHARD with params on CPU
+DISTRIBUTED_STRATEGIES = [
+    "DDP",
+    "SHARD_GRAD_OP",
+    "HYBRID_SHARD",
+    "FULL_SHARD",
+    "FULL_SHARD_OFFLOAD",
+]
+# tokens per micro batch a GPU needs to stay busy, a strategy that only fits
+# smaller batches is not worth its lower communication cost
+MIN_TOKENS_PER_DEVICE = 8192
+# free memory in layers needed to also prefetch the next layer in forward
+FORWARD_PREFETCH_LAYERS = 2
+
+
+def _candidates(num_nodes: int, num_gpus_per_node: int) -> list[tuple]:
+    """(strategy, fsdp sharding strategy, sharding degree, offload) to try"""
+    num_processes = num_nodes * num_gpus_per_node
+    candidates = [("DDP", "NO_SHARD", 1, False)]
+    if num_processes > 1:
+        candidates.append(("SHARD_GRAD_OP", "SHARD_GRAD_OP", num_processes, False))
+        if num_nodes > 1 and num_gpus_per_node > 1:
+            candidates.append(
+                ("HYBRID_SHARD", "HYBRID_SHARD", num_gpus_per_node, False)
+            )
+        candidates.append(("FULL_SHARD", "FULL_SHARD", num_processes, False))
+    candidates.append(("FULL_SHARD_OFFLOAD", "FULL_SHARD", num_processes, True))
+    return candidates
+
+
+def select_distributed_strategy(
+    model_config: dict,
+    num_nodes: int,
+    num_gpus_per_node: int,
+    memory_budget: float,
+    seq_len: int = 2048,
+    min_per_device_batch_size: int | None = None,
+    **kwargs,
+) -> dict:
+    """Fastest distributed strategy that fits a useful batch in memory
+
+    Strategies are tried in the order of DISTRIBUTED_STRATEGIES, each shards
+    more and communicates more than the previous one. The first one where a
+    per device batch of min_per_device_batch_size (MIN_TOKENS_PER_DEVICE
+    tokens by default) fits in memory_budget is picked, then the first one
+    where a single sample fits. Offload is the last resort. FSDP prefetch
+    settings follow the memory left over, prefetching a layer early costs
+    the memory of a layer.
+
+    Remaining keyword arguments are passed to estimate_memory.
+
+    Returns:
+        dict: strategy, distributed_type, fsdp_sharding_strategy,
+        fsdp_offload_params, fsdp_backward_prefetch, fsdp_forward_prefetch,
+        per_device_batch_size it was checked with, fits, memory_gib,
+        headroom_gib and rejected with the memory in GiB of faster strategies
+        that did not fit
+    """
+    if min_per_device_batch_size is None:
+        min_per_device_batch_size = math.ceil(MIN_TOKENS_PER_DEVICE / int(seq_len))
+    min_per_device_batch_size = max(int(min_per_device_batch_size), 1)
+    candidates = _candidates(num_nodes, num_gpus_per_node)
+    # offload is slow enough that sharding with a smaller batch is preferred
+    attempts = [(c, min_per_device_batch_size) for c in candidates[:-1]]
+    if min_per_device_batch_size > 1:
+        attempts += [(c, 1) for c in candidates[:-1]]
+    attempts.append((candidates[-1], 1))
+    rejected = {}
+    for (strategy, sharding_strategy, degree, offload), batch in attempts:
+        total = float(
+            estimate_memory(
+                model_config,
+                per_device_batch_size=batch,
+                seq_len=seq_len,
+                sharding_strategy=sharding_strategy,
+                sharding_degree=degree,
+                offload_params=offload,
+                **kwargs,
+            ).total
+        )
+        if total <= memory_budget:
+            break
+        rejected.setdefault(strategy, round(total / GIB, 2))
+
+    headroom = memory_budget - total
+    layer_bytes = ModelShape.from_config(model_config).layer_parameters * (
+        DTYPE_BYTES.get(kwargs.get("dtype", "bfloat16"), 2)
+    )
+    backward_prefetch = "BACKWARD_PRE" if headroom >= layer_bytes else "BACKWARD_POST"
+    num_processes = num_nodes * num_gpus_per_node
+    distributed_type = "FSDP"
+    if strategy == "DDP":
+        distributed_type = "MULTI_GPU" if num_processes > 1 else "NO"
+    return {
+        "strategy": strategy,
+        "distributed_type": distributed_type,
+        "fsdp_sharding_strategy": sharding_strategy,
+        "fsdp_offload_params": offload,
+        "fsdp_backward_prefetch": backward_prefetch,
+        "fsdp_forward_prefetch": bool(
+            headroom >= FORWARD_PREFETCH_LAYERS * layer_bytes
+        ),
+        "per_device_batch_size": batch,
+        "fits": bool(headroom >= 0),
+        "memory_gib": round(total / GIB, 2),
+        "headroom_gib": round(headroom / GIB, 2),
+        "rejected": rejected,
+    }
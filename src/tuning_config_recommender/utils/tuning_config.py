@@ -2,35 +2,26 @@ import json
 import os
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import yaml
 
-from tuning_config_recommender.utils.kb_table import query_kb
+from tuning_config_recommender.constants import (
+    BATCH_SIZE_OBJECTIVES,
+    DEFAULT_MEMORY_SAFETY_MARGIN,
+)
+from tuning_config_recommender.utils.kb_estimator import (
+    estimate_batch_size_from_neighbours,
+)
+from tuning_config_recommender.utils.kb_table import load_tuning_run_data, query_kb
+from tuning_config_recommender.utils.model_facts import get_model_facts
 
 script_dir = Path(__file__).resolve().parent
 
 
 def is_model_type_moe(model_name_or_path: str) -> bool:
     """Checks if the granite model given is MoE"""
-
-    if os.path.isdir(model_name_or_path):
-        with open(f"{model_name_or_path}/config.json", encoding="utf-8") as f:
-            config = json.load(f)
-
-    moe_tags = ["granitemoe", ""]
-
-    if "model_type" in config and (
-        config["model_type"] in moe_tags or "moe" in config["model_type"]
-    ):
-        return True
-    if "architectures" in config and (
-        config["architectures"][0].lower() in moe_tags
-        or "moe" in config["architectures"][0].lower()
-    ):
-        return True
-    if "num_experts_per_tok" in config and config["num_experts_per_tok"] > 0:
-        return True
-    return False
+    return get_model_facts(model_name_or_path).is_moe
 
 
 def find_best_row(df, target_length, default_value=None):
@@ -51,17 +42,105 @@ def find_best_row(df, target_length, default_value=None):
     return default_value
 
 
-def use_kb_for_batch_size(user_input: dict):
-    """Use the knowledge base to determine the optimal batch size"""
-    training_run_data_path = (
-        script_dir.parent / "knowledge_base" / "tuning_run_data.csv"
+def _rows_for_length(df, target_length):
+    """All runs at the exact length, else all runs at the nearest smaller length"""
+    exact_match = df[df["model_max_length"] == target_length]
+    if not exact_match.empty:
+        return exact_match
+    smaller_matches = df[df["model_max_length"] < target_length]
+    if not smaller_matches.empty:
+        return smaller_matches[
+            smaller_matches["model_max_length"]
+            == smaller_matches["model_max_length"].max()
+        ]
+    return smaller_matches
+
+
+def _pareto_frontier(throughput: np.ndarray, cost: np.ndarray) -> np.ndarray:
+    """Mask of runs not dominated in (max throughput, min cost)"""
+    at_least_as_good = (throughput[None, :] >= throughput[:, None]) & (
+        cost[None, :] <= cost[:, None]
+    )
+    strictly_better = (throughput[None, :] > throughput[:, None]) | (
+        cost[None, :] < cost[:, None]
     )
-    df = pd.read_csv(training_run_data_path)
+    return ~np.any(at_least_as_good & strictly_better, axis=1)
 
-    model_name_or_path = str(user_input.get("model_name_or_path", ""))
-    tuning_strategy = user_input.get("tuning_strategy", "")
-    max_seq_length = user_input.get("max_seq_length", 2048)
 
+def find_optimal_row(
+    df,
+    target_length,
+    objective: str,
+    memory_safety_margin: float = DEFAULT_MEMORY_SAFETY_MARGIN,
+    default_value=None,
+):
+    """Pick among the runs matching the target length by an objective.
+
+    Args:
+        df: KB runs already filtered to the model and tuning method
+        target_length: sequence length to match, nearest smaller length is used
+            when there is no exact match
+        objective: one of BATCH_SIZE_OBJECTIVES
+            throughput - maximum dataset_tokens_per_second
+            cost - minimum dollars_per_million_tokens
+            pareto - runs within the memory safety margin on the
+                throughput/cost pareto frontier, closest to the ideal point
+        memory_safety_margin: fraction of GPU memory to keep free (pareto only)
+        default_value: returned when no run matches the target length
+
+    Returns:
+        matching row, find_best_row when no run can be ranked by the objective
+    """
+    row = _rank_by_objective(df, target_length, objective, memory_safety_margin)
+    if row is None:
+        return find_best_row(df, target_length, default_value)
+    return row
+
+
+def _rank_by_objective(df, target_length, objective: str, memory_safety_margin):
+    """Best run for the objective, None when no run has its metrics or, for
+    pareto, fits within the memory safety margin"""
+    if objective not in BATCH_SIZE_OBJECTIVES:
+        raise ValueError(
+            f"batch size objective {objective} is not one of {BATCH_SIZE_OBJECTIVES}"
+        )
+    rows = _rows_for_length(df, target_length)
+    if objective == "throughput":
+        rows = rows.dropna(subset=["dataset_tokens_per_second"])
+        if rows.empty:
+            return None
+        return rows.loc[rows["dataset_tokens_per_second"].idxmax()]
+    if objective == "cost":
+        rows = rows.dropna(subset=["dollars_per_million_tokens"])
+        if rows.empty:
+            return None
+        return rows.loc[rows["dollars_per_million_tokens"].idxmin()]
+
+    rows = rows.dropna(
+        subset=["dataset_tokens_per_second", "dollars_per_million_tokens"]
+    )
+    memory = rows["gpu_memory_utilization_max"].to_numpy(dtype=float)
+    # utilization may be recorded either as a fraction or as a percentage
+    if np.nanmax(memory, initial=0) > 1:
+        memory = memory / 100
+    rows = rows[~(memory > 1 - memory_safety_margin)]
+    if rows.empty:
+        return None
+    throughput = rows["dataset_tokens_per_second"].to_numpy(dtype=float)
+    cost = rows["dollars_per_million_tokens"].to_numpy(dtype=float)
+    frontier = _pareto_frontier(throughput, cost)
+    throughput, cost, rows = throughput[frontier], cost[frontier], rows[frontier]
+
+    def _normalize(x):
+        spread = x.max() - x.min()
+        return (x - x.min()) / spread if spread else np.zeros_like(x)
+
+    distance_to_ideal = np.hypot(1 - _normalize(throughput), _normalize(cost))
+    return rows.iloc[int(np.argmin(distance_to_ideal))]
+
+
+def _kb_rows_for_model(df, model_name_or_path: str, tuning_strategy: str):
+    """KB runs of the model, falling back to runs of its base/instruct variant"""
     try:
         model_name_or_path = model_name_or_path.split("/")[-2]
     except Exception:
@@ -77,12 +156,74 @@ def use_kb_for_batch_size(user_input: dict):
             model_name_or_path = model_name_or_path.replace("instruct", "base")
         elif "base" in model_name_or_path:
             model_name_or_path = model_name_or_path.replace("base", "instruct")
-            filtered = df[
-                (df["model_name"] == model_name_or_path)
-                & (df["method"] == tuning_strategy)
-            ]
+        filtered = df[
+            (df["model_name"] == model_name_or_path) & (df["method"] == tuning_strategy)
+        ]
+    return filtered
+
+
+def use_kb_for_throughput(
+    model_name_or_path: str, tuning_strategy: str, max_seq_length: int, gpu_model: str
+) -> dict | None:
+    """Fastest KB run of the model on gpu_model at the closest sequence length
+
+    Returns:
+        dict | None: dataset_tokens_per_second, number_gpus,
+        per_device_train_batch_size and dollars_per_million_tokens (may be
+        None) of the run, None when the KB has no such run.
+    """
+    df = load_tuning_run_data()
+    filtered = _kb_rows_for_model(df, str(model_name_or_path), tuning_strategy)
+    filtered = filtered[
+        (filtered["gpu_model"] == gpu_model)
+        & filtered["dataset_tokens_per_second"].notna()
+    ]
+    rows = _rows_for_length(filtered, max_seq_length)
+    if rows.empty:
+        return None
+    row = rows.loc[rows["dataset_tokens_per_second"].astype(float).idxmax()]
+    return {
+        "dataset_tokens_per_second": float(row["dataset_tokens_per_second"]),
+        "number_gpus": int(row.get("number_gpus", 1)),
+        "per_device_train_batch_size": int(row.get("per_device_train_batch_size", 1)),
+        "dollars_per_million_tokens": (
+            None
+            if pd.isna(row.get("dollars_per_million_tokens", None))
+            else float(row["dollars_per_million_tokens"])
+        ),
+    }
+
 
-    match = find_best_row(filtered, max_seq_length)
+def use_kb_for_batch_size(user_input: dict):
+    """Use the knowledge base to determine the optimal batch size"""
+    df = load_tuning_run_data()
+
+    local_model_path = str(user_input.get("model_name_or_path", ""))
+    model_name_or_path = local_model_path
+    tuning_strategy = user_input.get("tuning_strategy", "")
+    max_seq_length = user_input.get("max_seq_length", 2048)
+    objective = user_input.get("objective", None)
+
+    filtered = _kb_rows_for_model(df, model_name_or_path, tuning_strategy)
+
+    selected_by = None
+    match = None
+    if objective:
+        match = _rank_by_objective(
+            filtered,
+            max_seq_length,
+            objective,
+            user_input.get("memory_safety_margin", DEFAULT_MEMORY_SAFETY_MARGIN),
+        )
+        if match is not None:
+            selected_by = objective
+    if match is None:
+        # same fallback as find_optimal_row
+        match = find_best_row(filtered, max_seq_length)
+    if match is None and os.path.isdir(local_model_path):
+        return estimate_batch_size_from_neighbours(
+            get_model_config(local_model_path), tuning_strategy, max_seq_length
+        )
 
     batch_size_configs = {}
     if match is not None:
@@ -95,6 +236,11 @@ def use_kb_for_batch_size(user_input: dict):
                 "number_gpus": int(match.get("number_gpus", 16)),
             }
         )
+        for metric in ["dataset_tokens_per_second", "dollars_per_million_tokens"]:
+            if not pd.isna(match.get(metric, None)):
+                batch_size_configs[metric] = float(match[metric])
+        if selected_by:
+            batch_size_configs["selected_by"] = selected_by
     return batch_size_configs
 
 
@@ -108,6 +254,5 @@ def fetch_from_knowledge_base(model_name_or_path: str, kb_section):
 
 
 def get_model_config(model_name_or_path: str):
-    with open(f"{model_name_or_path}/config.json", encoding="utf-8") as f:
-        config = json.load(f)
-    return config
+    """Parsed config.json of the model, shared across callers and must not be modified"""
+    return get_model_facts(model_name_or_path).config
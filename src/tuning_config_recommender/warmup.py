@@ -0,0 +1,54 @@
+import os
+import time
+
+from loguru import logger
+
+from tuning_config_recommender.actions.compute import warm_up_estimator
+from tuning_config_recommender.utils.data_processing import get_model_path
+from tuning_config_recommender.utils.kb_table import (
+    _build_kb_table,
+    load_model_architectures,
+    load_tuning_run_data,
+)
+from tuning_config_recommender.utils.model_facts import get_model_facts
+
+
+def warmup_models() -> list[str]:
+    """Models given by TCR_WARMUP_MODELS, comma separated HF model ids"""
+    models = os.environ.get("TCR_WARMUP_MODELS", "")
+    return [m.strip() for m in models.split(",") if m.strip()]
+
+
+def warm_up(models: list[str] = ()) -> dict:
+    """Load what the first recommendation of a process would otherwise load:
+    the knowledge base, the min gpu estimator and the metadata of models.
+
+    Models that cannot be fetched are skipped with a warning, they are fetched
+    again on their first request.
+
+    Returns:
+        dict: seconds spent on kb, estimator and models, and the models that
+        failed
+    """
+    timings = {}
+    start = time.perf_counter()
+    _build_kb_table()
+    load_tuning_run_data()
+    load_model_architectures()
+    timings["kb"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    warm_up_estimator()
+    timings["estimator"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    failed = []
+    for model in models:
+        try:
+            get_model_facts(get_model_path(model))
+        except Exception as e:
+            logger.warning(f"Could not warm up metadata of {model}: {e!r}")
+            failed.append(model)
+    timings["models"] = time.perf_counter() - start
+    logger.info(f"Warm up done in {sum(timings.values()):.2f}s {timings}")
+    return {**timings, "failed_models": failed}
@@ -0,0 +1,29 @@
+import pytest
+
+from tuning_config_recommender.testing import (
+    fake_hub,
+    generate_dataset,
+    stub_estimator,
+)
+
+
+@pytest.fixture
+def hub(tmp_path):
+    with fake_hub(tmp_path / "hub") as store:
+        yield store
+
+
+@pytest.fixture
+def estimator():
+    with stub_estimator() as stub:
+        yield stub
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    def _dataset(name="train.jsonl", num_samples=100, kind="qa", **kwargs):
+        return str(
+            generate_dataset(tmp_path / "data" / name, num_samples, kind, **kwargs)
+        )
+
+    return _dataset
@@ -0,0 +1,442 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import yaml
+from fastapi.testclient import TestClient
+
+from tuning_config_recommender import api, cache_backends
+from tuning_config_recommender.artifacts import ArtifactStore
+from tuning_config_recommender.cache_backends import FileSystemCache, InProcessCache
+from tuning_config_recommender.jobs import InMemoryJobStore, SQLiteJobStore
+from tuning_config_recommender.utils.isolation import BoundedWorkerPool, PoolFullError
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(
+        api, "_POOL", BoundedWorkerPool(max_concurrency=1, max_queue=0, kind="thread")
+    )
+    monkeypatch.setattr(api, "_JOB_STORE", InMemoryJobStore())
+    monkeypatch.setattr(api, "_ARTIFACT_STORE", ArtifactStore())
+    monkeypatch.setattr(cache_backends, "_BACKEND", InProcessCache())
+    with TestClient(api.app) as client:
+        while client.get("/readyz").status_code != 200:
+            time.sleep(0.01)
+        yield client
+
+
+def test_pool_rejects_calls_beyond_its_queue():
+    pool = BoundedWorkerPool(max_concurrency=1, max_queue=1, kind="thread")
+
+    async def _calls():
+        return await asyncio.gather(
+            *[pool.run(time.sleep, 0.2) for _ in range(3)], return_exceptions=True
+        )
+
+    results = asyncio.run(_calls())
+    pool.shutdown()
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], PoolFullError)
+    assert results[2].retry_after >= 1
+    assert pool.pending == 0
+
+
+def test_recommend_returns_503_when_pool_is_full(client, monkeypatch):
+    release = threading.Event()
+
+    def _slow_recommendation(req):
+        release.wait(10)
+        return {"paths": {}, "artifacts": {}}
+
+    monkeypatch.setattr(api, "run_recommendation", _slow_recommendation)
+    first = {}
+    request = threading.Thread(
+        target=lambda: first.update(
+            response=client.post("/recommend", json={"tuning_config": {"id": 1}})
+        )
+    )
+    request.start()
+    while api._POOL.pending == 0:
+        time.sleep(0.01)
+
+    rejected = client.post("/recommend", json={"tuning_config": {"id": 2}})
+    release.set()
+    request.join()
+    assert rejected.status_code == 503
+    assert int(rejected.headers["Retry-After"]) >= 1
+    assert first["response"].status_code == 200
+
+
+@pytest.mark.parametrize("store", ["memory", "sqlite"])
+def test_job_store_round_trip(store, tmp_path):
+    if store == "memory":
+        jobs = InMemoryJobStore()
+    else:
+        jobs = SQLiteJobStore(tmp_path / "jobs.db")
+    job = jobs.create("a", {"tuning_config": {"max_seq_length": 1024}})
+    assert job["status"] == "queued"
+    jobs.update("a", status="succeeded", result={"paths": {"x": "y"}})
+    if store == "sqlite":
+        jobs.close()
+        jobs = SQLiteJobStore(tmp_path / "jobs.db")
+    job = jobs.get("a")
+    assert job["status"] == "succeeded"
+    assert job["result"] == {"paths": {"x": "y"}}
+    assert job["request"]["tuning_config"]["max_seq_length"] == 1024
+    assert jobs.get("b") is None
+    with pytest.raises(ValueError):
+        jobs.update("a", status="done")
+
+
+@pytest.mark.parametrize("store", ["memory", "sqlite"])
+def test_job_store_drops_expired_and_excess_finished_jobs(store, tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    if store == "memory":
+        jobs = InMemoryJobStore(max_jobs=2, ttl=60)
+    else:
+        jobs = SQLiteJobStore(tmp_path / "jobs.db", max_jobs=2, ttl=60)
+    jobs.create("old", {})
+    jobs.update("old", status="succeeded")
+    now[0] += 61
+    jobs.create("running", {})
+    assert jobs.get("old") is None
+    for job_id in ("a", "b"):
+        jobs.create(job_id, {})
+        jobs.update(job_id, status="failed")
+    # running jobs are kept, the oldest finished job goes beyond max_jobs
+    assert jobs.get("running")["status"] == "queued"
+    assert jobs.get("a") is None
+    assert jobs.get("b")["status"] == "failed"
+
+
+def test_sqlite_job_store_fails_jobs_interrupted_by_a_restart(tmp_path):
+    jobs = SQLiteJobStore(tmp_path / "jobs.db")
+    jobs.create("queued", {})
+    jobs.create("running", {})
+    jobs.update("running", status="running")
+    jobs.create("done", {})
+    jobs.update("done", status="succeeded")
+    jobs.close()
+    jobs = SQLiteJobStore(tmp_path / "jobs.db")
+    for job_id in ("queued", "running"):
+        job = jobs.get(job_id)
+        assert job["status"] == "failed"
+        assert "restart" in job["error"]
+    assert jobs.get("done")["status"] == "succeeded"
+
+
+def _wait_for(client, job_id, status):
+    for _ in range(500):
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {job['status']}, expected {status}")
+
+
+def test_jobs_can_be_polled_and_cancelled(client, monkeypatch):
+    release = threading.Event()
+
+    def _recommendation(req):
+        if req["tuning_config"].get("slow"):
+            release.wait(10)
+        return {
+            "paths": {"accelerate_config": "accelerate_config.yaml"},
+            "artifacts": {"accelerate_config.yaml": "num_processes: 8\n"},
+            "launch_command": "accelerate launch --config_file accelerate_config.yaml",
+        }
+
+    monkeypatch.setattr(api, "run_recommendation", _recommendation)
+    submitted = client.post("/jobs", json={"tuning_config": {}})
+    assert submitted.status_code == 202
+    job = _wait_for(client, submitted.json()["id"], "succeeded")
+    path = job["result"]["paths"]["accelerate_config"]
+    assert path == f"/jobs/{job['id']}/artifacts/accelerate_config.yaml"
+    assert job["result"]["launch_command"] == f"accelerate launch --config_file {path}"
+    # artifacts of jobs outlive the entries of the artifact store
+    monkeypatch.setattr(api, "_ARTIFACT_STORE", None)
+    assert client.get(path).text == "num_processes: 8\n"
+    assert client.get(f"/jobs/{job['id']}/artifacts/unknown.yaml").status_code == 404
+
+    slow = client.post("/jobs", json={"tuning_config": {"slow": True}}).json()
+    _wait_for(client, slow["id"], "running")
+    assert client.delete(f"/jobs/{slow['id']}").json()["status"] == "cancelled"
+    release.set()
+    assert client.delete(f"/jobs/{slow['id']}").status_code == 409
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_batch_runs_distinct_items_once_in_parallel(client, monkeypatch):
+    monkeypatch.setattr(
+        api, "_POOL", BoundedWorkerPool(max_concurrency=4, max_queue=0, kind="thread")
+    )
+    calls = []
+
+    def _recommendation(req):
+        model = req["tuning_config"]["model_name_or_path"]
+        calls.append(model)
+        time.sleep(0.3)
+        if model == "broken":
+            raise ValueError("broken model")
+        return {"paths": {}, "artifacts": {}, "model": model}
+
+    monkeypatch.setattr(api, "run_recommendation", _recommendation)
+    monkeypatch.setattr(api.app.state, "batch_slots", asyncio.Semaphore(4))
+    items = [
+        {"tuning_config": {"model_name_or_path": "a", "max_seq_length": 1024}},
+        {"tuning_config": {"model_name_or_path": "broken"}},
+        {"tuning_config": {"max_seq_length": 1024, "model_name_or_path": "a"}},
+        {"tuning_config": {"model_name_or_path": "b"}},
+    ]
+    start = time.perf_counter()
+    response = client.post("/recommend/batch", json=items)
+    elapsed = time.perf_counter() - start
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = sorted(
+        (json.loads(line) for line in response.text.splitlines()),
+        key=lambda line: line["index"],
+    )
+    assert [line["index"] for line in lines] == [0, 1, 2, 3]
+    assert sorted(calls) == ["a", "b", "broken"]
+    assert elapsed < 0.8
+    assert lines[0]["response"] == lines[2]["response"]
+    assert lines[0]["response"]["model"] == "a"
+    assert lines[1]["status_code"] == 500
+    assert lines[3]["response"]["model"] == "b"
+
+
+def test_batch_items_give_up_while_the_pool_stays_full(client, monkeypatch):
+    release = threading.Event()
+
+    def _slow_recommendation(req):
+        release.wait(10)
+        return {"paths": {}, "artifacts": {}}
+
+    monkeypatch.setattr(api, "run_recommendation", _slow_recommendation)
+    monkeypatch.setenv("TCR_BATCH_RETRY_TIMEOUT", "0.2")
+    single = {}
+    request = threading.Thread(
+        target=lambda: single.update(
+            response=client.post("/recommend", json={"tuning_config": {"id": 1}})
+        )
+    )
+    request.start()
+    while api._POOL.pending == 0:
+        time.sleep(0.01)
+
+    response = client.post("/recommend/batch", json=[{"tuning_config": {"id": 2}}])
+    release.set()
+    request.join()
+    (line,) = [json.loads(line) for line in response.text.splitlines()]
+    assert line["status_code"] == 503
+    assert line["retry_after"] >= 1
+    assert single["response"].status_code == 200
+
+
+def test_artifact_store_expires_and_bounds_entries(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    store = ArtifactStore(ttl=10, max_bytes=10)
+    first = store.put({"a.yaml": "12345"})
+    second = store.put({"a.yaml": "1234"})
+    assert store.get(first, "a.yaml") == "12345"
+    third = store.put({"a.yaml": "12"})
+    # the oldest entry is dropped to stay within max_bytes
+    assert store.get(first, "a.yaml") is None
+    assert store.size == 6
+    now[0] = 11
+    assert store.get(second, "a.yaml") is None
+    assert store.sweep() == 2
+    assert len(store) == 0 and store.size == 0
+    assert store.get(third, "b.yaml") is None
+
+
+def test_recommend_serves_configs_from_memory(
+    client, monkeypatch, hub, estimator, dataset, tmp_path
+):
+    monkeypatch.chdir(tmp_path)
+    response = client.post(
+        "/recommend",
+        json={
+            "tuning_config": {
+                "model_name_or_path": "ibm-granite/granite-3.1-8b-base",
+                "training_data_path": dataset(),
+            },
+            "compute_config": {},
+            "accelerate_config": {},
+            "tuning_data_config": {},
+        },
+    )
+    assert response.status_code == 200
+    paths = response.json()["paths"]
+    assert set(paths) == {
+        "tuning_config",
+        "compute_config",
+        "accelerate_config",
+        "tuning_data_config",
+    }
+    tuning_config = yaml.safe_load(client.get(paths["tuning_config"]).text)
+    assert tuning_config["model_name_or_path"] == "ibm-granite/granite-3.1-8b-base"
+    launch_command = response.json()["launch_command"]
+    assert f"--config_file {paths['accelerate_config']}" in launch_command
+    assert f"--data_config {paths['tuning_data_config']}" in launch_command
+    assert client.get("/artifacts/unknown/tuning_config.yaml").status_code == 404
+    assert not list(tmp_path.rglob("*.yaml"))
+
+
+def test_identical_concurrent_requests_share_one_run(client, monkeypatch):
+    calls = []
+
+    def _recommendation(req):
+        calls.append(req)
+        time.sleep(0.3)
+        return {"paths": {"tuning_config": "tuning_config.yaml"}, "artifacts": {}}
+
+    monkeypatch.setattr(api, "run_recommendation", _recommendation)
+    payload = {"tuning_config": {"model_name_or_path": "a", "max_seq_length": 1024}}
+    reordered = {"tuning_config": {"max_seq_length": 1024, "model_name_or_path": "a"}}
+    # the pool runs one request and queues none, the second would be rejected
+    with ThreadPoolExecutor(2) as pool:
+        responses = list(
+            pool.map(
+                lambda body: client.post("/recommend", json=body), [payload, reordered]
+            )
+        )
+    assert [r.status_code for r in responses] == [200, 200]
+    assert len(calls) == 1
+    assert responses[0].json()["artifact_id"] == responses[1].json()["artifact_id"]
+
+
+def test_recommend_stream_emits_patches_before_the_result(
+    client, hub, estimator, dataset, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    response = client.post(
+        "/recommend/stream",
+        json={
+            "tuning_config": {
+                "model_name_or_path": "ibm-granite/granite-3.1-8b-base",
+                "training_data_path": dataset(),
+            },
+            "compute_config": {},
+            "accelerate_config": {},
+            "tuning_data_config": {},
+        },
+    )
+    assert response.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["event"] for e in events[:-1]].count("action") >= 1
+    action = next(e for e in events if e["event"] == "action")
+    assert {"json_merge_patch", "json_patch", "comment", "seconds"} <= set(action)
+    assert isinstance(action["comment"], str)
+    stages = [e["stage"] for e in events if e["event"] == "stage"]
+    assert stages == ["resolve_model", "rule_engine", "render"]
+    assert events[-1]["event"] == "result"
+    paths = events[-1]["result"]["paths"]
+    assert client.get(paths["tuning_config"]).status_code == 200
+    # the request is timed until the last line was streamed
+    metrics = client.get("/metrics").text
+    sum_line = 'tcr_request_seconds_sum{endpoint="/recommend/stream",status="200"} '
+    streamed = float(metrics.split(sum_line)[1].split()[0])
+    assert streamed >= sum(e["seconds"] for e in events if e["event"] == "stage")
+
+
+def test_metrics_expose_request_and_stage_latency(
+    client, hub, estimator, dataset, tmp_path, monkeypatch
+):
+    monkeypatch.chdir(tmp_path)
+    body = {
+        "tuning_config": {
+            "model_name_or_path": "ibm-granite/granite-3.1-8b-base",
+            "training_data_path": dataset(),
+        },
+        "compute_config": {},
+        "accelerate_config": {},
+        "tuning_data_config": {},
+    }
+    assert client.post("/recommend", json=body).status_code == 200
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    text = response.text
+    assert 'tcr_request_seconds_count{endpoint="/recommend",status="200"}' in text
+    for stage in ("resolve_model", "dataset_probe", "rule_engine", "render"):
+        assert f'tcr_stage_seconds_count{{stage="{stage}"}}' in text
+    assert "tcr_action_seconds_bucket{action=" in text
+    assert "tcr_engine_iterations_total " in text
+    assert 'tcr_cache_lookups_total{cache="model_store",result=' in text
+    assert "tcr_queue_depth 0.0" in text
+    assert "tcr_in_flight_requests 1.0" in text
+
+
+def test_readyz_waits_for_warm_up_of_popular_models(hub, monkeypatch):
+    monkeypatch.setattr(
+        api, "_POOL", BoundedWorkerPool(max_concurrency=2, max_queue=0, kind="thread")
+    )
+    model = "ibm-granite/granite-3.1-8b-base"
+    monkeypatch.setenv("TCR_WARMUP_MODELS", f"{model}, unknown/model")
+    with TestClient(api.app) as client:
+        assert client.get("/healthz").json() == {"status": "ok"}
+        for _ in range(500):
+            ready = client.get("/readyz")
+            if ready.status_code == 200:
+                break
+            assert ready.json()["status"] == "warming_up"
+            time.sleep(0.01)
+    assert ready.status_code == 200
+    assert ready.json()["failed_models"] == ["unknown/model"]
+    assert (hub.ref_dir(model) / "config.json").is_file()
+
+
+def test_replicas_reuse_recommendations_from_a_shared_cache(
+    client, monkeypatch, tmp_path
+):
+    calls = []
+
+    def _recommendation(req):
+        calls.append(req)
+        return {
+            "paths": {"tuning_config": "tuning_config.yaml"},
+            "artifacts": {"tuning_config.yaml": "learning_rate: 1.0e-05\n"},
+        }
+
+    monkeypatch.setattr(api, "run_recommendation", _recommendation)
+    monkeypatch.setattr(cache_backends, "_BACKEND", FileSystemCache(tmp_path))
+    payload = {"tuning_config": {"model_name_or_path": "a"}}
+    first = client.post("/recommend", json=payload).json()
+    # another replica has its own artifact store but shares the cache
+    monkeypatch.setattr(api, "_ARTIFACT_STORE", ArtifactStore())
+    second = client.post("/recommend", json=payload).json()
+    assert len(calls) == 1
+    assert second["artifact_id"] != first["artifact_id"]
+    tuning_config = client.get(second["paths"]["tuning_config"]).text
+    assert tuning_config == "learning_rate: 1.0e-05\n"
+
+
+def test_readyz_reports_degraded_once_warm_up_retries_are_used_up(monkeypatch):
+    monkeypatch.setattr(
+        api, "_POOL", BoundedWorkerPool(max_concurrency=1, max_queue=0, kind="thread")
+    )
+    attempts = []
+
+    def _failing_warm_up(models):
+        attempts.append(models)
+        raise OSError("hub unreachable")
+
+    monkeypatch.setattr(api, "warm_up", _failing_warm_up)
+    monkeypatch.setenv("TCR_WARMUP_RETRIES", "2")
+    monkeypatch.setenv("TCR_WARMUP_BACKOFF", "0.01")
+    with TestClient(api.app) as client:
+        for _ in range(500):
+            ready = client.get("/readyz")
+            if ready.status_code == 200:
+                break
+            time.sleep(0.01)
+    assert ready.status_code == 200
+    assert ready.json()["status"] == "degraded"
+    assert "hub unreachable" in ready.json()["error"]
+    assert len(attempts) == 3
@@ -0,0 +1,80 @@
+import pytest
+
+from tuning_config_recommender.actions import IR
+from tuning_config_recommender.actions.train import ApplyGlobalBatchSize
+from tuning_config_recommender.adapters import FMSAdapter
+from tuning_config_recommender.utils.batch_solver import solve_global_batch
+
+
+@pytest.mark.parametrize("num_processes", [8, 16, 32, 64])
+def test_global_batch_is_kept_across_node_counts(num_processes):
+    solution = solve_global_batch(
+        num_processes, max_per_device_batch_size=6, target_global_batch_size=256
+    )
+    assert solution["global_batch_size"] == 256
+    assert solution["relative_error"] == 0
+    # largest per device batch that divides the target
+    assert solution["per_device_train_batch_size"] == min(4, 256 // num_processes)
+
+
+def test_token_target_and_uneven_split():
+    solution = solve_global_batch(
+        6, 8, target_global_batch_tokens=4 * 1024 * 1024, seq_len=4096
+    )
+    assert solution["target_global_batch_size"] == 1024
+    assert (
+        solution["per_device_train_batch_size"]
+        * solution["gradient_accumulation_steps"]
+        * 6
+        == solution["global_batch_size"]
+    )
+    assert 0 < solution["relative_error"] < 0.01
+
+
+def test_adapter_solves_target_global_batch(hub, estimator, dataset, tmp_path):
+    result = FMSAdapter(base_dir=tmp_path / "out").execute(
+        tuning_config={
+            "model_name_or_path": "ibm-granite/granite-3.1-2b-base",
+            "training_data_path": dataset(),
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+            "target_global_batch_tokens": 2 * 1024 * 1024,
+        },
+        compute_config={},
+        accelerate_config={},
+        data_config={},
+        unique_tag="global-batch",
+        paths={},
+    )
+    section = result["dict_payload"]["step_config_section"]
+    tuning_config = section["tuning_config"]
+    num_processes = section["compute_config"]["num_gpus_per_node"]
+    assert "target_global_batch_tokens" not in tuning_config
+    assert (
+        tuning_config["per_device_train_batch_size"]
+        * tuning_config["gradient_accumulation_steps"]
+        * num_processes
+        == 512
+    )
+
+
+def test_comment_reports_the_global_batch_reached_when_off_target(hub):
+    ir = IR(
+        tuning_config={
+            "model_name_or_path": hub.get("ibm-granite/granite-3.1-2b-base"),
+            "max_seq_length": 1024,
+            "target_global_batch_size": 1003,
+        },
+        compute_config={"num_nodes": 1, "num_gpus_per_node": 6},
+    )
+    patch = ApplyGlobalBatchSize().apply(ir, [])
+    reached = (
+        patch.tuning_config["per_device_train_batch_size"]
+        * patch.tuning_config["gradient_accumulation_steps"]
+        * 6
+    )
+    assert reached != 1003
+    comment = str(patch.comment)
+    assert f"Global batch of {reached} samples" in comment
+    assert f"off by {reached - 1003:+d} samples" in comment
+    assert "hits the target" not in comment
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from tuning_config_recommender.cache_backends import (
+    CacheBackendError,
+    FileSystemCache,
+    InProcessCache,
+    RedisCache,
+)
+from tuning_config_recommender.testing import fake_redis
+
+
+@pytest.fixture(params=["memory", "filesystem", "redis"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield InProcessCache(default_ttl=0.2)
+    elif request.param == "filesystem":
+        yield FileSystemCache(tmp_path / "cache", default_ttl=0.2)
+    else:
+        with fake_redis(password="secret") as server:
+            cache = RedisCache(server.url, default_ttl=0.2)
+            yield cache
+            cache.close()
+
+
+def test_backends_store_values_until_they_expire(backend):
+    backend.set("a", b"1")
+    backend.set("b", b"2", ttl=60)
+    backend.set_json("c", {"lengths": [1.0, 2.0]}, ttl=60)
+    assert backend.get("a") == b"1"
+    assert backend.get_json("c") == {"lengths": [1.0, 2.0]}
+    backend.delete("b")
+    assert backend.get("b") is None
+    time.sleep(0.3)
+    assert backend.get("a") is None
+    assert backend.get_json("c") == {"lengths": [1.0, 2.0]}
+
+
+@pytest.mark.parametrize("kind", ["memory", "filesystem"])
+def test_backends_drop_least_recently_used_values_beyond_max_bytes(kind, tmp_path):
+    if kind == "memory":
+        cache = InProcessCache(max_bytes=10)
+    else:
+        cache = FileSystemCache(tmp_path, max_bytes=10)
+    cache.set("a", b"1234")
+    time.sleep(0.01)
+    cache.set("b", b"1234")
+    time.sleep(0.01)
+    assert cache.get("a") == b"1234"
+    time.sleep(0.01)
+    cache.set("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234" and cache.get("c") == b"1234"
+
+
+def test_redis_cache_reconnects_and_reports_errors():
+    with fake_redis(password="secret") as server:
+        cache = RedisCache(server.url, prefix="x:")
+        cache.set("a", b"1")
+        assert server.data[b"x:a"][0] == b"1"
+        # the next command after a dropped connection reconnects
+        server.drop_connections()
+        assert cache.get("a") == b"1"
+        assert server.commands.count("AUTH") == 2
+        with pytest.raises(CacheBackendError):
+            RedisCache(server.url.replace("secret", "wrong")).get("a")
+        url = server.url
+    # an unavailable cache is a miss
+    assert RedisCache(url, timeout=0.2).get_json("a") is None
@@ -0,0 +1,233 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tuning_config_recommender.actions import compute
+from tuning_config_recommender.utils import kb_table
+from tuning_config_recommender.utils.isolation import (
+    CircuitBreaker,
+    CircuitOpenError,
+    ProcessIsolatedRunner,
+)
+
+
+class CountingRecommender:
+    def __init__(self):
+        self.calls = []
+
+    def run(self, configuration, y):
+        self.calls.append(configuration)
+        if configuration["gpus_per_worker"] < 4:
+            return {"workers": -1, "gpus_per_worker": -1}
+        return {"workers": 1, "gpus_per_worker": configuration["gpus_per_worker"]}
+
+
+@pytest.fixture
+def recommender(monkeypatch):
+    stub = CountingRecommender()
+    monkeypatch.setattr(compute, "_RECOMMENDER", stub)
+    monkeypatch.setattr(compute, "ESTIMATOR_ISOLATION", "inline")
+    compute._run_min_gpu_recommender.cache_clear()
+    yield stub
+    compute._run_min_gpu_recommender.cache_clear()
+
+
+def _configuration(**overrides):
+    return {
+        "model_name": "granite-3.1-8b-base",
+        "method": "full",
+        "gpu_model": "NVIDIA-A100-SXM4-80GB",
+        "tokens_per_sample": 4096,
+        "batch_size": 8,
+        "gpus_per_worker": 8,
+        "model_version": "2.0.0",
+        **overrides,
+    }
+
+
+def test_recommender_results_are_memoized_on_normalized_configuration(recommender):
+    first = compute.run_min_gpu_recommender(_configuration())
+    first["workers"] = 100
+    second = compute.run_min_gpu_recommender(
+        _configuration(method=" FULL ", tokens_per_sample="4096")
+    )
+    assert second == {"workers": 1, "gpus_per_worker": 8}
+    assert len(recommender.calls) == 1
+    compute.run_min_gpu_recommender(_configuration(gpus_per_worker=4))
+    assert len(recommender.calls) == 2
+
+
+def test_compute_config_picks_smallest_feasible_candidate(recommender, monkeypatch):
+    monkeypatch.setattr(compute, "skip_autoconf", False)
+    monkeypatch.setattr(
+        compute.ApplyComputeConfig, "_infer_model_name", lambda self, m: m
+    )
+    ir = compute.IR(
+        tuning_config={
+            "model_name_or_path": "granite-3.1-8b-base",
+            "per_device_train_batch_size": 2,
+            "max_seq_length": 4096,
+        },
+        compute_config={
+            "candidate_shapes": [
+                {"num_nodes": 2, "num_gpus_per_node": 8},
+                {"num_nodes": 1, "num_gpus_per_node": 2},
+                {"num_nodes": 1, "num_gpus_per_node": 4},
+            ]
+        },
+    )
+    patch = compute.ApplyComputeConfig().apply(ir, [])
+    assert patch.compute_config == {"num_nodes": 1, "num_gpus_per_node": 4}
+    assert sorted(c["batch_size"] for c in recommender.calls) == [4, 8, 16]
+    assert "1x2 infeasible" in str(patch.comment)
+    assert "2x8 feasible as 1x8" in str(patch.comment)
+
+
+def test_multi_node_shapes_use_the_workers_returned_per_node(recommender, monkeypatch):
+    monkeypatch.setattr(compute, "skip_autoconf", False)
+    monkeypatch.setattr(
+        compute.ApplyComputeConfig, "_infer_model_name", lambda self, m: m
+    )
+    monkeypatch.setattr(
+        recommender,
+        "run",
+        lambda configuration, y: (
+            recommender.calls.append(configuration)
+            or (
+                {"workers": 2, "gpus_per_worker": 8}
+                if configuration["gpus_per_worker"] == 8
+                else {"workers": -1, "gpus_per_worker": -1}
+            )
+        ),
+    )
+    ir = compute.IR(tuning_config={"model_name_or_path": "granite-3.1-8b-base"})
+    patch = compute.ApplyComputeConfig().apply(ir, [])
+    assert patch.compute_config == {"num_nodes": 2, "num_gpus_per_node": 8}
+    # 1x8, 2x8, 4x8 and 8x8 share a single query
+    assert len(recommender.calls) == 4
+    assert "1x8 infeasible, 2x8 feasible as 2x8" in str(patch.comment)
+
+
+LLAMA_8B = {
+    "model_type": "llama",
+    "hidden_size": 4096,
+    "num_hidden_layers": 32,
+    "num_attention_heads": 32,
+    "num_key_value_heads": 8,
+    "intermediate_size": 14336,
+    "vocab_size": 128256,
+}
+
+
+@pytest.mark.parametrize(
+    "rank_by,expected",
+    [("throughput", "NVIDIA-H100-80GB-HBM3"), ("cost", "NVIDIA-A100-SXM4-80GB")],
+)
+def test_gpu_types_are_ranked(recommender, monkeypatch, tmp_path, rank_by, expected):
+    monkeypatch.setattr(compute, "skip_autoconf", False)
+    monkeypatch.setattr(
+        compute.ApplyComputeConfig, "_infer_model_name", lambda self, m: m
+    )
+    runs = tmp_path / "tuning_run_data.csv"
+    runs.write_text(
+        "model_name,method,model_max_length,per_device_train_batch_size,gpu_model,"
+        "number_gpus,dollars_per_million_tokens,dataset_tokens_per_second\n"
+        "granite-3.1-8b-base,full,4096,4,NVIDIA-H100-80GB-HBM3,8,,60000\n"
+    )
+    monkeypatch.setattr(kb_table, "TUNING_RUN_DATA_PATH", runs)
+    model_dir = tmp_path / "granite-3.1-8b-base" / "main"
+    model_dir.mkdir(parents=True)
+    (model_dir / "config.json").write_text(json.dumps(LLAMA_8B))
+    ir = compute.IR(
+        tuning_config={"model_name_or_path": str(model_dir), "max_seq_length": 4096},
+        compute_config={
+            "rank_by": rank_by,
+            "gpu_types": [
+                {"gpu_model": "NVIDIA-L40S", "count": 2},
+                {"gpu_model": "NVIDIA-A100-SXM4-80GB", "price_per_gpu_hour": 2},
+                {
+                    "gpu_model": "NVIDIA-H100-80GB-HBM3",
+                    "count": 4,
+                    "price_per_gpu_hour": 8,
+                },
+            ],
+        },
+    )
+    patch = compute.ApplyComputeConfig().apply(ir, [])
+    assert patch.compute_config == {
+        "num_nodes": 1,
+        "num_gpus_per_node": 4,
+        "gpu_model": expected,
+    }
+    ranking = str(patch.comment).splitlines()[0]
+    # H100 throughput comes from the KB, A100 from the analytic estimate
+    assert "NVIDIA-H100-80GB-HBM3 1x4 ~30000 tokens/s" in ranking
+    assert "analytic estimate" in ranking
+    assert ranking.endswith("3. NVIDIA-L40S infeasible")
+
+
+def test_isolated_timeout_counts_running_time_and_kills_only_hung_worker():
+    runner = ProcessIsolatedRunner(timeout=1.5, max_workers=2)
+    try:
+        runner.start()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            # four 0.8s calls on two workers, queued ones must not time out
+            calls = executor.map(lambda _: runner.call(time.sleep, 0.8), range(4))
+            assert list(calls) == [None] * 4
+            hung = executor.submit(runner.call, time.sleep, 60)
+            time.sleep(0.2)
+            healthy = executor.submit(runner.call, time.sleep, 1.0)
+            with pytest.raises(TimeoutError):
+                hung.result()
+            assert healthy.result() is None
+    finally:
+        runner.shutdown()
+    assert not runner.breaker.is_open
+
+
+class HangingRecommender:
+    def run(self, configuration, y):
+        time.sleep(60)
+
+
+def test_hanging_estimator_falls_back_within_timeout(monkeypatch, tmp_path):
+    compute._run_min_gpu_recommender.cache_clear()
+    runner = ProcessIsolatedRunner(
+        initializer=compute._init_estimator_worker,
+        initargs=(HangingRecommender,),
+        timeout=0.5,
+        max_workers=1,
+        breaker=CircuitBreaker(failure_threshold=1, cooldown=60),
+    )
+    monkeypatch.setattr(compute, "_RUNNER", runner)
+    monkeypatch.setattr(compute, "ESTIMATOR_ISOLATION", "process")
+    monkeypatch.setattr(compute, "skip_autoconf", False)
+    monkeypatch.setattr(
+        compute.ApplyComputeConfig, "_infer_model_name", lambda self, m: m
+    )
+    model_dir = tmp_path / "granite-3.1-8b-base"
+    model_dir.mkdir()
+    (model_dir / "config.json").write_text(json.dumps(LLAMA_8B))
+    ir = compute.IR(
+        tuning_config={
+            "model_name_or_path": str(model_dir),
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+        },
+    )
+    try:
+        runner.start()
+        start = time.monotonic()
+        patch = compute.ApplyComputeConfig().apply(ir, [])
+        assert time.monotonic() - start < 10
+    finally:
+        runner.shutdown()
+        compute._run_min_gpu_recommender.cache_clear()
+    # 8B full fine tuning needs 8B * 12 bytes of model states, sharded over 2 GPUs
+    assert patch.compute_config == {"num_nodes": 1, "num_gpus_per_node": 2}
+    assert "fallback based on the analytic memory estimate" in str(patch.comment)
+    assert runner.breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        runner.call(compute._recommend, ())
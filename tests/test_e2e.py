@@ -1,3 +1,7 @@
+import json
+
+import pytest
+
 from tuning_config_recommender.adapters import FMSAdapter
 
 
@@ -15,3 +19,62 @@ def test_FMSAdapter_execution_on_hf_model_and_datasets():
         unique_tag="gpq12df-fms",
         paths={},
     )
+
+
+@pytest.mark.parametrize(
+    "model_name_or_path,kind,name",
+    [
+        ("ibm-granite/granite-3.1-8b-instruct", "chat", "train.jsonl"),
+        ("meta-llama/Llama-3.1-8B", "qa", "train.parquet"),
+        ("mistralai/Mixtral-8x7B-v0.1", "qa", "train.csv"),
+    ],
+)
+def test_FMSAdapter_execution_offline(
+    hub, estimator, dataset, tmp_path, model_name_or_path, kind, name
+):
+    result = FMSAdapter(base_dir=tmp_path / "out").execute(
+        tuning_config={
+            "model_name_or_path": model_name_or_path,
+            "training_data_path": dataset(name, kind=kind),
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+        },
+        compute_config={},
+        accelerate_config={},
+        data_config={},
+        unique_tag="offline",
+        paths={},
+    )
+    section = result["dict_payload"]["step_config_section"]
+    assert section["compute_config"]["num_gpus_per_node"] >= 2
+    assert any(
+        "Feasibility" in str(p["comment"]) for p in result["serializable_patches"]
+    )
+    data_config = section["tuning_data_config"]
+    if kind == "chat":
+        assert "start_of_role" in data_config["chat_template"]
+    else:
+        assert data_config["datasets"][0]["data_handlers"][0]["name"] == (
+            "apply_custom_jinja_template"
+        )
+
+
+def test_FMSAdapter_result_without_patches(hub, estimator, dataset, tmp_path):
+    result = FMSAdapter(output_mode="memory").execute(
+        tuning_config={
+            "model_name_or_path": "ibm-granite/granite-3.1-8b-instruct",
+            "training_data_path": dataset("train.jsonl", kind="chat"),
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+        },
+        compute_config={},
+        accelerate_config={},
+        data_config={},
+        unique_tag="offline",
+        paths={},
+        include=(),
+    )
+    assert "patches" not in result
+    assert set(result["serializable_patches"][0]) == {"json_patch", "comment"}
+    # the result is built from JSON values only
+    assert json.loads(json.dumps(result)) == result
@@ -0,0 +1,248 @@
+import json
+
+import pytest
+
+from tuning_config_recommender.utils import kb_table
+from tuning_config_recommender.utils.kb_estimator import (
+    estimate_batch_size_from_neighbours,
+)
+from tuning_config_recommender.utils.kb_ingest import ingest_runs
+from tuning_config_recommender.utils.tuning_config import (
+    find_best_row,
+    find_optimal_row,
+    use_kb_for_batch_size,
+)
+
+RUN_DATA_HEADER = (
+    "model_name,method,number_nodes,model_max_length,rnk,batch_size,"
+    "per_device_train_batch_size,gpu_model,number_gpus,dollars_per_million_tokens,"
+    "gpu_hours_per_million_tokens,dataset_tokens_per_second,"
+    "gpu_memory_utilization_max,train_samples_per_second,experiment_id\n"
+)
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    runs = tmp_path / "tuning_run_data.csv"
+    runs.write_text(
+        RUN_DATA_HEADER
+        + "small-base,full,1,4096,0,64,8,NVIDIA-A100-SXM4-80GB,8,1.0,0.5,20000,0.7,5.0,e1\n"
+        + "large-base,full,1,4096,0,16,2,NVIDIA-A100-SXM4-80GB,8,4.0,2.0,5000,0.9,1.2,e2\n"
+        + "large-base,full,1,2048,0,32,4,NVIDIA-A100-SXM4-80GB,8,3.5,1.8,6000,0.8,3.0,e3\n"
+        + "large-base,lora,1,4096,8,64,8,NVIDIA-A100-SXM4-80GB,8,2.0,1.0,9000,0.6,2.2,e4\n"
+    )
+    archs = tmp_path / "model_architectures.csv"
+    archs.write_text(
+        "model_name,hidden_size,num_hidden_layers,num_attention_heads,vocab_size,num_experts\n"
+        "small-base,1024,24,16,49155,0\n"
+        "large-base,4096,40,32,49155,0\n"
+    )
+    monkeypatch.setattr(kb_table, "TUNING_RUN_DATA_PATH", runs)
+    monkeypatch.setattr(kb_table, "MODEL_ARCHITECTURES_PATH", archs)
+    return tmp_path
+
+
+def _write_model(path, **config):
+    path.mkdir(parents=True)
+    (path / "config.json").write_text(json.dumps(config))
+    return path
+
+
+def test_neighbour_estimate_prefers_architecturally_similar_models(kb):
+    config = {
+        "hidden_size": 4096,
+        "num_hidden_layers": 36,
+        "num_attention_heads": 32,
+        "vocab_size": 49155,
+    }
+    result = estimate_batch_size_from_neighbours(config, "full", 4096, k=1)
+    assert result["per_device_train_batch_size"] == 2
+    assert result["neighbours"][0]["model_name"] == "large-base"
+
+
+def test_neighbour_estimate_rescales_other_sequence_lengths(kb):
+    config = {"hidden_size": 4096, "num_hidden_layers": 40, "num_attention_heads": 32}
+    result = estimate_batch_size_from_neighbours(config, "full", 8192, k=1)
+    # 4 samples of 2048 tokens become 1 sample of 8192 tokens
+    assert result["per_device_train_batch_size"] == 1
+    assert result["model_max_length"] == 8192
+
+
+def test_kb_batch_size_falls_back_to_neighbours(kb):
+    model_dir = _write_model(
+        kb / "models" / "new-model" / "main",
+        hidden_size=1024,
+        num_hidden_layers=24,
+        num_attention_heads=16,
+        vocab_size=49155,
+    )
+    result = use_kb_for_batch_size(
+        {
+            "model_name_or_path": str(model_dir),
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+        }
+    )
+    assert result["neighbours"]
+    assert result["per_device_train_batch_size"] >= 2
+
+
+@pytest.mark.parametrize(
+    "objective,expected_experiment",
+    [("throughput", "t1"), ("cost", "c1"), ("pareto", "p1")],
+)
+def test_kb_batch_size_objectives(kb, objective, expected_experiment):
+    (kb / "tuning_run_data.csv").write_text(
+        RUN_DATA_HEADER
+        + "m-base,full,1,4096,0,64,8,A100,8,3.0,1.0,30000,0.95,5.0,t1\n"
+        + "m-base,full,1,4096,0,32,4,A100,8,1.0,0.8,12000,0.60,3.0,c1\n"
+        + "m-base,full,1,4096,0,48,6,A100,8,1.2,0.9,25000,0.80,4.0,p1\n"
+        + "m-base,full,1,4096,0,56,7,A100,8,2.8,1.1,27000,0.85,4.5,q1\n"
+        + "m-base,full,1,4096,0,16,2,A100,8,2.5,1.2,10000,0.50,2.0,dominated\n"
+    )
+    result = use_kb_for_batch_size(
+        {
+            "model_name_or_path": "models/m-base/main",
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+            "objective": objective,
+        }
+    )
+    expected_batch_size = {"t1": 8, "c1": 4, "p1": 6}[expected_experiment]
+    assert result["per_device_train_batch_size"] == expected_batch_size
+    assert result["number_gpus"] == 8
+    assert "dataset_tokens_per_second" in result
+    assert result["selected_by"] == objective
+
+
+def test_pareto_falls_back_like_the_other_objectives(kb):
+    # every run uses more memory than the safety margin allows
+    (kb / "tuning_run_data.csv").write_text(
+        RUN_DATA_HEADER
+        + "m-base,full,1,4096,0,64,8,A100,8,3.0,1.0,30000,0.95,5.0,t1\n"
+        + "m-base,full,1,4096,0,32,4,A100,8,1.0,0.8,12000,0.92,3.0,c1\n"
+    )
+    runs = kb_table.load_tuning_run_data()
+    assert (
+        find_optimal_row(runs, 4096, "pareto")["experiment_id"]
+        == (find_best_row(runs, 4096)["experiment_id"])
+    )
+    result = use_kb_for_batch_size(
+        {
+            "model_name_or_path": "models/m-base/main",
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+            "objective": "pareto",
+        }
+    )
+    assert result["per_device_train_batch_size"] == 8
+    assert "selected_by" not in result
+
+
+def test_kb_batch_size_says_when_the_objective_could_not_be_used(kb):
+    # no run of large-base records its cost
+    (kb / "tuning_run_data.csv").write_text(
+        RUN_DATA_HEADER
+        + "large-base,full,1,2048,0,32,4,A100,8,,1.8,6000,0.8,3.0,e1\n"
+        + "large-base,full,1,2048,0,16,2,A100,8,,2.0,5000,0.7,1.2,e2\n"
+    )
+    result = use_kb_for_batch_size(
+        {
+            "model_name_or_path": "models/large-base/main",
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+            "objective": "cost",
+        }
+    )
+    assert result["per_device_train_batch_size"] == 4
+    assert result["model_max_length"] == 2048
+    assert "selected_by" not in result
+
+
+def _write_run(run_dir, experiment_id, tokens_per_second=1000.0):
+    run_dir.mkdir(parents=True)
+    (run_dir / "trainer_state.json").write_text(
+        json.dumps(
+            {
+                "log_history": [
+                    {"loss": 1.0, "step": 1},
+                    {
+                        "train_runtime": 100.0,
+                        "train_samples_per_second": 2.5,
+                        "train_tokens_per_second": tokens_per_second,
+                    },
+                ]
+            }
+        )
+    )
+    (run_dir / "tuning_config.yaml").write_text(
+        "model_name_or_path: ibm-granite/new-model-base\n"
+        "max_seq_length: 4096\n"
+        "per_device_train_batch_size: 4\n"
+        "gradient_accumulation_steps: 2\n"
+    )
+    (run_dir / "compute_config.yaml").write_text("num_nodes: 1\nnum_gpus_per_node: 8\n")
+    (run_dir / "run_metadata.json").write_text(
+        json.dumps(
+            {
+                "experiment_id": experiment_id,
+                "gpu_model": "NVIDIA-A100-SXM4-80GB",
+                "price_per_gpu_hour": 2.0,
+            }
+        )
+    )
+    (run_dir / "config.json").write_text(
+        json.dumps({"hidden_size": 2048, "num_hidden_layers": 40})
+    )
+
+
+def test_ingest_appends_new_runs_only(kb):
+    _write_run(kb / "runs" / "a", "exp-a")
+    _write_run(kb / "runs" / "nested" / "b", "exp-b", tokens_per_second=2000.0)
+    (kb / "runs" / "unfinished").mkdir()
+    (kb / "runs" / "unfinished" / "trainer_state.json").write_text(
+        json.dumps({"log_history": [{"loss": 1.0}]})
+    )
+
+    assert ingest_runs(kb / "runs") == 2
+    assert ingest_runs(kb / "runs") == 0
+
+    runs = kb_table.load_tuning_run_data()
+    ingested = runs[runs["model_name"] == "new-model-base"]
+    assert sorted(ingested["experiment_id"]) == ["exp-a", "exp-b"]
+    row = ingested[ingested["experiment_id"] == "exp-a"].iloc[0]
+    assert row["method"] == "full"
+    assert row["number_gpus"] == 8
+    assert row["batch_size"] == 64
+    assert row["dataset_tokens_per_second"] == 8000.0
+    assert "new-model-base" in set(kb_table.load_model_architectures()["model_name"])
+
+    result = use_kb_for_batch_size(
+        {
+            "model_name_or_path": "models/new-model-base/main",
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+            "objective": "throughput",
+        }
+    )
+    assert result["dataset_tokens_per_second"] == 16000.0
+
+
+def test_ingest_tells_apart_runs_with_the_same_folder_name(kb):
+    for parent in ("a", "b"):
+        run_dir = kb / "runs" / parent / "run-1"
+        _write_run(run_dir, "unused")
+        (run_dir / "run_metadata.json").write_text(
+            json.dumps({"gpu_model": "NVIDIA-A100-SXM4-80GB"})
+        )
+    kb_path = kb / "user" / "tuning_run_data.csv"
+    architectures_path = kb / "user" / "model_architectures.csv"
+    assert ingest_runs(kb / "runs", kb_path, architectures_path) == 2
+    runs = kb_table.load_tuning_run_data(kb_path)
+    assert sorted(runs["experiment_id"]) == ["a/run-1", "b/run-1"]
+    # new KB files start from the packaged ones
+    packaged = kb_table.load_model_architectures(
+        kb_table.KB_DIR / "model_architectures.csv"
+    )
+    archs = kb_table.load_model_architectures(architectures_path)
+    assert set(packaged["model_name"]) < set(archs["model_name"])
@@ -0,0 +1,169 @@
+import json
+
+import numpy as np
+import pytest
+
+from tuning_config_recommender.actions import IR, train
+from tuning_config_recommender.actions.train import (
+    ApplyDistributedTraining,
+    ApplyOptimalBatchSize,
+)
+from tuning_config_recommender.utils.memory_estimator import (
+    GIB,
+    ModelShape,
+    estimate_memory,
+    max_batch_size_that_fits,
+)
+from tuning_config_recommender.utils.strategy_selector import (
+    select_distributed_strategy,
+)
+
+LLAMA_8B = {
+    "model_type": "llama",
+    "hidden_size": 4096,
+    "num_hidden_layers": 32,
+    "num_attention_heads": 32,
+    "num_key_value_heads": 8,
+    "intermediate_size": 14336,
+    "vocab_size": 128256,
+}
+
+
+def test_parameter_count_matches_published_size():
+    assert round(ModelShape.from_config(LLAMA_8B).num_parameters / 1e9, 2) == 8.03
+
+
+def test_sharding_and_lora_reduce_model_state_memory():
+    unsharded = estimate_memory(LLAMA_8B, "full", sharding_strategy="NO_SHARD")
+    sharded = estimate_memory(LLAMA_8B, "full", sharding_degree=8)
+    lora = estimate_memory(LLAMA_8B, "lora", sharding_degree=8)
+    assert unsharded.optimizer_states == 8 * sharded.optimizer_states
+    assert sharded.total < unsharded.total
+    assert lora.optimizer_states < sharded.optimizer_states / 10
+
+
+def test_checkpointing_trades_activation_memory_for_batch_size():
+    with_checkpointing = max_batch_size_that_fits(
+        LLAMA_8B, 80 * GIB, seq_len=4096, sharding_degree=8
+    )
+    without_checkpointing = max_batch_size_that_fits(
+        LLAMA_8B,
+        80 * GIB,
+        seq_len=4096,
+        sharding_degree=8,
+        gradient_checkpointing=False,
+    )
+    assert with_checkpointing > without_checkpointing >= 1
+    # full fine tuning of 8B without sharding does not fit on a single GPU
+    assert (
+        max_batch_size_that_fits(
+            LLAMA_8B, 80 * GIB, seq_len=4096, sharding_strategy="NO_SHARD"
+        )
+        == 0
+    )
+
+
+def test_batch_sizes_are_vectorized_over_configurations():
+    batch_sizes = max_batch_size_that_fits(
+        LLAMA_8B,
+        80 * GIB,
+        seq_len=np.array([1024, 2048, 4096]),
+        sharding_degree=8,
+    )
+    assert batch_sizes.shape == (3,)
+    assert np.all(np.diff(batch_sizes) <= 0)
+
+
+@pytest.mark.parametrize(
+    "tuning_strategy,num_nodes,num_gpus_per_node,expected",
+    [
+        ("lora", 1, 8, "DDP"),
+        ("full", 1, 8, "SHARD_GRAD_OP"),
+        ("full", 1, 1, "FULL_SHARD_OFFLOAD"),
+    ],
+)
+def test_strategy_selector_shards_only_as_much_as_needed(
+    tuning_strategy, num_nodes, num_gpus_per_node, expected
+):
+    selection = select_distributed_strategy(
+        LLAMA_8B,
+        num_nodes,
+        num_gpus_per_node,
+        80 * GIB * 0.9,
+        tuning_strategy=tuning_strategy,
+    )
+    assert selection["strategy"] == expected
+    assert selection["fits"]
+    assert selection["fsdp_offload_params"] == (expected == "FULL_SHARD_OFFLOAD")
+    assert (
+        selection["distributed_type"]
+        == {
+            "DDP": "MULTI_GPU",
+            "SHARD_GRAD_OP": "FSDP",
+            "FULL_SHARD_OFFLOAD": "FSDP",
+        }[expected]
+    )
+    assert all(gib > 80 * 0.9 for gib in selection["rejected"].values())
+
+
+def test_strategy_selector_prefetches_less_when_memory_is_tight():
+    roomy = select_distributed_strategy(LLAMA_8B, 1, 8, 80 * GIB)
+    tight = select_distributed_strategy(
+        LLAMA_8B, 1, 8, (roomy["memory_gib"] + 0.1) * GIB
+    )
+    assert roomy["fsdp_forward_prefetch"]
+    assert roomy["fsdp_backward_prefetch"] == "BACKWARD_PRE"
+    assert tight["strategy"] == roomy["strategy"]
+    assert not tight["fsdp_forward_prefetch"]
+    assert tight["fsdp_backward_prefetch"] == "BACKWARD_POST"
+
+
+def test_ddp_drops_fsdp_config_of_the_input(tmp_path):
+    (tmp_path / "config.json").write_text(json.dumps(LLAMA_8B))
+    ir = IR(
+        tuning_config={"model_name_or_path": str(tmp_path), "tuning_strategy": "lora"},
+        compute_config={"num_nodes": 1, "num_gpus_per_node": 8},
+        accelerate_config={
+            "distributed_type": "FSDP",
+            "fsdp_config": {"fsdp_sharding_strategy": "FULL_SHARD"},
+        },
+    )
+    ir.update(ApplyDistributedTraining().apply(ir, []))
+    assert ir.accelerate_config["distributed_type"] == "MULTI_GPU"
+    assert ir.accelerate_config["fsdp_config"] is None
+
+
+@pytest.mark.parametrize(
+    "gpu_memory_gb,gradient_checkpointing,batch_size",
+    # on 40GB only a single sample fits without checkpointing, 7 fit with it
+    [(40, True, 7), (80, False, 4)],
+)
+def test_checkpointing_is_kept_when_its_larger_batch_is_faster(
+    tmp_path, monkeypatch, gpu_memory_gb, gradient_checkpointing, batch_size
+):
+    (tmp_path / "config.json").write_text(json.dumps(LLAMA_8B))
+    monkeypatch.setattr(train, "use_kb_for_batch_size", lambda _: {})
+    ir = IR(
+        tuning_config={
+            "model_name_or_path": str(tmp_path),
+            "tuning_strategy": "full",
+            "max_seq_length": 2048,
+            "gradient_checkpointing": True,
+        },
+        compute_config={
+            "num_nodes": 1,
+            "num_gpus_per_node": 8,
+            "gpu_memory_gb": gpu_memory_gb,
+        },
+        accelerate_config={
+            "distributed_type": "FSDP",
+            "fsdp_config": {"fsdp_sharding_strategy": "FULL_SHARD"},
+        },
+    )
+    patch = ApplyOptimalBatchSize().apply(ir, [])
+    assert patch.tuning_config["per_device_train_batch_size"] == batch_size
+    assert (
+        patch.tuning_config.get("gradient_checkpointing", True)
+        == gradient_checkpointing
+    )
+    assert "Gradient checkpointing is" in str(patch.comment)
@@ -0,0 +1,72 @@
+import pytest
+
+from tuning_config_recommender.metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    Registry,
+    cache_lookup,
+    record_miss,
+)
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ("path",), registry=registry)
+    depth = Gauge("depth", "Queue depth", registry=registry)
+    latency = Histogram(
+        "latency_seconds", "Latency", ("stage",), buckets=(0.1, 1), registry=registry
+    )
+    requests.inc(path='/a"b')
+    requests.inc(2, path='/a"b')
+    depth.set_function(lambda: 3)
+    latency.observe(0.05, stage="x")
+    latency.observe(0.5, stage="x")
+    latency.observe(5, stage="x")
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{path="/a\\"b"} 3.0' in lines
+    assert "depth 3.0" in lines
+    assert 'latency_seconds_bucket{stage="x",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="x",le="1.0"} 2' in lines
+    assert 'latency_seconds_bucket{stage="x",le="+Inf"} 3' in lines
+    assert 'latency_seconds_sum{stage="x"} 5.55' in lines
+    assert 'latency_seconds_count{stage="x"} 3' in lines
+    with pytest.raises(ValueError):
+        requests.inc(status=200)
+
+
+def _metrics(registry):
+    return (
+        Counter("hits_total", "Hits", ("cache",), registry=registry),
+        Histogram("stage_seconds", "Stages", ("stage",), registry=registry),
+    )
+
+
+def test_drained_samples_merge_into_another_registry():
+    worker, server = Registry(), Registry()
+    worker_hits, worker_stages = _metrics(worker)
+    server_hits, server_stages = _metrics(server)
+    worker_hits.inc(cache="dataset")
+    worker_stages.observe(0.2, stage="render")
+    server_stages.observe(0.3, stage="render")
+
+    server.merge(worker.drain())
+    assert server_hits.value(cache="dataset") == 1
+    assert server_stages.count(stage="render") == 2
+    # drained values are not merged twice
+    server.merge(worker.drain())
+    assert server_hits.value(cache="dataset") == 1
+
+
+def test_cache_lookup_counts_hits_and_misses(monkeypatch):
+    from tuning_config_recommender import metrics
+
+    lookups = Counter("lookups_total", "", ("cache", "result"), registry=None)
+    monkeypatch.setattr(metrics, "CACHE_LOOKUPS", lookups)
+    with cache_lookup("dataset"):
+        record_miss()
+    with cache_lookup("dataset"):
+        pass
+    assert lookups.value(cache="dataset", result="miss") == 1
+    assert lookups.value(cache="dataset", result="hit") == 1
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+
+import pytest
+
+from tuning_config_recommender.utils.model_store import ModelMetadataStore
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    for name, hidden_size in [("org/model-a", 1024), ("org/model-b", 2048)]:
+        model_dir = tmp_path / "mirror" / name
+        model_dir.mkdir(parents=True)
+        (model_dir / "config.json").write_text(json.dumps({"hidden_size": hidden_size}))
+        (model_dir / "tokenizer_config.json").write_text(
+            json.dumps({"chat_template": "{{ messages }}"})
+        )
+    return tmp_path / "mirror"
+
+
+def test_offline_lookup_from_mirror_shares_blobs(tmp_path, mirror):
+    store = ModelMetadataStore(tmp_path / "store", mirror_dir=mirror, offline=True)
+    path_a = store.get("org/model-a")
+    path_b = store.get("org/model-b")
+
+    assert path_a.endswith(os.path.join("org", "model-a", "main"))
+    assert json.load(open(os.path.join(path_a, "config.json"))) == {"hidden_size": 1024}
+    # identical tokenizer configs are stored once and hardlinked into both refs
+    stat_a = os.stat(os.path.join(path_a, "tokenizer_config.json"))
+    stat_b = os.stat(os.path.join(path_b, "tokenizer_config.json"))
+    assert stat_a.st_ino == stat_b.st_ino
+    assert store.get("org/model-a") == path_a
+
+
+def test_offline_lookup_of_unknown_model_fails(tmp_path, mirror):
+    store = ModelMetadataStore(tmp_path / "store", mirror_dir=mirror, offline=True)
+    with pytest.raises(FileNotFoundError):
+        store.get("org/unknown")
+
+
+def test_concurrent_lookups_fetch_once(tmp_path, mirror):
+    store = ModelMetadataStore(tmp_path / "store", mirror_dir=mirror, offline=True)
+    fetches = []
+    fetch = store._fetch
+
+    def counting_fetch(*args):
+        fetches.append(args)
+        fetch(*args)
+
+    store._fetch = counting_fetch
+    threads = [
+        threading.Thread(target=store.get, args=("org/model-a",)) for _ in range(8)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(fetches) == 1
+
+
+def test_least_recently_used_models_are_evicted(tmp_path, mirror):
+    store = ModelMetadataStore(
+        tmp_path / "store", mirror_dir=mirror, offline=True, max_bytes=1
+    )
+    path_a = store.get("org/model-a")
+    for blob in (tmp_path / "store" / "blobs").rglob("*"):
+        if blob.is_file():
+            os.utime(blob, (0, 0))
+    os.utime(path_a, (0, 0))
+    path_b = store.get("org/model-b")
+    assert not os.path.exists(path_a)
+    assert os.path.exists(os.path.join(path_b, "config.json"))
+
+
+def test_model_facts_are_parsed_once_per_file_version(tmp_path, mirror, monkeypatch):
+    from tuning_config_recommender.utils import model_facts
+
+    store = ModelMetadataStore(tmp_path / "store", mirror_dir=mirror, offline=True)
+    path = store.get("org/model-a")
+    reads = []
+    read_json = model_facts._read_json
+    monkeypatch.setattr(
+        model_facts, "_read_json", lambda p: reads.append(p) or read_json(p)
+    )
+
+    facts = model_facts.get_model_facts(path)
+    assert model_facts.get_model_facts(path) is facts
+    assert facts.chat_template == "{{ messages }}"
+    assert not facts.is_moe
+    assert len(reads) == 2
+
+    config = os.path.join(path, "config.json")
+    os.unlink(config)
+    with open(config, "w") as f:
+        json.dump({"model_type": "granitemoe", "num_local_experts": 40}, f)
+    os.utime(config, ns=(1, 1))
+    facts = model_facts.get_model_facts(path)
+    assert facts.is_moe and facts.num_experts == 40
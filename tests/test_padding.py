@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from tuning_config_recommender.actions import ApplyPaddingStrategy
+from tuning_config_recommender.adapters import FMSAdapter
+from tuning_config_recommender.testing import generate_records
+from tuning_config_recommender.utils import data_processing
+from tuning_config_recommender.utils.padding_estimator import (
+    estimate_padding_modes,
+    estimate_sample_lengths,
+    probe_dataset,
+)
+
+
+def test_sample_lengths_of_text_chat_and_tokenized_records():
+    lengths = estimate_sample_lengths(
+        [
+            {"instruction": "a" * 40, "response": "b" * 40},
+            {"messages": [{"role": "user", "content": "c" * 40}] * 2},
+            {"instruction": "short", "response": ""},
+        ]
+    )
+    np.testing.assert_array_equal(lengths, [20, 28, 2])
+    assert estimate_sample_lengths([{"input_ids": [1, 2, 3]}]).tolist() == [3]
+
+
+def test_padding_modes_follow_length_distribution():
+    rng = np.random.default_rng(0)
+    short = estimate_padding_modes(rng.integers(50, 1000, 1000), 4096, 4)
+    assert short["padded"]["padding_fraction"] > 0.3
+    assert short["padding_free"]["padding_fraction"] == 0
+    assert (
+        short["packing"]["relative_throughput"]
+        > short["padding_free"]["relative_throughput"]
+        > 1
+    )
+    full = estimate_padding_modes(np.full(1000, 5000), 4096, 4)
+    assert full["padded"]["relative_throughput"] == 1
+    assert full["packing"]["relative_throughput"] == 1
+    # long samples leave little to pack while packed chunks attend further
+    long = estimate_padding_modes(rng.integers(2500, 4096, 1000), 4096, 1)
+    assert long["packing"]["steps"] < long["padding_free"]["steps"]
+    assert (
+        long["packing"]["relative_throughput"]
+        < long["padding_free"]["relative_throughput"]
+        * ApplyPaddingStrategy.MIN_PACKING_GAIN
+    )
+
+
+@pytest.mark.parametrize("name", ["train.jsonl", "train.csv", "train.parquet"])
+def test_probe_reads_the_start_of_large_datasets_only(dataset, monkeypatch, name):
+    path = dataset(name, num_samples=500)
+
+    def _full_load(*args):
+        raise AssertionError("the dataset should not be loaded fully")
+
+    monkeypatch.setattr(data_processing, "_load_training_data", _full_load)
+    probe = probe_dataset(path, max_records=40)
+    assert probe["num_samples"] == len(probe["lengths"]) == 40
+
+
+@pytest.mark.parametrize(
+    "min_words,max_words,max_seq_length,mode",
+    [(8, 64, 8192, "packing"), (900, 1000, 2048, "padding_free")],
+)
+def test_adapter_recommends_packing_for_short_samples_only(
+    hub, estimator, dataset, tmp_path, min_words, max_words, max_seq_length, mode
+):
+    result = FMSAdapter(base_dir=tmp_path / "out").execute(
+        tuning_config={
+            "model_name_or_path": "ibm-granite/granite-3.1-8b-base",
+            "training_data_path": dataset(min_words=min_words, max_words=max_words),
+            "tuning_strategy": "lora",
+            "max_seq_length": max_seq_length,
+        },
+        compute_config={},
+        accelerate_config={},
+        data_config={},
+        unique_tag=mode,
+        paths={},
+    )
+    tuning_config = result["dict_payload"]["step_config_section"]["tuning_config"]
+    if mode == "packing":
+        # same string value as the packing default of the knowledge base
+        assert tuning_config["packing"] == "True"
+        assert "padding_free" not in tuning_config
+    else:
+        assert tuning_config["padding_free"] == "huggingface"
+        assert tuning_config.get("packing", "False") == "False"
+    assert any(
+        f"{mode} is expected to be" in p["comment"]
+        for p in result["serializable_patches"]
+    )
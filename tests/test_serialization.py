@@ -0,0 +1,62 @@
+from enum import Enum
+
+import numpy as np
+import pytest
+
+from tuning_config_recommender.actions import IR, Action, Comment
+from tuning_config_recommender.rule_engine import RuleEngine
+from tuning_config_recommender.utils.serialization import (
+    check_include,
+    dumps,
+    loads,
+    serialize_patches,
+    to_jsonable,
+)
+
+
+class _Mode(Enum):
+    FULL = "full"
+
+
+def test_to_jsonable_converts_in_one_walk():
+    ir = IR(tuning_config={"lr": np.float32(0.5), "mode": _Mode.FULL})
+    ir.comment = Comment("note")
+    value = to_jsonable({"ir": ir, "lengths": np.arange(3), 1: (np.int64(2),)})
+    assert value["ir"]["tuning_config"] == {"lr": 0.5, "mode": "full"}
+    assert value["ir"]["comment"] == "note"
+    assert value["lengths"] == [0, 1, 2]
+    assert value["1"] == [2]
+    assert loads(dumps(value)) == value
+
+
+def test_patches_keep_what_include_asks_for():
+    patches = [
+        {
+            "json_patch": [],
+            "json_merge_patch": {},
+            "stage_source_ir": IR(),
+            "comment": Comment("c"),
+        }
+    ]
+    assert set(serialize_patches(patches, include=())[0]) == {"json_patch", "comment"}
+    assert "stage_source_ir" in serialize_patches(patches)[0]
+    with pytest.raises(ValueError):
+        check_include(["everything"])
+
+
+class _SetEpochs(Action):
+    def apply(self, ir, actions_meta):
+        self.skip = True
+        return IR(tuning_config={"num_train_epochs": 1}, comment=Comment("epochs"))
+
+
+def test_rule_engine_keeps_source_irs_when_asked(tmp_path):
+    ir = IR(
+        tuning_config={"model_name_or_path": str(tmp_path), "tuning_strategy": "full"}
+    )
+    for keep in (True, False):
+        engine = RuleEngine(keep_source_irs=keep)
+        engine.register_action(_SetEpochs())
+        engine.apply(ir)
+        patch = engine.actions[0].json_patches_and_comment_wrt_source[-1]
+        assert ("stage_source_ir" in patch) is keep
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tuning_config_recommender.utils.data_processing import load_training_data
+from tuning_config_recommender.utils.single_flight import (
+    AsyncSingleFlight,
+    SingleFlight,
+)
+
+
+def test_concurrent_calls_share_one_result_and_error():
+    flight = SingleFlight()
+    calls = []
+
+    def _slow(value):
+        calls.append(value)
+        time.sleep(0.2)
+        if value == "bad":
+            raise ValueError(value)
+        return [value]
+
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda _: flight.do("a", _slow, "a"), range(8)))
+        errors = [pool.submit(flight.do, "b", _slow, "bad") for _ in range(4)]
+    assert calls.count("a") == 1 and calls.count("bad") == 1
+    assert all(result is results[0] for result in results)
+    for error in errors:
+        with pytest.raises(ValueError):
+            error.result()
+    # nothing is kept once the call finished
+    assert flight.do("a", lambda: "again") == "again"
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_call():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def _slow():
+        calls.append(1)
+        await asyncio.sleep(0.2)
+        return "done"
+
+    async def _callers():
+        first = asyncio.create_task(flight.do("k", _slow))
+        second = asyncio.create_task(flight.do("k", _slow))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        result = await second
+        alone = asyncio.create_task(flight.do("k", _slow))
+        await asyncio.sleep(0.05)
+        alone.cancel()
+        await asyncio.sleep(0.01)
+        return first.cancelled(), result, flight.in_flight
+
+    cancelled, result, in_flight = asyncio.run(_callers())
+    assert cancelled and result == "done"
+    assert len(calls) == 2
+    assert in_flight == 0
+
+
+def test_concurrent_dataset_loads_read_the_file_once(dataset, monkeypatch):
+    from tuning_config_recommender.utils import data_processing
+
+    path = dataset("coalesced.jsonl", num_samples=2000)
+    reads = []
+    extract = data_processing.extract_data_from_general_file
+
+    def _counting_extract(file_path):
+        reads.append(file_path)
+        return extract(file_path)
+
+    monkeypatch.setattr(
+        data_processing, "extract_data_from_general_file", _counting_extract
+    )
+    start = threading.Barrier(4)
+
+    def _load(_):
+        start.wait()
+        return load_training_data(path)
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(_load, range(4)))
+    assert reads == [path]
+    assert all(result is results[0] for result in results)
+    # finished loads are not kept in memory
+    load_training_data(path)
+    assert reads == [path, path]
+
+
+def test_first_record_is_cached_without_loading_the_dataset(dataset, monkeypatch):
+    from tuning_config_recommender.utils import data_processing
+
+    path = dataset("first.jsonl", num_samples=2000)
+
+    def _full_load(*args):
+        raise AssertionError("the dataset should not be loaded fully")
+
+    monkeypatch.setattr(data_processing, "_load_training_data", _full_load)
+    record = data_processing.load_first_record(path)
+    assert {"instruction", "response"} <= set(record)
+    assert data_processing.load_first_record(path) is record
@@ -0,0 +1,104 @@
+import json
+import time
+
+from tuning_config_recommender.actions import IR
+from tuning_config_recommender.adapters import FMSAdapter
+from tuning_config_recommender.sweep import SweepEngine
+from tuning_config_recommender.testing import SYNTHETIC_MODELS
+from tuning_config_recommender.utils import kb_table
+from tuning_config_recommender.utils.memory_estimator import GIB
+
+
+def _ir(tmp_path, **tuning_config):
+    model_dir = tmp_path / "Llama-3.1-8B" / "main"
+    model_dir.mkdir(parents=True)
+    (model_dir / "config.json").write_text(
+        json.dumps(SYNTHETIC_MODELS["meta-llama/Llama-3.1-8B"])
+    )
+    return IR(
+        tuning_config={
+            "model_name_or_path": str(model_dir),
+            "tuning_strategy": "full",
+            "max_seq_length": 4096,
+            **tuning_config,
+        },
+        compute_config={"num_nodes": 1, "num_gpus_per_node": 8},
+    )
+
+
+def test_sweep_ranks_feasible_candidates_quickly(tmp_path):
+    ir = _ir(tmp_path, target_global_batch_size=256)
+    engine = SweepEngine(space={"gradient_accumulation_steps": list(range(1, 33))})
+    start = time.perf_counter()
+    candidates = engine.sweep(ir, top_k=2000)
+    assert time.perf_counter() - start < 1
+    assert len(candidates) > 50
+    # accumulation is not maximized, candidates keep the target global batch
+    assert {c["global_batch_size"] for c in candidates} == {256}
+    assert candidates[0]["gradient_accumulation_steps"] < 32
+    throughput = [c["predicted_tokens_per_second"] for c in candidates]
+    assert throughput == sorted(throughput, reverse=True)
+    assert all(c["memory_gib"] <= 80 * 0.9 for c in candidates)
+    # 8B full fine tuning does not fit on a GPU unsharded
+    assert {c["fsdp_sharding_strategy"] for c in candidates} == {
+        "SHARD_GRAD_OP",
+        "FULL_SHARD",
+    }
+    assert candidates[0]["padding"] == "padding_free"
+    assert candidates[0]["fast_kernels"]
+
+    patched = engine.candidate_ir(ir, candidates[0])
+    assert patched.tuning_config["padding_free"] == "huggingface"
+    assert (
+        patched.accelerate_config["fsdp_config"]["fsdp_sharding_strategy"]
+        == (candidates[0]["fsdp_sharding_strategy"])
+    )
+    assert "padding_free" not in ir.tuning_config
+
+
+def test_sweep_is_anchored_at_kb_throughput(tmp_path, monkeypatch):
+    runs = tmp_path / "tuning_run_data.csv"
+    runs.write_text(
+        "model_name,method,model_max_length,per_device_train_batch_size,gpu_model,"
+        "number_gpus,dataset_tokens_per_second\n"
+        "Llama-3.1-8B,full,4096,4,NVIDIA-A100-SXM4-80GB,8,40000\n"
+    )
+    monkeypatch.setattr(kb_table, "TUNING_RUN_DATA_PATH", runs)
+    engine = SweepEngine(
+        space={
+            "per_device_train_batch_size": [4],
+            "gradient_accumulation_steps": [1],
+            "fsdp_sharding_strategy": ["FULL_SHARD"],
+            "gradient_checkpointing": [True],
+            "padding": ["padding_free"],
+            "fast_kernels": [True],
+        }
+    )
+    (candidate,) = engine.sweep(_ir(tmp_path), top_k=5)
+    assert candidate["throughput_source"] == "knowledge base"
+    assert candidate["predicted_tokens_per_second"] == 40000
+    assert candidate["memory_gib"] * GIB > 0
+
+
+def test_adapter_returns_sweep(hub, estimator, dataset, tmp_path):
+    result = FMSAdapter(base_dir=tmp_path / "out").execute(
+        tuning_config={
+            "model_name_or_path": "ibm-granite/granite-3.1-8b-base",
+            "training_data_path": dataset(),
+            "tuning_strategy": "lora",
+        },
+        compute_config={},
+        accelerate_config={},
+        data_config={},
+        unique_tag="sweep",
+        paths={},
+        sweep_top_k=3,
+    )
+    assert len(result["sweep"]) == 3
+    # without a target candidates stay as close to the global batch of the
+    # recommendation as the swept values allow
+    deviations = {
+        abs(c["global_batch_size"] - c["target_global_batch_size"])
+        for c in result["sweep"]
+    }
+    assert len(deviations) == 1